@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import concurrent.futures
+import contextlib
+import getopt
+import gzip
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+# include 3rd party modules
+from colorama import init, Fore
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WORKDIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'static-site', 'bench'
+)
+CASES = ('publish', 'drain', 'deploy', 'report')
+SIZES = '1k,10k,100k'       # files per synthetic site / objects per bucket
+LOG_LINES = '10M'           # lines in the synthetic log corpus
+LINES_PER_LOG = 100000      # lines per synthetic log file
+REGION = 'us-east-1'
+LOG_HEADER = (b'#Version: 1.0\n#Fields: date time x-edge-location sc-bytes '
+    b'c-ip cs-method cs(Host) cs-uri-stem sc-status cs(Referer) '
+    b'cs(User-Agent) cs-uri-query cs(Cookie) x-edge-result-type '
+    b'x-edge-request-id x-host-header cs-protocol cs-bytes time-taken\n')
+
+def main(cases=CASES, sizes=SIZES, log_lines=LOG_LINES, endpoint=None,
+    workdir=WORKDIR, history=None):
+    """Benchmarks the deploy, publish, teardown and report paths offline,
+    against a local AWS stand-in (moto server) instead of real AWS.
+
+    Synthetic sites of each size and a synthetic CloudFront log corpus are
+    generated once into workdir and reused. Every case runs in its own
+    process, so its peak RSS and imports are its own, and records per phase
+    the wall time, AWS API calls, bytes sent and received and peak RSS.
+
+        - publish: cold publish of a site, then a no-change publish
+        - drain: bucket_drain of a versioned bucket (2 versions per key)
+        - deploy: launch_stack, then delete_stack, of a small stack
+        - report: log_fetch, log_report, log_store compaction and a stored
+          range report over the log corpus
+
+    Without an endpoint, a moto server (optional dependency, pip install
+    "moto[server]") is started for the run. Results are appended to the
+    history file (workdir/history.json) with the git version, and compared
+    with the previous run of each phase.
+    """
+    history = history or os.path.join(workdir, 'history.json')
+    os.makedirs(workdir, exist_ok=True)
+
+    server = None
+    if endpoint is None:
+        try:
+            from moto.server import ThreadedMotoServer
+        except ImportError:
+            print(Fore.YELLOW + 'moto is not installed; pip install '
+                '"moto[server]" or pass --endpoint' + Fore.RESET)
+            sys.exit(1)
+        server = ThreadedMotoServer(port=0)
+        server.start()
+        host, port = server.get_host_and_port()
+        endpoint = 'http://{}:{}'.format(host, port)
+
+    runs = []
+    try:
+        for case, size in plan(cases, sizes, log_lines):
+            print(Fore.WHITE + '\n### ' + case + ' ' + human(size) + ' ###' +
+                Fore.RESET)
+            data = prepare(case, size, workdir)
+            phases = run_case(case, size, data, endpoint, workdir)
+            runs += phases
+            for phase in phases:
+                print(format_phase(phase))
+    finally:
+        if server:
+            server.stop()
+
+    entry = {
+        'version': version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'phases': runs
+    }
+    entries = load_history(history)
+    compare(entries, runs)
+    entries.append(entry)
+    with open(history + '.tmp', 'w') as f:
+        json.dump(entries, f, indent=2)
+    os.replace(history + '.tmp', history)
+    print('\nResults appended to ' + history)
+    return entry
+
+def plan(cases, sizes, log_lines):
+    for case in cases:
+        if case == 'report':
+            yield case, parse_size(log_lines)
+        elif case == 'deploy':
+            yield case, 20  # resources in the stack
+        else:
+            for size in sizes.split(','):
+                yield case, parse_size(size)
+
+def parse_size(text):
+    units = {'k': 1000, 'M': 1000000}
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def human(n):
+    for unit, scale in (('M', 1000000), ('k', 1000)):
+        if n >= scale and n % scale == 0:
+            return str(n // scale) + unit
+    return str(n)
+
+def prepare(case, size, workdir):
+    # generated data is kept and reused; its name says what's in it
+    generators = {'publish': ('site-', synthetic_site),
+        'report': ('logs-', synthetic_logs)}
+    if case not in generators:
+        return None
+    prefix, generate = generators[case]
+    path = os.path.join(workdir, prefix + human(size))
+    if not os.path.isdir(path):
+        shutil.rmtree(path + '.tmp', ignore_errors=True)  # interrupted
+        generate(path + '.tmp', size)
+        os.replace(path + '.tmp', path)
+    return path
+
+def synthetic_site(path, files):
+    """Generates a Hugo-like output tree: 60% pages, 15% CSS/JS (some
+    fingerprinted), 25% images, plus a webpack manifest.
+    """
+    print('Generating a {} file site in {}...'.format(human(files), path))
+    rng = random.Random(files)
+    words = [''.join(rng.choice('etaoinshrdlu') for _ in range(rng.randint(2,
+        9))) for _ in range(2000)]
+    public = os.path.join(path, 'public')
+    bundles = {}
+
+    def text(n):
+        return ' '.join(rng.choice(words) for _ in range(n))
+
+    for i in range(files):
+        kind = rng.random()
+        if kind < 0.6:
+            key = 'post/{}/{}/index.html'.format(i % 97, i)
+            body = ('<html><head><title>' + text(6) + '</title></head><body>'
+                '<p>' + text(rng.randint(200, 900)) + '</p></body></html>'
+                ).encode()
+        elif kind < 0.75:
+            ext = rng.choice(('css', 'js'))
+            if i % 3:
+                key = '{}/{}.{:010x}.{}'.format(ext, i, rng.getrandbits(40),
+                    ext)
+                bundles[str(i) + '.' + ext] = '/' + key
+            else:
+                key = '{}/{}.{}'.format(ext, i, ext)
+            body = ('.' + text(rng.randint(100, 3000)) + ' {}\n').encode()
+        else:
+            key = 'img/{}/{}.png'.format(i % 31, i)
+            body = os.urandom(rng.randint(1024, 8192))
+        full = os.path.join(public, key)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, 'wb') as f:
+            f.write(body)
+
+    os.makedirs(os.path.join(path, 'data'), exist_ok=True)
+    with open(os.path.join(path, 'data', 'manifest.json'), 'w') as f:
+        json.dump(bundles, f)
+
+def synthetic_logs(path, lines):
+    """Generates gzipped W3C CloudFront access logs of LINES_PER_LOG lines,
+    spread over 30 days, with a long-tailed path distribution.
+    """
+    print('Generating {} log lines in {}...'.format(human(lines), path))
+    os.makedirs(path, exist_ok=True)
+    files = -(-lines // LINES_PER_LOG)
+    with concurrent.futures.ProcessPoolExecutor() as pool:
+        list(pool.map(write_log, [path] * files, [lines] * files,
+            range(files)))
+
+def write_log(path, lines, index):
+    rng = random.Random(index)
+    day = '2026-09-{:02d}'.format(1 + index % 30)
+    edges = ['IAD89-C1', 'LHR62-C2', 'NRT57-C3', 'SFO5-C1', 'FRA2-C1']
+    results = ['Hit'] * 7 + ['RefreshHit', 'Miss', 'Miss', 'Error']
+    rows = []
+    for _ in range(min(LINES_PER_LOG, lines - index * LINES_PER_LOG)):
+        uri = '/post/{}/'.format(int(rng.paretovariate(1.2)) % 5000)
+        rows.append('\t'.join((
+            day, '12:00:00', rng.choice(edges),
+            str(rng.randint(300, 60000)), '192.0.2.1', 'GET',
+            'd111111abcdef8.cloudfront.net', uri,
+            rng.choice(('200', '200', '200', '304', '404')), '-', '-', '-',
+            '-', rng.choice(results), 'x', 'example.com', 'https', '400',
+            '{:.3f}'.format(rng.lognormvariate(-3, 1))
+        )))
+    name = 'E2BENCH.{}-{:02d}.{:08x}.gz'.format(day, index % 24, index)
+    with gzip.open(os.path.join(path, name), 'wb', 1) as f:
+        f.write(LOG_HEADER + '\n'.join(rows).encode() + b'\n')
+
+def run_case(case, size, data, endpoint, workdir):
+    # each case gets a fresh process; it writes its phases to out
+    out = os.path.join(workdir, 'case.json')
+    env = dict(os.environ,
+        AWS_ENDPOINT_URL=endpoint,
+        AWS_ACCESS_KEY_ID='testing',
+        AWS_SECRET_ACCESS_KEY='testing',
+        AWS_DEFAULT_REGION=REGION,
+        XDG_CACHE_HOME=os.path.join(workdir, 'cache')  # resolver's cache
+    )
+    env.pop('AWS_PROFILE', None)
+    subprocess.run([sys.executable, os.path.abspath(__file__), '--run',
+        case, str(size), data or '', out], env=env, check=True)
+    with open(out) as f:
+        return json.load(f)
+
+def run(case, size, data, out):
+    """Runs one case in this process (see run_case)."""
+    import boto3
+
+    meter = Meter()
+    boto3.setup_default_session()
+    boto3.DEFAULT_SESSION.events.register('before-send', meter.sent)
+    boto3.DEFAULT_SESSION.events.register('response-received',
+        meter.received)
+    s3 = boto3.client('s3')
+    name = 'bench-{}-{}'.format(case, int(time.time() * 1000))
+
+    if case == 'publish':
+        sys.path.append(os.path.join(HERE, 'build', 'build'))
+        import publish
+        for bucket in (name, 'log.' + name):
+            s3.create_bucket(Bucket=bucket)
+        public = os.path.join(data, 'public')
+        cache_dir = os.path.join(os.path.dirname(out), 'publish-cache')
+        shutil.rmtree(cache_dir, ignore_errors=True)  # a cold publish
+        with meter.phase('publish-' + human(size)):
+            publish.main(public, name, cache_dir=cache_dir)
+        with meter.phase('publish-noop-' + human(size)):
+            publish.main(public, name, cache_dir=cache_dir)
+
+    elif case == 'drain':
+        import bucket_drain
+        s3.create_bucket(Bucket=name)
+        s3.put_bucket_versioning(Bucket=name,
+            VersioningConfiguration={'Status': 'Enabled'})
+        keys = ['logs/E2BENCH.{:08d}.gz'.format(i) for i in range(size // 2)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=32) as pool:
+            for _ in range(2):
+                list(pool.map(lambda k: s3.put_object(Bucket=name, Key=k,
+                    Body=b'x'), keys))
+        with meter.phase('drain-' + human(size)):
+            bucket_drain.main([name], region=REGION)
+
+    elif case == 'deploy':
+        import deploy
+        tpl = os.path.join(os.path.dirname(out), 'bench.cfn.json')
+        with open(tpl, 'w') as f:
+            json.dump({'Resources': {
+                'Bucket' + str(i): {'Type': 'AWS::S3::Bucket'}
+                for i in range(size)
+            }}, f)
+        cf = boto3.client('cloudformation', region_name=REGION)
+        with meter.phase('deploy-launch'):
+            deploy.launch_stack(cf, tpl, [], name, REGION)
+        with meter.phase('deploy-delete'):
+            deploy.delete_stack(cf, name)
+
+    elif case == 'report':
+        sys.path.append(os.path.join(HERE, 'build', 'bin'))
+        import log_fetch
+        import log_report
+        import log_store
+        s3.create_bucket(Bucket=name)
+        logs = sorted(os.listdir(data))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=16) as pool:
+            list(pool.map(lambda n: s3.upload_file(os.path.join(data, n),
+                name, 'logs/' + n), logs))
+        site_log = os.path.join(os.path.dirname(out), 'site-log')
+        shutil.rmtree(site_log, ignore_errors=True)
+        label = human(size)
+        with meter.phase('report-fetch-' + label):
+            paths = log_fetch.main(name, site_log)
+        with meter.phase('report-' + label):
+            log_report.main(site_log, log_fetch.lines(paths))
+        with meter.phase('report-compact-' + label):
+            log_store.compact(site_log, paths)
+        with meter.phase('report-range-' + label):
+            log_store.report(site_log, '2026-09-01', '2026-09-30')
+
+    with open(out, 'w') as f:
+        json.dump(meter.phases, f)
+
+class Meter:
+    """Counts AWS API calls and bytes through botocore events, and times
+    phases of a case.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.sent_bytes = 0
+        self.received_bytes = 0
+        self.phases = []
+
+    def sent(self, request, **kwargs):
+        size = request.headers.get('Content-Length')
+        if size is None and isinstance(request.body, bytes):
+            size = len(request.body)
+        with self.lock:
+            self.calls += 1
+            self.sent_bytes += int(size or 0)
+
+    def received(self, response_dict=None, **kwargs):
+        headers = (response_dict or {}).get('headers', {})
+        with self.lock:
+            self.received_bytes += int(headers.get('content-length', 0))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        calls, sent, received = (self.calls, self.sent_bytes,
+            self.received_bytes)
+        start = time.perf_counter()
+        yield
+        self.phases.append({
+            'phase': name,
+            'seconds': round(time.perf_counter() - start, 3),
+            'calls': self.calls - calls,
+            'sent': self.sent_bytes - sent,
+            'received': self.received_bytes - received,
+            'peak_rss': peak_rss()
+        })
+
+def peak_rss():
+    # peak of this process or its largest worker process, in bytes
+    scale = 1 if sys.platform.startswith('darwin') else 1024  # Linux: KiB
+    return scale * max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+
+def format_phase(phase):
+    return '{:<26}{:>9.2f}s{:>9} calls{:>10} sent{:>10} received{:>10} ' \
+        'rss'.format(phase['phase'], phase['seconds'], phase['calls'],
+        human_bytes(phase['sent']), human_bytes(phase['received']),
+        human_bytes(phase['peak_rss']))
+
+def human_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024 or unit == 'GB':
+            return '{:.0f}{}'.format(n, unit)
+        n /= 1024
+
+def compare(entries, runs):
+    # wall time and API calls against the last run of the same phase
+    previous = {}
+    for entry in entries:
+        for phase in entry['phases']:
+            previous[phase['phase']] = (entry['version'], phase)
+    if not previous:
+        return
+
+    print(Fore.WHITE + '\nCompared with the previous run:' + Fore.RESET)
+    for phase in runs:
+        if phase['phase'] not in previous:
+            continue
+        ver, old = previous[phase['phase']]
+        change = (phase['seconds'] - old['seconds']) / max(old['seconds'],
+            0.001)
+        color = Fore.RED if change > 0.1 else \
+            Fore.GREEN if change < -0.1 else ''
+        print('{:<26}{}{:>+8.0%}{} time, {:+} calls (vs {})'.format(
+            phase['phase'], color, change, Fore.RESET,
+            phase['calls'] - old['calls'], ver))
+
+def load_history(path):
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+def version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always',
+            '--dirty'], cwd=HERE, universal_newlines=True,
+            stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def usage():
+    print('Usage: bench.py [--case publish,drain,deploy,report] '
+        '[--sizes 1k,10k,100k] [--log-lines 10M] [--endpoint URL] '
+        '[--workdir DIR] [--history FILE]')
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        run(sys.argv[2], int(sys.argv[3]), sys.argv[4], sys.argv[5])
+        sys.exit(0)
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'c:s:l:e:w:H:h',
+            ['case=', 'sizes=', 'log-lines=', 'endpoint=', 'workdir=',
+            'history=', 'help'])
+    except getopt.error as err:
+        print(err)
+        usage()
+        sys.exit(1)
+
+    kwargs = {}
+    for opt, val in opts:
+        if opt in ('-c', '--case'):
+            kwargs['cases'] = val.split(',')
+        elif opt in ('-s', '--sizes'):
+            kwargs['sizes'] = val
+        elif opt in ('-l', '--log-lines'):
+            kwargs['log_lines'] = val
+        elif opt in ('-e', '--endpoint'):
+            kwargs['endpoint'] = val
+        elif opt in ('-w', '--workdir'):
+            kwargs['workdir'] = val
+        elif opt in ('-H', '--history'):
+            kwargs['history'] = val
+        elif opt in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    main(**kwargs)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import concurrent.futures
+import os
+import random
+import sys
+import threading
+import time
+
+# include 3rd party modules
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from colorama import init, Fore
+
+# key characters a truncated listing is split on; keys with anything else
+# there are picked up by the final sweep
+FANOUT = '!-.0123456789=ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+SPLIT_DEPTH = 2         # how many times a listing is split again
+RETRY_CODES = ('SlowDown', 'InternalError', 'ServiceUnavailable',
+    'RequestTimeout')
+MAX_RETRIES = 8
+
+def main(buckets, region=None, workers=32, echo=print, interval=5):
+    """Empties S3 buckets so CloudFormation can delete them, draining all
+    of them at once through one thread pool.
+
+    Every object version and delete marker is removed, so versioned buckets
+    empty too. Each bucket's listing is split on top-level prefixes and,
+    when a listing runs past one page, on the key characters past the
+    prefix the page's keys share, so large buckets are listed in parallel
+    even when every key starts the same (CloudFront logs are all
+    logs/<distribution id>.<date>...; they split on the date).
+    Deletes go out as 1000-key delete_objects batches; throttled keys are
+    retried with exponential backoff and jitter. A final sweep of each
+    bucket removes anything the partitioned listings missed.
+
+    Progress and throughput are reported through echo every interval
+    seconds. Returns {bucket: objects deleted}.
+    """
+    s3 = boto3.client('s3', region_name=region, config=Config(
+        max_pool_connections=workers * 2,
+        retries={'max_attempts': 10}
+    ))
+    buckets = [b for b in buckets if exists(s3, b)]
+    if not buckets:
+        return {}
+
+    deleted = {b: 0 for b in buckets}
+    errors = []
+    cond = threading.Condition()
+    outstanding = [0]
+
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    def submit(fn, *args):
+        with cond:
+            outstanding[0] += 1
+        pool.submit(run, fn, *args)
+
+    def run(fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            with cond:
+                outstanding[0] -= 1
+                cond.notify_all()
+
+    def delete_batch(bucket, objects):
+        attempt = 0
+        while objects:
+            response = s3.delete_objects(Bucket=bucket, Delete={
+                'Objects': objects,
+                'Quiet': True
+            })
+            failed = response.get('Errors', [])
+            with cond:
+                deleted[bucket] += len(objects) - len(failed)
+            retry = [
+                {'Key': e['Key'], 'VersionId': e['VersionId']}
+                if e.get('VersionId') else {'Key': e['Key']}
+                for e in failed if e['Code'] in RETRY_CODES
+            ]
+            if len(retry) < len(failed):
+                raise RuntimeError(bucket + ': ' + failed[0]['Key'] + ' => '
+                    + failed[0]['Message'])
+            attempt += 1
+            if retry and attempt > MAX_RETRIES:
+                raise RuntimeError(bucket + ': gave up on ' +
+                    str(len(retry)) + ' throttled keys')
+            if retry:
+                time.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1))
+            objects = retry
+
+    def list_partition(bucket, prefix, depth, key_marker=None,
+        version_marker=None):
+        kwargs = {'Bucket': bucket, 'Prefix': prefix}
+        while True:
+            if key_marker:
+                kwargs['KeyMarker'] = key_marker
+                if version_marker:
+                    kwargs['VersionIdMarker'] = version_marker
+            response = s3.list_object_versions(**kwargs)
+            objects = versions(response)
+            if objects:
+                submit(delete_batch, bucket, objects)
+            if not response.get('IsTruncated'):
+                return
+
+            key_marker = response['NextKeyMarker']
+            version_marker = response.get('NextVersionIdMarker')
+            if depth >= SPLIT_DEPTH or len(key_marker) <= len(prefix):
+                continue
+
+            # keys past the marker differ from it at some character: split
+            # on every character up to the end of the prefix the page's keys
+            # share (splitting on the next one only would leave all logs on
+            # one listing); what still matches the marker past that shared
+            # prefix carries on from the marker
+            first = objects[0]['Key'] if objects else key_marker
+            common = len(os.path.commonprefix([first, key_marker]))
+            for i in range(len(prefix), min(common + 1, len(key_marker))):
+                for c in FANOUT:
+                    if c > key_marker[i]:
+                        submit(list_partition, bucket, key_marker[:i] + c,
+                            depth + 1)
+            submit(list_partition, bucket, key_marker[:common + 1],
+                depth + 1, key_marker, version_marker)
+            return
+
+    def start(bucket):
+        # top-level "directories" (e.g. logs/) become their own partitions
+        response = s3.list_object_versions(Bucket=bucket, Delimiter='/')
+        if response.get('IsTruncated'):
+            # too many to enumerate here; fan out on key characters instead
+            submit(list_partition, bucket, '', 0)
+            return
+        prefixes = [p['Prefix'] for p in response.get('CommonPrefixes', [])]
+        for prefix in prefixes:
+            submit(list_partition, bucket, prefix, 0)
+        objects = versions(response)
+        if objects:
+            submit(delete_batch, bucket, objects)
+
+    def sweep(bucket):
+        while True:
+            response = s3.list_object_versions(Bucket=bucket)
+            objects = versions(response)
+            if not objects:
+                return
+            delete_batch(bucket, objects)
+
+    started = time.monotonic()
+    echo(Fore.GREEN + 'Emptying buckets: ' + ', '.join(buckets) + Fore.RESET)
+
+    for phase in (start, sweep):
+        for bucket in buckets:
+            submit(phase, bucket)
+        last = time.monotonic()
+        with cond:
+            while outstanding[0]:
+                cond.wait(0.5)
+                if time.monotonic() - last >= interval:
+                    last = time.monotonic()
+                    echo(progress(deleted, started))
+        if errors:
+            break
+
+    pool.shutdown()
+
+    if errors:
+        raise RuntimeError('Failed to empty buckets: ' + str(errors[0]))
+
+    echo(Fore.GREEN + 'Emptied buckets: ' + progress(deleted, started) +
+        Fore.RESET)
+    return deleted
+
+def exists(s3, bucket):
+    try:
+        s3.head_bucket(Bucket=bucket)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchBucket'):
+            return False
+        raise
+    return True
+
+def versions(response):
+    # unversioned objects are listed with version id "null"
+    return [
+        {'Key': v['Key'], 'VersionId': v['VersionId']}
+        for v in response.get('Versions', []) +
+            response.get('DeleteMarkers', [])
+    ]
+
+def progress(deleted, started):
+    total = sum(deleted.values())
+    rate = total / max(time.monotonic() - started, 0.001)
+    return '{:,} objects deleted ({:,.0f}/s): '.format(total, rate) + \
+        ', '.join(b + ' {:,}'.format(n) for b, n in deleted.items())
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: bucket_drain.py bucket [bucket ...]')
+        sys.exit(1)
+    main(sys.argv[1:])
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+
+# include 3rd party modules
+from colorama import init, Fore
+
+# include custom modules
+import task_graph
+
+STATE = 'build/.build-state.json'
+
+# stage => inputs, outputs (relative to site source), command, dependencies;
+# images optimizes the images webpack copies to static/img in place, hugo
+# reads the static/ and data/ output of both, and budget checks hugo's output
+STAGES = {
+    'webpack': {
+        'inputs': ['build/assets', 'build/webpack.config.js',
+            'build/package.json', 'build/yarn.lock'],
+        'outputs': ['static', 'data'],
+        'cwd': 'build',
+        'cmd': 'yarn build',
+        'clean': True,  # old bundle hashes would otherwise linger
+        'deps': []
+    },
+    'images': {
+        'inputs': ['static/img', 'build/images.py'],
+        'outputs': ['static/img'],
+        'cwd': '.',
+        'cmd': 'python3 build/images.py static/img',
+        'clean': False,
+        'deps': ['webpack']
+    },
+    'hugo': {
+        'inputs': ['archetypes', 'config.toml', 'content', 'data', 'layouts',
+            'static', 'themes'],
+        'outputs': ['public'],
+        'cwd': '.',
+        'cmd': 'hugo --cleanDestinationDir',
+        'clean': False,
+        'deps': ['webpack', 'images']
+    },
+    'budget': {
+        'inputs': ['public', 'build/budget.py', 'build/budget.json'],
+        'outputs': [],
+        'cwd': '.',
+        'cmd': 'python3 build/budget.py public',
+        'clean': False,
+        'deps': ['hugo']
+    }
+}
+
+def main(site_src, force=False, stages=STAGES):
+    """Builds the site, skipping stages whose inputs haven't changed since
+    their last successful run.
+
+    Each stage's inputs are fingerprinted (path, size and mtime of every
+    file, plus the command) and compared with the fingerprint saved after
+    its last run, and so are its outputs as the build left them: a stage
+    reruns when something else rewrote or removed an output, such as the
+    dev server's webpack watcher writing dev bundles to static/. Stages
+    run on a task graph, so independent ones run concurrently. With force,
+    outputs are cleaned and every stage runs.
+
+    Prints per-stage timings and cache hits; returns False if a stage
+    failed.
+    """
+    state_path = os.path.join(site_src, STATE)
+    state = {}
+    if os.path.isfile(state_path) and not force:
+        with open(state_path) as f:
+            state = json.load(f)
+    lock = threading.Lock()
+    ran = {}
+
+    def stage(name, spec):
+        def run():
+            # fingerprint when the stage starts; upstream output is final
+            fingerprint = {
+                'inputs': fingerprint_inputs(site_src, spec),
+                'outputs': fingerprint_outputs(site_src, spec)
+            }
+            outputs = [os.path.join(site_src, o) for o in spec['outputs']]
+            if not force and state.get(name) == fingerprint and \
+                all(os.path.exists(o) for o in outputs):
+                ran[name] = False
+                return
+
+            if spec['clean'] or force:
+                for output in outputs:
+                    shutil.rmtree(output, ignore_errors=True)
+
+            subprocess.run(spec['cmd'], shell=True, check=True,
+                cwd=os.path.join(site_src, spec['cwd']))
+            ran[name] = True
+            with lock:
+                state[name] = {'inputs': fingerprint_inputs(site_src, spec)}
+        return run
+
+    tasks = {
+        name: (stage(name, spec), spec['deps'])
+        for name, spec in stages.items()
+    }
+    results = task_graph.run(tasks)
+
+    # outputs once every stage is done, as later stages may change them
+    # (images rewrites webpack's static/img)
+    for name, result in results.items():
+        if result['status'] == 'ok':
+            state[name]['outputs'] = fingerprint_outputs(site_src,
+                stages[name])
+        else:
+            state.pop(name, None)
+
+    with open(state_path, 'w') as f:
+        json.dump(state, f, indent=2)
+
+    print(Fore.WHITE + '\nBuild Stages:' + Fore.RESET)
+    for name, result in results.items():
+        if result['status'] == 'ok':
+            print(name + Fore.GREEN + ' \u2714 ' +
+                ('built' if ran[name] else 'cached') + Fore.RESET +
+                ' ({:.1f}s)'.format(result['seconds']))
+        elif result['status'] == 'failed':
+            print(name + Fore.RED + ' \u2718 ' + str(result['error']) +
+                Fore.RESET)
+        else:
+            print(name + Fore.YELLOW + ' skipped; depends on a failed stage' +
+                Fore.RESET)
+
+    return all(r['status'] == 'ok' for r in results.values())
+
+def fingerprint_inputs(site_src, spec):
+    return fingerprint(site_src, spec['inputs'], spec['cmd'])
+
+def fingerprint_outputs(site_src, spec):
+    return fingerprint(site_src, spec['outputs'])
+
+def fingerprint(site_src, paths, salt=''):
+    digest = hashlib.sha256(salt.encode())
+    for path in paths:
+        full = os.path.join(site_src, path)
+        files = [full] if os.path.isfile(full) else []
+        for root, dirs, names in os.walk(full):
+            dirs[:] = sorted(d for d in dirs if d != 'node_modules')
+            files += [os.path.join(root, n) for n in names]
+        for name in sorted(files):
+            stat = os.stat(name)
+            digest.update('{}\0{}\0{}\0'.format(
+                os.path.relpath(name, site_src), stat.st_size,
+                stat.st_mtime_ns).encode())
+    return digest.hexdigest()
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import json
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+# include 3rd party modules
+from colorama import init, Fore
+
+STATE = 'build/.dev-server.json'    # relative to site source
+LOG = 'build/.dev-server.log'
+RESTART_BASE = 0.5      # seconds before the first restart, then doubled
+RESTART_CAP = 10        # seconds; longest wait before a restart
+STABLE = 30             # seconds up after which a watcher's backoff resets
+STOP_GRACE = 5          # seconds a watcher gets to exit before SIGKILL
+POLL = 0.2              # seconds between supervisor checks
+SAMPLES = 200           # rebuild latencies kept per watcher
+URL = 'http://localhost:1313'
+
+# watcher => command, working directory and inputs (relative to site
+# source), and the output line that marks a finished (re)build, with the
+# build time the tool itself reports; webpack only runs with --dev-style
+WATCHERS = {
+    'hugo': {
+        'cmd': ['hugo', 'server', '-D'],
+        'cwd': '.',
+        'inputs': ['archetypes', 'config.toml', 'content', 'data', 'layouts',
+            'static', 'themes'],
+        'done': re.compile(r'Total in (\d+(?:\.\d+)?) ?ms'),
+        'style': False
+    },
+    'webpack': {
+        'cmd': ['yarn', 'dev'],
+        'cwd': 'build',
+        'inputs': ['build/assets'],
+        'done': re.compile(r'^\s*Time: (\d+)ms'),
+        'style': True
+    }
+}
+
+def start(site_src, style=False):
+    """Starts the dev server supervisor for site_src, unless one is already
+    running with the watchers asked for; a running one is left as it is,
+    so its watchers stay warm between sessions.
+
+    The supervisor is a detached process (see Supervisor) that owns the
+    hugo server and, with style, the webpack watcher: it restarts them
+    when they exit and records their pids and rebuild metrics in a state
+    file, which status() reads and stop() uses to stop exactly them.
+
+    Returns True if a supervisor was started.
+    """
+    state = load_state(site_src)
+    if running(site_src, state):
+        if style and 'webpack' not in state['watchers']:
+            stop(site_src)  # restarted below with webpack too
+        else:
+            print(Fore.GREEN + 'Dev server already running (pid {}); '
+                'watchers are warm'.format(state['pid']) + Fore.RESET)
+            return False
+    elif state:
+        reap(state)  # watchers orphaned by a supervisor that died
+
+    with open(os.path.join(site_src, LOG), 'a') as log:
+        supervisor = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'supervise',
+                site_src] + (['--style'] if style else []),
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+            start_new_session=True  # outlives this shell session
+        )
+
+    # wait for its state file, so status and stop work right away
+    deadline = time.monotonic() + STOP_GRACE
+    while time.monotonic() < deadline:
+        state = load_state(site_src)
+        if state.get('pid') == supervisor.pid:
+            break
+        time.sleep(POLL)
+    print(Fore.GREEN + 'Dev server started (pid {}): '.format(supervisor.pid) +
+        ', '.join(watchers(style)) + ' on ' + URL + Fore.RESET)
+    return True
+
+def stop(site_src):
+    """Stops the supervisor of site_src and the watchers it started;
+    other hugo or webpack processes on the machine are left alone.
+    """
+    state = load_state(site_src)
+    if not running(site_src, state):
+        if state:
+            reap(state)
+        print(Fore.YELLOW + 'Dev server not running' + Fore.RESET)
+        return False
+
+    os.kill(state['pid'], signal.SIGTERM)
+    deadline = time.monotonic() + STOP_GRACE * 2
+    while alive(state['pid']) and time.monotonic() < deadline:
+        time.sleep(POLL)
+    if alive(state['pid']):
+        os.kill(state['pid'], signal.SIGKILL)
+    reap(load_state(site_src))
+    print(Fore.YELLOW + '- Dev server stopped: ' + ', '.join(
+        state['watchers']) + Fore.RESET)
+    return True
+
+def status(site_src):
+    """Prints whether the supervisor and each watcher are up, their
+    restarts, and rebuild latency: from the newest input file change to
+    the finished rebuild, and the build time the tool reports.
+    """
+    state = load_state(site_src)
+    now = time.time()
+    if not running(site_src, state):
+        print(Fore.YELLOW + '\nDev server not running' + Fore.RESET)
+        if not state:
+            return
+    else:
+        print(Fore.WHITE + '\nDev server: pid {}, up {} on {}'.format(
+            state['pid'], duration(now - state['started']), URL) + Fore.RESET)
+
+    for name, w in state['watchers'].items():
+        if w['pid'] and alive(w['pid']):
+            print(name + Fore.GREEN + ' \u2714 ' + Fore.RESET +
+                'pid {}, up {}, {} restart(s)'.format(w['pid'],
+                duration(now - w['started']), w['restarts']))
+        else:
+            print(name + Fore.RED + ' \u2718 ' + Fore.RESET +
+                'down, last exit {}, {} restart(s)'.format(w['exit'],
+                w['restarts']))
+        if w['startup'] is not None:
+            print('  first build {:.0f}ms after start'.format(
+                1000 * w['startup']))
+        for label, key in (('change to rebuild', 'latency'),
+            ('build time', 'build')):
+            samples = w[key]
+            if samples:
+                print('  {:<18}{:>4} rebuild(s)  last {:.0f}ms  p50 {:.0f}ms'
+                    '  p95 {:.0f}ms  max {:.0f}ms'.format(label,
+                    len(samples), 1000 * samples[-1],
+                    1000 * statistics.median(samples),
+                    1000 * percentile(samples, 0.95), 1000 * max(samples)))
+    print('\nWatcher output: ' + os.path.join(site_src, LOG))
+
+class Supervisor:
+    """Runs the watchers, each in its own process group, restarting any
+    that exits with exponential backoff (reset once it has been up for
+    STABLE seconds), and keeps the state file current. SIGTERM stops the
+    watchers and then the supervisor.
+    """
+    def __init__(self, site_src, style=False):
+        self.site_src = site_src
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.procs = {}
+        self.state = {
+            'pid': os.getpid(),
+            'started': time.time(),
+            'watchers': {
+                name: {
+                    'pid': None,
+                    'started': None,
+                    'restarts': -1,     # the first start isn't one
+                    'exit': None,
+                    'startup': None,
+                    'latency': [],
+                    'build': []
+                }
+                for name in watchers(style)
+            }
+        }
+
+    def run(self):
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, lambda *args: self.stopping.set())
+
+        backoff = {name: RESTART_BASE for name in self.state['watchers']}
+        due = dict.fromkeys(self.state['watchers'], 0)
+        while not self.stopping.is_set():
+            for name in self.state['watchers']:
+                proc = self.procs.get(name)
+                if proc is None:
+                    if time.monotonic() >= due[name]:
+                        self.launch(name)
+                    continue
+                if proc.poll() is None:
+                    continue
+
+                # exited: restart after a backoff, reset if it was stable
+                w = self.state['watchers'][name]
+                if time.time() - w['started'] >= STABLE:
+                    backoff[name] = RESTART_BASE
+                delay = backoff[name]
+                backoff[name] = min(RESTART_CAP, delay * 2)
+                due[name] = time.monotonic() + delay
+                with self.lock:
+                    w['exit'] = proc.returncode
+                    w['pid'] = None
+                    self.save()
+                log('{} exited ({}); restarting in {:.1f}s'.format(name,
+                    proc.returncode, delay))
+                del self.procs[name]
+            self.stopping.wait(POLL)
+
+        for name, proc in self.procs.items():
+            terminate(proc.pid)
+        with self.lock:
+            for w in self.state['watchers'].values():
+                w['pid'] = None
+            self.state['pid'] = None
+            self.save()
+
+    def launch(self, name):
+        spec = WATCHERS[name]
+        proc = subprocess.Popen(
+            spec['cmd'], cwd=os.path.join(self.site_src, spec['cwd']),
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, universal_newlines=True, bufsize=1,
+            start_new_session=True  # its own group, stopped as one
+        )
+        self.procs[name] = proc
+        with self.lock:
+            w = self.state['watchers'][name]
+            w['pid'] = proc.pid
+            w['started'] = time.time()
+            w['restarts'] += 1
+            self.save()
+        threading.Thread(target=self.follow, args=(name, proc),
+            daemon=True).start()
+        log('{} started (pid {})'.format(name, proc.pid))
+
+    def follow(self, name, proc):
+        # forwards watcher output to the log and times its rebuilds
+        spec = WATCHERS[name]
+        w = self.state['watchers'][name]
+        first = True
+        last = time.time()
+        for line in proc.stdout:
+            sys.stdout.write('[' + name + '] ' + line)
+            sys.stdout.flush()
+            match = spec['done'].search(line)
+            if not match:
+                continue
+
+            now = time.time()
+            with self.lock:
+                if first:
+                    w['startup'] = now - w['started']
+                else:
+                    w['build'] = (w['build'] + [float(match.group(1)) /
+                        1000])[-SAMPLES:]
+                    changed = newest(self.site_src, spec['inputs'])
+                    if changed > last:
+                        w['latency'] = (w['latency'] + [now - changed])[
+                            -SAMPLES:]
+                self.save()
+            first = False
+            last = now
+
+    def save(self):
+        save_state(self.site_src, self.state)
+
+def watchers(style):
+    return [name for name, spec in WATCHERS.items()
+        if style or not spec['style']]
+
+def newest(site_src, inputs):
+    # mtime of the most recently changed input file
+    latest = 0
+    for path in inputs:
+        full = os.path.join(site_src, path)
+        if os.path.isfile(full):
+            latest = max(latest, os.path.getmtime(full))
+        for root, dirs, names in os.walk(full):
+            dirs[:] = [d for d in dirs if d != 'node_modules']
+            for name in names:
+                try:
+                    latest = max(latest, os.path.getmtime(
+                        os.path.join(root, name)))
+                except OSError:
+                    pass  # removed while walking
+    return latest
+
+def load_state(site_src):
+    path = os.path.join(site_src, STATE)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(site_src, state):
+    path = os.path.join(site_src, STATE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def running(site_src, state=None):
+    # the recorded supervisor is alive and still is this script
+    state = load_state(site_src) if state is None else state
+    pid = state.get('pid')
+    if not pid or not alive(pid):
+        return False
+    try:
+        command = subprocess.check_output(['ps', '-o', 'command=', '-p',
+            str(pid)], universal_newlines=True)
+    except subprocess.CalledProcessError:
+        return False
+    return os.path.basename(__file__) in command
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def reap(state):
+    # watchers lead their own process groups; stop those still recorded
+    for w in state.get('watchers', {}).values():
+        if w.get('pid') and alive(w['pid']):
+            terminate(w['pid'])
+
+def terminate(pgid):
+    try:
+        os.killpg(pgid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    deadline = time.monotonic() + STOP_GRACE
+    while time.monotonic() < deadline:
+        try:
+            os.killpg(pgid, 0)
+        except ProcessLookupError:
+            return
+        time.sleep(POLL)
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{}h{:02d}m'.format(hours, minutes) if hours else \
+        '{}m{:02d}s'.format(minutes, seconds)
+
+def log(message):
+    print(time.strftime('%Y-%m-%d %H:%M:%S ') + message, flush=True)
+
+if __name__ == '__main__':
+    # dev_server.py supervise|start|stop|status site_src [--style]
+    if len(sys.argv) < 3 or sys.argv[1] not in ('supervise', 'start',
+        'stop', 'status'):
+        print('Usage: dev_server.py supervise|start|stop|status site_src '
+            '[--style]')
+        sys.exit(1)
+    init()
+    command, site_src = sys.argv[1], os.path.abspath(sys.argv[2])
+    style = '--style' in sys.argv[3:]
+    if command == 'supervise':
+        Supervisor(site_src, style).run()
+    elif command == 'start':
+        start(site_src, style)
+    elif command == 'stop':
+        stop(site_src)
+    else:
+        status(site_src)
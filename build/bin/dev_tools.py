@@ -2,55 +2,74 @@
 
 # include standard modules
 import getopt
+import importlib
 import os
 import signal
 import subprocess
 import sys
+import time
+
+STARTED = time.perf_counter()   # startup cost is measured from here
 
 # include 3rd party modules
 from colorama import init, Fore
 
-# include custom modules
+# include custom modules; everything else is imported by the commands that
+# use it (see load), so e.g. site -x never pulls in boto3
 sys.path.append('$site_deploy')
-import deploy
-import key_gen
+
+IMPORT_BUDGET = 0.15    # seconds a light command may spend starting up
+
+COMMANDS = {}   # long option => (short option, argument, light, help, handler)
+timings = []    # (label, seconds)
+
+def command(short, long, help, arg=None, light=True):
+    """Registers a handler(site, value) as "site -<short>/--<long>". light
+    commands don't touch AWS, so their startup is held to IMPORT_BUDGET by
+    site --timings.
+    """
+    def register(handler):
+        COMMANDS[long] = (short, arg, light, help, handler)
+        return handler
+    return register
+
+def load(name):
+    """Imports a custom module on first use, recording how long it took."""
+    if name in sys.modules:
+        return sys.modules[name]
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    timings.append(('import ' + name, time.perf_counter() - start))
+    return module
 
 def main():
 
     """Bootstraps a development environment with ad-hoc management commands
     that can install, uninstall, rotate key pair, generate a site log report
     and start/stop a watched development session.
+
+    Commands come from the COMMANDS registry; with --timings, the startup,
+    import and run time of each command is shown afterwards.
     """
 
-    domain = '$domain'                  # domain name/S3 bucket name
-    email = '$email'                    # for CodePipeline notifications
     home = os.path.expanduser('~/')     # expand home directory
-    site_root = home + '$domain'        # path to site root
-    site_dpl = site_root + '/deploy'    # path to site deploy
-    site_src = site_root + '/src'       # path to site source
-    site_bld = site_src + '/build'      # path to site build
-    site_log = site_root + '/logs'      # path to site logs
-    report = '_report.html'             # name of log report
+    site = {
+        'domain': '$domain',            # domain name/S3 bucket name
+        'stack': '$stack_site',         # site's CloudFormation stack
+        'email': '$email',              # for CodePipeline notifications
+        'root': home + '$domain',       # path to site root
+        'report': '_report.html'        # name of log report
+    }
+    site['dpl'] = site['root'] + '/deploy'  # path to site deploy
+    site['src'] = site['root'] + '/src'     # path to site source
+    site['bld'] = site['src'] + '/build'    # path to site build
+    site['log'] = site['root'] + '/logs'    # path to site logs
 
     fullCmdArgs = sys.argv              # read commandline arguments (first)
     argList = fullCmdArgs[1:]           # further arguments
 
-    # valid parameters
-    shortOps = 'dsxprbcokhiu'
-    longOps = [
-        'dev',
-        'dev-style',
-        'dev-stop',
-        'post',
-        'report',
-        'build',
-        'clean',
-        'open',
-        'keypair',
-        'help',
-        'install',
-        'uninstall'
-    ]
+    # valid parameters, built from the registry
+    shortOps, longOps, byOption = options()
 
     if len(sys.argv) == 1:
         opt_error()
@@ -61,38 +80,58 @@ def main():
     except getopt.error as err:
         opt_error(err)
 
+    show_timings = ('--timings', '') in arguments
+    arguments = [a for a in arguments if a[0] != '--timings']
+    if not arguments:
+        opt_error()
+    timings.append(('startup', time.perf_counter() - STARTED))
+
+    # ctrl + c exits quietly; deploy installs its own handler when loaded
+    signal.signal(signal.SIGINT, sigint_handler)
+
     for currentArgument, currentValue in arguments:
-        if currentArgument in ("-d", "--dev"):
-            dev_stop()
-            dev(site_src, site_bld)
-            site_open()
-        elif currentArgument in ("-s", "--dev-style"):
-            dev_stop()
-            dev(site_src, site_bld)
-            dev_style(site_bld)
-            site_open()
-        elif currentArgument in ("-x", "--dev-stop"):
-            dev_stop()
-        elif currentArgument in ("-p", "--post"):
-            post(site_src)
-        elif currentArgument in ("-r", "--report"):
-            site_report(site_root, site_log, report)
-        elif currentArgument in ("-b", "--build"):
-            build(site_bld, site_src)
-        elif currentArgument in ("-c", "clean"):
-            clean(site_bld)
-        elif currentArgument in ("-o", "--open"):
-            site_open()
-        elif currentArgument in ("-k", "--keypair"):
-            key_gen.main()
-        elif currentArgument in ("-h", "--help"):
-            display_help()
-        elif currentArgument in ("-i", "--install"):
-            deploy.main(domain, email)
-        elif currentArgument in ("-u", "--uninstall"):
-            print ("Static-Site Uninstall Coming Soon")
-        else:
+        if currentArgument not in byOption:
             opt_error()
+        name = byOption[currentArgument]
+        start = time.perf_counter()
+        COMMANDS[name][4](site, currentValue)
+        timings.append(('run --' + name, time.perf_counter() - start))
+
+    if show_timings:
+        print_timings([byOption[a] for a, _ in arguments])
+
+def options():
+    """Returns getopt's short and long options for the registered
+    commands, and {'-d' or '--dev': 'dev'}.
+    """
+    shortOps = ''.join(
+        c[0] + (':' if c[1] else '') for c in COMMANDS.values() if c[0])
+    longOps = [l + ('=' if c[1] else '') for l, c in COMMANDS.items()]
+    longOps.append('timings')
+    byOption = {}
+    for l, c in COMMANDS.items():
+        byOption['--' + l] = l
+        if c[0]:
+            byOption['-' + c[0]] = l
+    return shortOps, longOps, byOption
+
+def print_timings(names):
+    # startup and imports, i.e. all but running the commands themselves
+    overhead = sum(s for l, s in timings if not l.startswith('run '))
+    print(Fore.WHITE + '\nTimings:' + Fore.RESET)
+    for label, seconds in timings:
+        print('{:<28}{:>8.3f}s'.format(label, seconds))
+    print('{:<28}{:>8.3f}s'.format('startup + imports', overhead))
+
+    if all(COMMANDS[n][2] for n in names) and overhead > IMPORT_BUDGET:
+        print(Fore.RED + 'Over the {:.3f}s startup budget of light '
+            'commands; check the imports above'.format(IMPORT_BUDGET) +
+            Fore.RESET)
+        sys.exit(1)
+
+def sigint_handler(signum, frame):
+    print(Fore.WHITE + '\n\nGoodbye!' + Fore.RESET)
+    sys.exit(0)
 
 def opt_error(err = 'No valid option entered!'):
     print('\n' + Fore.YELLOW + str(err) + Fore.RESET)
@@ -100,38 +139,105 @@ def opt_error(err = 'No valid option entered!'):
     if len(sys.argv) > 1:
         sys.exit(1)
 
-def dev(site_src, site_bld):
-    os.chdir(site_bld)  # change cwd to site build
-    subprocess.run('yarn start', shell=True)  # yarn clean & yarn build source
-    os.chdir(site_src)  # change cwd to site source
-    subprocess.run('hugo server -D &', shell=True)  # build and serve dev site
-    print(Fore.YELLOW + '\nPress enter to get prompt back!\n' + Fore.RESET)
-
-def dev_style(site_bld):
-    os.chdir(site_bld)
-    subprocess.run('yarn dev &', shell=True)  # yarn clean & yarn build source
-
-def dev_stop():
-    processes = ['hugo', 'webpack']
-    for process in processes:
+@command('d', 'dev', 'Run build (Webpack, changed inputs only) & start '
+    'supervised Hugo server')
+def cmd_dev(site, value):
+    dev(site['src'])
+    site_open()
+
+@command('s', 'dev-style', 'Run site --dev & also supervise Webpack file '
+    'watch mode')
+def cmd_dev_style(site, value):
+    dev(site['src'], style=True)
+    site_open()
+
+@command('x', 'dev-stop', 'Stop file watch mode (Hugo & Webpack)')
+def cmd_dev_stop(site, value):
+    load('dev_server').stop(site['src'])
+
+@command('S', 'status', 'Show dev server watchers & rebuild latency')
+def cmd_status(site, value):
+    load('dev_server').status(site['src'])
+
+@command('p', 'post', 'Create new Hugo post')
+def cmd_post(site, value):
+    post(site['src'])
+
+@command('r', 'report', 'Fetch new site access logs & update report',
+    light=False)
+def cmd_report(site, value):
+    site_report(site['log'], site['report'], site['domain'], site['stack'])
+
+@command('R', 'report-range', 'Report on stored logs for 7d, YYYY-MM or '
+    'YYYY-MM-DD[:YYYY-MM-DD]', arg='range')
+def cmd_report_range(site, value):
+    site_report_range(site['log'], value)
+
+@command('b', 'build', 'Run Webpack & Hugo builds (changed inputs only), '
+    'then check performance budgets')
+def cmd_build(site, value):
+    build(site['src'])
+
+@command('B', 'rebuild', 'Clean, then run full Webpack & Hugo builds')
+def cmd_rebuild(site, value):
+    build(site['src'], force=True)
+
+@command('c', 'clean', 'Remove Webpack & Hugo builds')
+def cmd_clean(site, value):
+    clean(site['bld'])
+
+@command('o', 'open', 'Open localhost:1313 in browser')
+def cmd_open(site, value):
+    site_open()
+
+@command('e', 'edge', 'Serve Hugo build like CloudFront on localhost:8080')
+def cmd_edge(site, value):
+    load('edge').main(os.path.join(site['src'], 'public'))
+
+@command('l', 'load', 'Load test a local edge with synthetic traffic or '
+    'logs of a report range', arg='synthetic|range')
+def cmd_load(site, value):
+    if value != 'synthetic':
         try:
-            # throw into list for cases when pattern match yields multiple pids
-            pids = subprocess.check_output(['pgrep', '-f', process],
-                universal_newlines=True).split('\n')
-
-            # strip empty elements and convert back to list
-            pids = list(filter(None, pids))
-
-            # map list from strings to integers
-            pids = list(map(int, pids))
-
-            for pid in pids:
-                os.kill(pid, signal.SIGTERM)
+            load('log_store').parse_range(value)
+        except ValueError as err:
+            opt_error(err)
+    load('edge_load').main(os.path.join(site['src'], 'public'), value,
+        site['log'])
+
+@command('k', 'keypair', 'Rotate SSH key pair (AWS cloud & locally)',
+    light=False)
+def cmd_keypair(site, value):
+    load('key_gen').main((site['stack'],))
+
+@command('h', 'help', 'Display site CLI commands')
+def cmd_help(site, value):
+    display_help()
 
-            print(Fore.YELLOW + '- Process terminated: ' + process +
-                Fore.RESET)
-        except:
-            pass
+@command('i', 'install', 'Deploy static site (AWS cloud & locally)',
+    light=False)
+def cmd_install(site, value):
+    load('deploy').main(site['domain'], site['email'], site['stack'])
+
+@command('u', 'uninstall', 'Uninstall static site (AWS cloud & locally)')
+def cmd_uninstall(site, value):
+    print ("Static-Site Uninstall Coming Soon")
+
+@command('P', 'publish', 'Upload changed Hugo build to S3 & invalidate its '
+    'paths', light=False)
+def cmd_publish(site, value):
+    site_publish(site['bld'], site['src'], site['domain'], site['stack'])
+
+def dev(site_src, style=False):
+    # a running dev server keeps its watchers warm; otherwise build only
+    # the webpack output hugo serves (cached stages are skipped) first
+    dev_server = load('dev_server')
+    if not dev_server.running(site_src):
+        build_stages = load('build_stages')
+        if not build_stages.main(site_src, stages={n: s for n, s in
+            build_stages.STAGES.items() if n in ('webpack', 'images')}):
+            sys.exit(1)
+    dev_server.start(site_src, style)
 
 def post(site_src):
     os.chdir(site_src)  # change cwd to site source
@@ -139,69 +245,80 @@ def post(site_src):
     '(no spaces): ' + Fore.RESET)
     subprocess.run('hugo new post/' + post_title + '.md', shell=True)
 
-def site_report(site_root, site_log, report):
-    if os.path.isfile(site_log + '/' + report):
-        os.remove(site_log + '/' + report)
+def site_report(site_log, report, domain, stack):
+    # fetch only logs delivered since the last report
+    log_fetch = load('log_fetch')
+    resolver = load('resolver')
+    log_bucket = resolver.outputs(stack).get('ArtifactsBucket',
+        'log.' + domain)
+    new_logs = log_fetch.main(log_bucket, site_log)
 
-    subprocess.run('aws s3 sync --exclude "Static-Site-CICD-Sit/*" '
-        's3://log.$domain ' + site_root, shell=True
-    )
+    # new lines are added to the aggregates saved by earlier reports
+    log_report = load('log_report')
+    report_path = log_report.main(site_log, log_fetch.lines(new_logs), report)
 
-    if sys.platform.startswith('darwin'):
-        log_proc = 'gunzip -c ' + site_log + '/*.gz | goaccess -a -o'
+    # fold raw logs into the date-partitioned store, then drop them
+    log_store = load('log_store')
+    rows = log_store.compact(site_log, log_store.raw_logs(site_log))
+    print('\nCompacted {:,} log lines into '.format(rows) + site_log +
+        '/store')
 
-    elif sys.platform.startswith('linux'):
-        log_proc = 'zcat ' + site_log + '/*.gz | goaccess -a -o'
+    print('\nSite log report generated: ' + report_path)
 
-    else:
-        print(Fore.YELLOW + 'Script not supported on this OS' + Fore.RESET)
-        sys.exit(1)
+    if sys.platform.startswith('darwin'):
+        subprocess.run('open ' + report_path, shell=True)
 
-    subprocess.run(log_proc + ' ' + site_log + '/' + report, shell=True)
+def site_report_range(site_log, date_range):
+    log_store = load('log_store')
+    try:
+        first, last = log_store.parse_range(date_range)
+    except ValueError as err:
+        opt_error(err)
+    report_path = log_store.report(site_log, first, last)
 
-    print('\nSite log report generated: ' + site_log + '/' + report)
+    print('\nSite log report generated: ' + report_path)
 
     if sys.platform.startswith('darwin'):
-        subprocess.run('open ' + site_log + '/' + report, shell=True)
+        subprocess.run('open ' + report_path, shell=True)
 
-def build(site_bld, site_src):
-    os.chdir(site_bld)
-    subprocess.run('yarn clean && yarn build', shell=True)
-    os.chdir(site_src)
-    subprocess.run('hugo', shell=True)
+def build(site_src, force=False):
+    # only stages with changed inputs run, unless forced
+    if not load('build_stages').main(site_src, force):
+        sys.exit(1)
 
 def clean(site_bld):
     os.chdir(site_bld)
     subprocess.run('yarn clean', shell=True)
 
+def site_publish(site_bld, site_src, domain, stack):
+    sys.path.append(site_bld)  # publish.py ships with the build system
+    publish = load('publish')
+    resolver = load('resolver')
+    outputs = resolver.outputs(stack)
+    os.chdir(site_src)
+    publish.main(
+        'public',
+        outputs.get('SiteBucketName', domain),
+        manifest_bucket=outputs.get('ArtifactsBucket'),
+        distribution=resolver.distribution_id(stack, domain)
+    )
+
 def site_open():
     if sys.platform.startswith('darwin'):
         subprocess.run('open http://localhost:1313', shell=True)
 
 def display_help():
-    print (Fore.GREEN +
-        '\n$ site -d or $ site --dev        # Run build (Hugo & Webpack) & '
-            'start Hugo file watch mode'
-        '\n$ site -s or $ site --dev-style  # Run site --dev & start Webpack '
-            'file watch mode'
-        '\n$ site -x or $ site --dev-stop   # Stop file watch mode (Hugo & '
-            'Webpack)'
-        '\n$ site -p or $ site --post       # Create new Hugo post'
-        '\n$ site -r or $ site --report     # Sync site access logs locally & '
-            'generate report'
-        '\n$ site -b or $ site --build      # Run Webpack & Hugo builds'
-        '\n$ site -c or $ site --clean      # Remove Webpack & Hugo builds'
-        '\n$ site -o or $ site --open       # Open localhost:1313 in browser'
-        '\n$ site -k or $ site --keypair    # Rotate SSH key pair (AWS cloud &'
-            ' locally)'
-        '\n$ site -h or $ site --help       # Display site CLI commands'
-        '\n$ site -i or $ site --install    # Deploy static site (AWS cloud &'
-            ' locally)'
-        '\n$ site -u or $ site --uninstall  # Uninstall static site (AWS cloud'
-            ' & locally)'
-        '\n$ sitego                         # cd to site source'
-        + Fore.RESET
-    )
+    lines = []
+    for long, (short, arg, light, help, handler) in COMMANDS.items():
+        if arg:
+            usage = '$ site -{} <{}>'.format(short, arg)
+        else:
+            usage = '$ site -{} or $ site --{}'.format(short, long)
+        lines.append(usage.ljust(33) + '# ' + help)
+    lines.append('$ site --timings <command>'.ljust(33) + '# Show startup, '
+        'import & run time of a command')
+    lines.append('$ sitego'.ljust(33) + '# cd to site source')
+    print(Fore.GREEN + '\n' + '\n'.join(lines) + Fore.RESET)
 
 if __name__ == '__main__':
     main()
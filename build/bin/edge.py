@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import asyncio
+import collections
+import email.utils
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+import time
+from urllib.parse import unquote, urlsplit
+
+# include 3rd party modules
+from colorama import init, Fore
+
+HOST = '127.0.0.1'
+PORT = 8080
+CACHE_BYTES = 256 * 1024 * 1024     # edge cache capacity, LRU evicted
+
+# SiteDistro's DefaultCacheBehavior keeps CloudFront's TTL defaults and
+# doesn't compress; its origin is the S3 website endpoint of SiteBucket
+MIN_TTL = 0
+DEFAULT_TTL = 86400
+MAX_TTL = 31536000
+ERROR_TTL = 10          # seconds CloudFront caches 4xx/5xx responses
+INDEX_DOCUMENT = 'index.html'
+ERROR_DOCUMENT = '404.html'
+ORIGIN_LATENCY = 0.02   # seconds; simulated edge to S3 round trip
+
+MAX_AGE = re.compile(r'\b(s-maxage|max-age)\s*=\s*(\d+)')
+
+def main(public='public', host=HOST, port=PORT, capacity=CACHE_BYTES,
+    latency=ORIGIN_LATENCY):
+    """Serves a Hugo build the way the production distribution does, to
+    see TTL and cache effects before deploying: an asyncio HTTP server
+    standing in for a CloudFront edge in front of the S3 website origin.
+
+    The origin (see Origin) rewrites directory paths to index.html,
+    redirects directories requested without a slash and answers 404.html
+    for missing keys, with the Cache-Control publish.py would upload and
+    text assets gzip-compressed as it uploads them (Content-Encoding: gzip
+    for every client; the distribution doesn't compress). The edge (see
+    Edge) only allows GET and HEAD, ignores query strings, keeps responses
+    in an in-memory LRU cache for their TTL and revalidates expired ones by
+    ETag (RefreshHit).
+
+    Serves until interrupted, then prints the edge's cache statistics.
+    """
+    init()
+    edge = Edge(Origin(public, latency), capacity)
+
+    async def serve():
+        server = await asyncio.start_server(edge.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    print(Fore.WHITE + '\nServing ' + public + ' like CloudFront on '
+        'http://{}:{} (Ctrl-C to stop)'.format(host, port) + Fore.RESET)
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        edge.print_stats()
+
+class Origin:
+    """The S3 website endpoint of SiteBucket, over a local build."""
+    def __init__(self, public, latency=ORIGIN_LATENCY):
+        self.public = public
+        self.latency = latency
+        self.requests = 0
+
+        # Cache-Control as publish.py uploads it; precompress.py ships with
+        # the build system, in the site source's build/ directory
+        site = os.path.dirname(os.path.abspath(public))
+        sys.path.append(os.path.join(site, 'build'))
+        import precompress
+        self.precompress = precompress
+        self.bundles = precompress.fingerprinted(os.path.join(site, 'data',
+            'manifest.json'))
+
+    async def get(self, path):
+        """Returns (status, headers, body) for a request path."""
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.read, path)
+
+    def read(self, path):
+        key = unquote(path).lstrip('/')
+        if key == '' or key.endswith('/'):
+            key += INDEX_DOCUMENT
+        file = os.path.join(self.public, key)
+        if '..' in key.split('/'):
+            file = None
+
+        if file and os.path.isfile(file):
+            return (200,) + self.object(key)
+        if file and os.path.isfile(os.path.join(file, INDEX_DOCUMENT)):
+            # S3 websites redirect "dir" to "dir/" when dir/index.html exists
+            return 302, {'Location': path + '/', 'Content-Type':
+                'text/html'}, b''
+
+        if os.path.isfile(os.path.join(self.public, ERROR_DOCUMENT)):
+            headers, body = self.object(ERROR_DOCUMENT)
+            return 404, {k: v for k, v in headers.items() if k in
+                ('Content-Type', 'Content-Encoding')}, body
+        return 404, {'Content-Type': 'text/html'}, \
+            b'<html><body><h1>404 Not Found</h1></body></html>'
+
+    def object(self, key):
+        # (headers, body) of the object publish.py uploads for key: a gzip
+        # copy of text assets when worth it
+        with open(os.path.join(self.public, key), 'rb') as f:
+            body = f.read()
+        packed = None
+        if key.endswith(self.precompress.COMPRESSIBLE) and \
+            len(body) >= self.precompress.MIN_SIZE:
+            packed = self.precompress.pack(body)
+        headers = self.headers(key, packed or body)
+        if packed:
+            headers['Content-Encoding'] = 'gzip'
+        return headers, packed or body
+
+    def headers(self, key, body):
+        meta = {
+            'Content-Type': mimetypes.guess_type(key)[0] or
+                'binary/octet-stream',
+            'ETag': '"' + hashlib.md5(body).hexdigest() + '"',
+            'Last-Modified': email.utils.formatdate(os.path.getmtime(
+                os.path.join(self.public, key)), usegmt=True)
+        }
+        if key in self.bundles or self.precompress.is_fingerprinted(key):
+            meta['Cache-Control'] = self.precompress.IMMUTABLE
+        elif key.endswith('.html'):
+            meta['Cache-Control'] = 'public, max-age=' + str(
+                self.precompress.HTML_TTL)
+        else:
+            meta['Cache-Control'] = 'public, max-age=' + str(
+                self.precompress.DEFAULT_TTL)
+        return meta
+
+class Edge:
+    """A CloudFront edge location: cache key is the path (query strings,
+    cookies and Accept-Encoding aren't forwarded). Concurrent misses for
+    one path are collapsed into a single origin fetch.
+    """
+    def __init__(self, origin, capacity=CACHE_BYTES):
+        self.origin = origin
+        self.capacity = capacity
+        self.cache = collections.OrderedDict()  # path => entry
+        self.pending = {}   # path => future of its origin fetch
+        self.size = 0
+        self.stats = collections.Counter()
+        self.started = time.monotonic()
+
+    async def handle(self, reader, writer):
+        # HTTP/1.1 with keep-alive; GET and HEAD carry no request body
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                lines = head.decode('latin-1').split('\r\n')
+                method, target, version = lines[0].split(' ', 2)
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+
+                status, out, body, result = await self.get(method, target)
+                out['Content-Length'] = str(len(body))
+                out['X-Cache'] = result + ' from cloudfront'
+                out['Via'] = '1.1 local-edge (CloudFront)'
+                writer.write('HTTP/1.1 {} {}\r\n'.format(status,
+                    REASONS.get(status, '')).encode('latin-1') +
+                    ''.join(k + ': ' + v + '\r\n' for k, v in
+                        out.items()).encode('latin-1') + b'\r\n' +
+                    (b'' if method == 'HEAD' else body))
+                await writer.drain()
+
+                if headers.get('connection', '').lower() == 'close' or \
+                    version == 'HTTP/1.0':
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+            ConnectionError, ValueError):
+            pass  # client went away or sent something this doesn't speak
+        finally:
+            writer.close()
+
+    async def get(self, method, target):
+        """Returns (status, headers, body, result type); result types are
+        the x-edge-result-type values of CloudFront access logs.
+        """
+        if method not in ('GET', 'HEAD'):
+            self.count('Error', 0)
+            return 403, {'Content-Type': 'text/html'}, b'', 'Error'
+
+        key = urlsplit(target).path or '/'
+        now = time.monotonic()
+
+        entry = self.cache.get(key)
+        if entry and entry['expires'] > now:
+            self.cache.move_to_end(key)
+            result = 'Hit'
+        elif key in self.pending:
+            # requests for an object already being fetched wait for it
+            entry = await self.pending[key]
+            result = 'Hit'
+        else:
+            fetch = self.pending[key] = \
+                asyncio.get_running_loop().create_future()
+            try:
+                entry, result = await self.fetch(key, entry, now)
+                fetch.set_result(entry)
+            except BaseException:
+                fetch.cancel()
+                raise
+            finally:
+                del self.pending[key]
+
+        if entry['status'] >= 400:
+            result = 'Error'    # cached or not, as access logs have it
+        headers = dict(entry['headers'])
+        if result in ('Hit', 'RefreshHit'):
+            headers['Age'] = str(int(now - entry['stored']))
+        self.count(result, len(entry['body']))
+        return entry['status'], headers, entry['body'], result
+
+    async def fetch(self, key, entry, now):
+        status, headers, body = await self.origin.get(key)
+        if entry and status == entry['status'] and \
+            headers.get('ETag') == entry['etag']:
+            # revalidated: a 304 from the origin, the cached copy stays
+            entry['expires'] = now + entry['ttl']
+            entry['stored'] = now
+            self.cache.move_to_end(key)
+            return entry, 'RefreshHit'
+        entry = await self.store(key, status, headers, body, now)
+        return entry, 'Miss' if status < 400 else 'Error'
+
+    async def store(self, key, status, headers, body, now):
+        ttl = time_to_live(status, headers)
+        entry = {
+            'status': status,
+            'headers': headers,
+            'body': body,
+            'etag': headers.get('ETag'),
+            'ttl': ttl,
+            'stored': now,
+            'expires': now + ttl
+        }
+        old = self.cache.pop(key, None)
+        if old:
+            self.size -= len(old['body'])
+        if ttl > 0 and len(body) <= self.capacity:
+            self.cache[key] = entry
+            self.size += len(body)
+            while self.size > self.capacity:
+                _, evicted = self.cache.popitem(last=False)
+                self.size -= len(evicted['body'])
+                self.stats['evictions'] += 1
+        return entry
+
+    def count(self, result, size):
+        self.stats[result] += 1
+        self.stats['requests'] += 1
+        self.stats['bytes'] += size
+
+    def print_stats(self):
+        stats = self.stats
+        hits = stats['Hit'] + stats['RefreshHit']
+        print(Fore.WHITE + '\nEdge Cache:' + Fore.RESET)
+        print('{:,} requests in {:.0f}s, {:,} bytes served'.format(
+            stats['requests'], time.monotonic() - self.started,
+            stats['bytes']))
+        print('Hit {:,}, RefreshHit {:,}, Miss {:,}, Error {:,}; hit ratio '
+            '{:.1%}'.format(stats['Hit'], stats['RefreshHit'], stats['Miss'],
+            stats['Error'], hits / max(1, hits + stats['Miss'])))
+        print('{:,} objects cached ({:,} bytes), {:,} evicted, {:,} origin '
+            'requests'.format(len(self.cache), self.size,
+            stats['evictions'], self.origin.requests))
+
+REASONS = {200: 'OK', 302: 'Found', 403: 'Forbidden', 404: 'Not Found'}
+
+def time_to_live(status, headers):
+    # s-maxage, then max-age, clamped to the behavior's min/max TTL; no
+    # directive at all gets the default TTL
+    if status >= 400:
+        return ERROR_TTL
+    cache_control = headers.get('Cache-Control', '').lower()
+    if any(d in cache_control for d in ('no-store', 'no-cache', 'private')):
+        return MIN_TTL
+    ages = dict(MAX_AGE.findall(cache_control))
+    age = ages.get('s-maxage', ages.get('max-age'))
+    if age is None:
+        return DEFAULT_TTL
+    return max(MIN_TTL, min(MAX_TTL, int(age)))
+
+if __name__ == '__main__':
+    # edge.py [public dir] [port]
+    main(sys.argv[1] if len(sys.argv) > 1 else 'public',
+        port=int(sys.argv[2]) if len(sys.argv) > 2 else PORT)
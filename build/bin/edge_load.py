@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import asyncio
+import collections
+import getopt
+import itertools
+import os
+import random
+import re
+import sys
+import time
+from urllib.parse import urlsplit
+
+# include 3rd party modules
+from colorama import init, Fore
+
+# include custom modules
+import edge
+
+REQUESTS = 10000        # synthetic requests; logs replay every request
+CONCURRENCY = 32        # client connections, each keep-alive
+SEED = 1
+ZIPF_S = 1.1            # page popularity skew of synthetic traffic
+MISSING = 0.02          # share of synthetic page views of missing pages
+TOP = 10                # most missed paths listed
+
+# Accept-Encoding headers of synthetic requests, by share of requests
+ENCODINGS = (('gzip, deflate, br', 0.7), ('gzip, deflate', 0.25), ('', 0.05))
+
+# assets a page loads, by absolute path or full URL (Hugo's absURL)
+ASSETS = re.compile(rb'(?:src|href)=["\']?(?:https?:)?(?://[^/"\'\s>]+)?'
+    rb'(/[^"\'\s>#?]+\.(?:css|js|png|jpe?g|gif|webp|svg|ico|woff2?))')
+
+def main(public='public', traffic='synthetic', site_log=None, url=None,
+    requests=None, concurrency=CONCURRENCY, seed=SEED):
+    """Load tests the edge emulator (see edge.py) with a traffic mix and
+    reports throughput, latency percentiles and cache hit ratio.
+
+    traffic is 'synthetic' (page views with Zipf-distributed popularity,
+    each followed by the assets the page loads, some of missing pages, with
+    a mix of Accept-Encoding headers), a report range such as "7d" or
+    "2018-06" replayed in order from the log store in site_log (see
+    log_store.py), or CloudFront log files. Requests go out over
+    concurrency keep-alive connections, each sending its next request as
+    soon as the last is answered.
+
+    Targets the edge at url; without one, an edge is started in-process
+    over public and its cache statistics are printed too.
+
+    Returns {'requests', 'seconds', 'results', 'status', 'latency'}.
+    """
+    init()
+    # streamed to the clients, so a long log replay isn't held in memory
+    mix = itertools.islice(traffic_mix(public, traffic, site_log, seed),
+        requests or (REQUESTS if traffic == 'synthetic' else None))
+    first = next(mix, None)
+    if first is None:
+        print(Fore.YELLOW + '\nNo requests to replay for: ' + traffic +
+            Fore.RESET)
+        return None
+    mix = itertools.chain([first], mix)
+
+    stats = asyncio.run(run(public, url, mix, concurrency))
+    print_stats(stats, traffic, concurrency)
+    return stats
+
+def traffic_mix(public, traffic, site_log, seed):
+    # (path, Accept-Encoding) pairs
+    rand = random.Random(seed)
+    encodings, weights = zip(*ENCODINGS)
+
+    def encoding():
+        return rand.choices(encodings, weights)[0]
+
+    if traffic == 'synthetic':
+        for path in synthetic(public, rand):
+            yield path, encoding()
+        return
+
+    if os.path.isfile(traffic.split(',')[0]):
+        import log_report
+        uris = (r.uri for r in log_report.records(log_report.read(
+            traffic.split(','))))
+    else:
+        import log_store
+        uris = log_store.uris(site_log, *log_store.parse_range(traffic))
+    for uri in uris:
+        yield uri, encoding()
+
+def synthetic(public, rand):
+    # endless page views; a page is requested by its directory URL
+    pages = sorted(
+        os.path.relpath(os.path.join(root, name), public).replace(os.sep,
+            '/')
+        for root, dirs, names in os.walk(public) for name in names
+        if name.endswith('.html') and name != edge.ERROR_DOCUMENT
+    )
+    if not pages:
+        raise ValueError('no pages under ' + public)
+    rand.shuffle(pages)     # popularity unrelated to path order
+    weights = list(itertools.accumulate(1 / rank ** ZIPF_S
+        for rank in range(1, len(pages) + 1)))
+    assets = {}
+
+    while True:
+        if rand.random() < MISSING:
+            yield '/missing-{}/'.format(rand.randrange(1000))
+            continue
+        page = rand.choices(pages, cum_weights=weights)[0]
+        if page not in assets:
+            with open(os.path.join(public, page), 'rb') as f:
+                assets[page] = sorted({m.decode('utf-8', 'replace')
+                    for m in ASSETS.findall(f.read())})
+        if os.path.basename(page) == edge.INDEX_DOCUMENT:
+            yield '/' + page[:-len(edge.INDEX_DOCUMENT)]
+        else:
+            yield '/' + page
+        yield from assets[page]
+
+async def run(public, url, mix, concurrency):
+    server = local = None
+    if url is None:
+        local = edge.Edge(edge.Origin(public))
+        server = await asyncio.start_server(local.handle, edge.HOST, 0)
+        host, port = server.sockets[0].getsockname()[:2]
+    else:
+        parts = urlsplit(url)
+        host, port = parts.hostname, parts.port or 80
+
+    stats = {
+        'requests': 0,
+        'bytes': 0,
+        'results': collections.Counter(),
+        'status': collections.Counter(),
+        'misses': collections.Counter(),
+        'latency': []
+    }
+    todo = iter(mix)
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            client(host, port, todo, stats) for _ in range(concurrency)
+        ))
+    finally:
+        stats['seconds'] = time.perf_counter() - start
+        if server:
+            server.close()
+            await server.wait_closed()
+    stats['edge'] = local
+    return stats
+
+async def client(host, port, todo, stats):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        # one event loop thread, so the shared iterator needs no lock
+        for path, encoding in todo:
+            request = 'GET {} HTTP/1.1\r\nHost: {}\r\n'.format(path, host)
+            if encoding:
+                request += 'Accept-Encoding: ' + encoding + '\r\n'
+            sent = time.perf_counter()
+            writer.write((request + '\r\n').encode('latin-1'))
+
+            head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+            lines = head.split('\r\n')
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length',
+                0)))
+            stats['latency'].append(time.perf_counter() - sent)
+
+            status = int(lines[0].split(' ', 2)[1])
+            result = headers.get('x-cache', 'Unknown').split(' ')[0]
+            stats['requests'] += 1
+            stats['bytes'] += len(body)
+            stats['status'][status] += 1
+            stats['results'][result] += 1
+            if result == 'Miss':
+                stats['misses'][path] += 1
+    finally:
+        writer.close()
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def print_stats(stats, traffic, concurrency, top=TOP):
+    latency = sorted(stats['latency'])
+    results = stats['results']
+    hits = results['Hit'] + results['RefreshHit']
+    seconds = stats['seconds']
+
+    print(Fore.WHITE + '\nLoad Test: {:,} requests of {} traffic over {} '
+        'connections'.format(stats['requests'], traffic, concurrency) +
+        Fore.RESET)
+    print('Throughput:  {:,.0f} req/s, {:.1f} MB/s ({:.1f}s)'.format(
+        stats['requests'] / seconds, stats['bytes'] / seconds / 1e6,
+        seconds))
+    print('Latency:     ' + '  '.join('{} {:.1f}ms'.format(label,
+        1000 * percentile(latency, q)) for label, q in
+        (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))))
+    print('Cache:       ' + ', '.join('{} {:,}'.format(r, n) for r, n in
+        results.most_common()) + '; hit ratio {:.1%}'.format(
+        hits / max(1, hits + results['Miss'])))
+    print('Status:      ' + ', '.join('{} {:,}'.format(s, n) for s, n in
+        sorted(stats['status'].items())))
+    if stats['misses']:
+        print(Fore.WHITE + '\nTop Misses:' + Fore.RESET)
+        for path, count in stats['misses'].most_common(top):
+            print('{:>8,}  {}'.format(count, path))
+    if stats['edge']:
+        stats['edge'].print_stats()
+
+def usage():
+    print('Usage: edge_load.py [--url URL] [--requests N] [--concurrency N] '
+        '[--site-log DIR] [public dir] [synthetic|range|log file,...]')
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'u:n:c:l:h',
+            ['url=', 'requests=', 'concurrency=', 'site-log=', 'help'])
+    except getopt.error as err:
+        print(err)
+        usage()
+        sys.exit(1)
+
+    kwargs = {}
+    for opt, val in opts:
+        if opt in ('-u', '--url'):
+            kwargs['url'] = val
+        elif opt in ('-n', '--requests'):
+            kwargs['requests'] = int(val)
+        elif opt in ('-c', '--concurrency'):
+            kwargs['concurrency'] = int(val)
+        elif opt in ('-l', '--site-log'):
+            kwargs['site_log'] = val
+        elif opt in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    main(*args, **kwargs)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import concurrent.futures
+import datetime
+import gzip
+import json
+import os
+import re
+import sys
+
+# include 3rd party modules
+import boto3
+from botocore.config import Config
+
+WATERMARK = '.watermark.json'
+LOOKBACK_DAYS = 1  # CloudFront can deliver a log file up to a day late
+
+# logs/<distribution id>.<YYYY-MM-DD-HH>.<unique id>.gz
+KEY_DATE = re.compile(r'^(.*?\.)(\d{4}-\d{2}-\d{2})-\d{2}\.')
+
+def main(bucket, site_log, prefix='logs/', workers=16):
+    """Fetches CloudFront access logs delivered since the last fetch.
+
+    A watermark file in site_log records the newest key fetched, so only
+    keys after it (less a one-day lookback for late deliveries, with keys
+    already fetched in that window remembered) are listed. New files are
+    downloaded concurrently over a pooled client.
+
+    Returns the local paths of the newly fetched files, oldest first.
+    """
+    os.makedirs(site_log, exist_ok=True)
+    watermark = load_watermark(site_log)
+    s3 = boto3.client('s3', config=Config(max_pool_connections=workers * 2))
+
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    if watermark.get('start_after'):
+        kwargs['StartAfter'] = watermark['start_after']
+    recent = set(watermark.get('recent', []))
+
+    new = []
+    for page in s3.get_paginator('list_objects_v2').paginate(**kwargs):
+        for obj in page.get('Contents', []):
+            if obj['Key'] not in recent and obj['Key'].endswith('.gz'):
+                new.append(obj)
+
+    print('Fetching {} new log files from s3://{}/{}...'.format(
+        len(new), bucket, prefix))
+
+    def fetch(obj):
+        path = os.path.join(site_log, os.path.basename(obj['Key']))
+        s3.download_file(bucket, obj['Key'], path)
+        return path
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        paths = list(pool.map(fetch, new))
+
+    if new:
+        save_watermark(site_log, watermark, new)
+
+    return sorted(paths)
+
+def load_watermark(site_log):
+    path = os.path.join(site_log, WATERMARK)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_watermark(site_log, watermark, new):
+    last = max(new, key=lambda o: o['Key'])
+    last_modified = max(o['LastModified'] for o in new)
+
+    # restart the next listing a day before the newest key's date
+    start_after = watermark.get('start_after', '')
+    match = KEY_DATE.match(last['Key'])
+    if match:
+        day = datetime.datetime.strptime(match.group(2), '%Y-%m-%d') - \
+            datetime.timedelta(days=LOOKBACK_DAYS)
+        start_after = max(start_after,
+            match.group(1) + day.strftime('%Y-%m-%d'))
+
+    keys = set(watermark.get('recent', [])) | {o['Key'] for o in new}
+    watermark = {
+        'start_after': start_after,
+        'last_key': max(last['Key'], watermark.get('last_key', '')),
+        'last_modified': max(last_modified.isoformat(),
+            watermark.get('last_modified', '')),
+        'recent': sorted(k for k in keys if k > start_after)
+    }
+
+    path = os.path.join(site_log, WATERMARK)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(watermark, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def lines(paths):
+    """Yields the decompressed lines of gzipped log files, one file at a
+    time, so any number of files can be streamed without a shell glob.
+    """
+    for path in paths:
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                yield line
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: log_fetch.py bucket site_log_dir')
+        sys.exit(1)
+    for path in main(sys.argv[1], sys.argv[2]):
+        print(path)
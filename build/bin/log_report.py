@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import collections
+import gzip
+import html
+import itertools
+import json
+import math
+import os
+import sys
+
+# W3C CloudFront access log fields used; positions are read from the
+# "#Fields:" header when present, these are the documented defaults
+FIELDS = {
+    'date': 0,
+    'x-edge-location': 2,
+    'sc-bytes': 3,
+    'cs-uri-stem': 7,
+    'sc-status': 8,
+    'x-edge-result-type': 13,
+    'time-taken': 18
+}
+HITS = ('Hit', 'RefreshHit')
+MISSES = ('Miss',)
+BATCH = 50000           # lines aggregated per batch
+MAX_PATHS = 200000      # distinct paths kept before the long tail is folded
+BINS_PER_E = 40         # time-taken histogram resolution (~2.5% per bin)
+STATE = 'report.json'
+
+# one parsed log line; also what log_store partitions hold
+Record = collections.namedtuple('Record',
+    'date edge bytes uri status result time_taken')
+
+def main(site_log, lines, report='_report.html'):
+    """Builds the site access report from CloudFront logs natively, without
+    goaccess, adding new log lines to the aggregates of earlier runs.
+
+    Lines are parsed from a generator and aggregated in batches, so memory
+    stays constant however many lines are fed. The report covers cache hit
+    ratio per path and per edge location, p50/p95/p99 time-taken, bytes
+    served and the top origin-miss URLs, written to site_log as HTML and
+    JSON; the aggregate state is kept in report.json.
+
+    Returns the path of the HTML report.
+    """
+    state = load(os.path.join(site_log, STATE))
+    aggregate(state, records(lines))
+    save(state, os.path.join(site_log, STATE))
+    return write(state, os.path.join(site_log, report))
+
+def write(state, path):
+    # HTML report at path, plus its summary as JSON next to it
+    report = summary(state)
+    with open(path, 'w') as f:
+        f.write(render(report))
+    with open(os.path.splitext(path)[0] + '.json', 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
+
+def new_state():
+    return {
+        'lines': 0,
+        'bytes': 0,
+        'first': None,
+        'last': None,
+        'results': collections.Counter(),
+        'status': collections.Counter(),
+        'paths': collections.Counter(),
+        'path_hits': collections.Counter(),
+        'path_misses': collections.Counter(),
+        'path_bytes': collections.Counter(),
+        'edges': collections.Counter(),
+        'edge_hits': collections.Counter(),
+        'edge_misses': collections.Counter(),
+        'time_taken': collections.Counter()
+    }
+
+def records(lines):
+    """Parses raw (bytes) CloudFront log lines into Records, skipping
+    comment lines and honoring "#Fields:" headers.
+    """
+    index = dict(FIELDS)
+    for line in lines:
+        if line.startswith(b'#'):
+            if line.startswith(b'#Fields:'):
+                names = line[8:].split()
+                index = {
+                    f: names.index(f.encode()) for f in FIELDS
+                    if f.encode() in names
+                }
+            continue
+        fields = line.rstrip(b'\r\n').split(b'\t')
+        try:
+            yield Record(
+                fields[index['date']].decode(),
+                fields[index['x-edge-location']].decode(),
+                int(fields[index['sc-bytes']]),
+                fields[index['cs-uri-stem']].decode('utf-8', 'replace'),
+                int(fields[index['sc-status']]),
+                fields[index['x-edge-result-type']].decode(),
+                float(fields[index['time-taken']])
+            )
+        except (IndexError, KeyError, ValueError):
+            continue  # truncated or malformed line
+
+def aggregate(state, recs):
+    # whole batches go through C-implemented Counter updates and sums
+    recs = iter(recs)
+    while True:
+        batch = list(itertools.islice(recs, BATCH))
+        if not batch:
+            return state
+        aggregate_columns(state, *zip(*batch))
+
+def aggregate_columns(state, dates, edges, sizes, uris, status, results,
+    taken):
+    """Adds one batch of log lines, given as one sequence per Record field,
+    to the aggregates in state.
+    """
+    state['lines'] += len(uris)
+    state['bytes'] += sum(sizes)
+    first, last = min(dates), max(dates)
+    state['first'] = min(state['first'] or first, first)
+    state['last'] = max(state['last'] or last, last)
+    state['results'].update(results)
+    state['status'].update(s // 100 * 100 for s in status)
+    state['paths'].update(uris)
+    state['edges'].update(edges)
+    state['time_taken'].update(
+        int(math.log1p(t * 1000) * BINS_PER_E) for t in taken
+    )
+    for uri, edge, size, result in zip(uris, edges, sizes, results):
+        state['path_bytes'][uri] += size
+        if result in HITS:
+            state['path_hits'][uri] += 1
+            state['edge_hits'][edge] += 1
+        elif result in MISSES:
+            state['path_misses'][uri] += 1
+            state['edge_misses'][edge] += 1
+
+    if len(state['paths']) > MAX_PATHS:
+        fold(state)
+
+def fold(state):
+    # keep memory bounded: fold the least requested paths into "(other)"
+    keep = dict(state['paths'].most_common(MAX_PATHS // 2))
+    for counter in ('paths', 'path_hits', 'path_misses', 'path_bytes'):
+        other = sum(n for p, n in state[counter].items() if p not in keep)
+        state[counter] = collections.Counter(
+            {p: n for p, n in state[counter].items() if p in keep}
+        )
+        state[counter]['(other)'] += other
+
+def merge(state, other):
+    """Adds the aggregates of other into state."""
+    for key, value in other.items():
+        if isinstance(value, collections.Counter):
+            state[key].update(value)
+        elif key in ('lines', 'bytes'):
+            state[key] += value
+    for key, pick in (('first', min), ('last', max)):
+        values = [v for v in (state[key], other[key]) if v]
+        state[key] = pick(values) if values else None
+    return state
+
+def percentile(histogram, q):
+    total = sum(histogram.values())
+    if not total:
+        return 0.0
+    seen = 0
+    for bin_, n in sorted(histogram.items()):
+        seen += n
+        if seen >= q * total:
+            return math.expm1(bin_ / BINS_PER_E)  # milliseconds
+    return 0.0
+
+def ratio(hits, misses):
+    return hits / (hits + misses) if hits + misses else None
+
+def summary(state, top=25):
+    results = state['results']
+    hits = sum(results[r] for r in HITS)
+    misses = sum(results[r] for r in MISSES)
+    return {
+        'lines': state['lines'],
+        'first': state['first'],
+        'last': state['last'],
+        'bytes_served': state['bytes'],
+        'cache_hit_ratio': ratio(hits, misses),
+        'result_types': dict(results),
+        'status_classes': {str(k): v for k, v in state['status'].items()},
+        'time_taken_ms': {
+            'p50': percentile(state['time_taken'], 0.50),
+            'p95': percentile(state['time_taken'], 0.95),
+            'p99': percentile(state['time_taken'], 0.99)
+        },
+        'paths': [
+            {
+                'path': p,
+                'requests': n,
+                'bytes': state['path_bytes'][p],
+                'cache_hit_ratio': ratio(state['path_hits'][p],
+                    state['path_misses'][p])
+            }
+            for p, n in state['paths'].most_common(top)
+        ],
+        'edges': [
+            {
+                'edge': e,
+                'requests': n,
+                'cache_hit_ratio': ratio(state['edge_hits'][e],
+                    state['edge_misses'][e])
+            }
+            for e, n in state['edges'].most_common(top)
+        ],
+        'top_origin_misses': [
+            {'path': p, 'misses': n}
+            for p, n in state['path_misses'].most_common(top)
+        ]
+    }
+
+def load(path):
+    state = new_state()
+    if os.path.isfile(path):
+        with open(path) as f:
+            saved = json.load(f)['state']
+        for key, value in saved.items():
+            if isinstance(state.get(key), collections.Counter):
+                if key == 'time_taken' or key == 'status':
+                    value = {int(k): v for k, v in value.items()}
+                state[key] = collections.Counter(value)
+            else:
+                state[key] = value
+    return state
+
+def save(state, path):
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'summary': summary(state), 'state': state}, f)
+    os.replace(path + '.tmp', path)
+
+def render(report):
+    def pct(value):
+        return '-' if value is None else '{:.1%}'.format(value)
+
+    def table(title, columns, rows):
+        head = ''.join('<th>' + html.escape(c) + '</th>' for c in columns)
+        body = ''.join(
+            '<tr>' + ''.join('<td>' + html.escape(str(v)) + '</td>'
+            for v in row) + '</tr>' for row in rows
+        )
+        return '<h2>' + title + '</h2><table><tr>' + head + '</tr>' + \
+            body + '</table>'
+
+    taken = report['time_taken_ms']
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        '<title>Site Access Report</title><style>'
+        'body{font-family:sans-serif;margin:2em}'
+        'table{border-collapse:collapse;margin-bottom:2em}'
+        'td,th{border:1px solid #ccc;padding:4px 8px;text-align:left}'
+        '</style></head><body><h1>Site Access Report</h1>' +
+        table('Overview', ['Metric', 'Value'], [
+            ['Period', str(report['first']) + ' to ' + str(report['last'])],
+            ['Requests', '{:,}'.format(report['lines'])],
+            ['Bytes served', '{:,}'.format(report['bytes_served'])],
+            ['Cache hit ratio (hits / (hits + misses))',
+                pct(report['cache_hit_ratio'])],
+            ['time-taken p50 / p95 / p99 (ms)', '{:.0f} / {:.0f} / {:.0f}'
+                .format(taken['p50'], taken['p95'], taken['p99'])]
+        ]) +
+        table('Result Types', ['Result', 'Requests'],
+            sorted(report['result_types'].items(), key=lambda r: -r[1])) +
+        table('Status Classes', ['Status', 'Requests'],
+            sorted(report['status_classes'].items())) +
+        table('Top Paths', ['Path', 'Requests', 'Bytes', 'Cache hit ratio'],
+            [[p['path'], p['requests'], p['bytes'],
+            pct(p['cache_hit_ratio'])] for p in report['paths']]) +
+        table('Edge Locations', ['Edge', 'Requests', 'Cache hit ratio'],
+            [[e['edge'], e['requests'], pct(e['cache_hit_ratio'])]
+            for e in report['edges']]) +
+        table('Top Origin Misses', ['Path', 'Misses'],
+            [[m['path'], m['misses']] for m in report['top_origin_misses']]) +
+        '</body></html>'
+    )
+
+def read(paths):
+    # plain or gzipped files, or stdin for "-"
+    for path in paths:
+        if path == '-':
+            yield from sys.stdin.buffer
+        else:
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rb') as f:
+                yield from f
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: log_report.py report_dir log_file [log_file ...|-]')
+        sys.exit(1)
+    print(main(sys.argv[1], read(sys.argv[2:])))
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import array
+import calendar
+import datetime
+import json
+import mmap
+import os
+import re
+import sys
+
+# include custom modules
+import log_report
+
+STORE = 'store'
+INDEX = 'index.json'
+
+# column file => (Record field, array typecode); uri, edge and result hold
+# codes into the partition's dictionary
+COLUMNS = {
+    'status.u16': ('status', 'H'),
+    'bytes.u64': ('bytes', 'Q'),
+    'time_taken.f32': ('time_taken', 'f'),
+    'uri.u32': ('uri', 'I'),
+    'edge.u16': ('edge', 'H'),
+    'result.u8': ('result', 'B')
+}
+ENCODED = ('uri', 'edge', 'result')
+FLUSH_ROWS = 500000  # rows buffered before appending to disk
+
+def compact(site_log, paths, prune=True):
+    """Compacts raw CloudFront log files into daily columnar partitions
+    under site_log/store, one directory per date.
+
+    Each partition holds typed arrays for status, bytes and time-taken, and
+    dictionary-encoded uri, edge location and result type, so reports read
+    only the days they cover, memory-mapped. New logs for a day already
+    compacted are appended to its partition. The index of rows per day is
+    saved last, so an interrupted compact leaves the store as it was and
+    can simply be rerun. With prune, the raw files are removed once
+    compacted.
+
+    Returns the number of rows compacted.
+    """
+    import log_fetch  # here, so reading the store doesn't load boto3
+
+    store = os.path.join(site_log, STORE)
+    os.makedirs(store, exist_ok=True)
+    index = load_index(store)
+    date, buffer = None, None
+    rows = 0
+
+    # logs come in date order, so only the current day is buffered; it is
+    # appended when the date changes or FLUSH_ROWS rows are held
+    for record in log_report.records(log_fetch.lines(paths)):
+        if record.date != date or len(buffer['status']) >= FLUSH_ROWS:
+            if buffer:
+                append(store, index, date, buffer)
+            date = record.date
+            buffer = {f: [] for f, _ in COLUMNS.values()}
+        for field, value in zip(log_report.Record._fields, record):
+            if field in buffer:
+                buffer[field].append(value)
+        rows += 1
+
+    if buffer:
+        append(store, index, date, buffer)
+    save_index(store, index)
+
+    if prune:
+        for path in paths:
+            os.remove(path)
+
+    return rows
+
+def append(store, index, date, buffer):
+    partition = os.path.join(store, date)
+    os.makedirs(partition, exist_ok=True)
+
+    dictionary = load_json(os.path.join(partition, 'dict.json'),
+        {f: [] for f in ENCODED})
+    for field in ENCODED:
+        codes = {v: i for i, v in enumerate(dictionary[field])}
+        encoded = []
+        for value in buffer[field]:
+            if value not in codes:
+                codes[value] = len(dictionary[field])
+                dictionary[field].append(value)
+            encoded.append(codes[value])
+        buffer[field] = encoded
+
+    # rows past the indexed count were appended by a compact that didn't
+    # finish (the index is saved last); drop them so columns stay aligned
+    indexed = index.get(date, 0)
+    for name, (field, typecode) in COLUMNS.items():
+        with open(os.path.join(partition, name), 'ab') as f:
+            f.truncate(indexed * array.array(typecode).itemsize)
+            array.array(typecode, buffer[field]).tofile(f)
+    save_json(os.path.join(partition, 'dict.json'), dictionary)
+
+    index[date] = index.get(date, 0) + len(buffer['status'])
+
+def load_json(path, default):
+    if not os.path.isfile(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+def save_json(path, data):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+def load_index(store):
+    return load_json(os.path.join(store, INDEX), {})
+
+def save_index(store, index):
+    save_json(os.path.join(store, INDEX), index)
+
+def parse_range(text, today=None):
+    """Returns (first, last) ISO dates for a report range given as "7d"
+    (last 7 days), "YYYY-MM", "YYYY-MM-DD" or "YYYY-MM-DD:YYYY-MM-DD".
+    """
+    today = today or datetime.date.today()
+    match = re.match(r'^(\d+)d$', text)
+    if match:
+        first = today - datetime.timedelta(days=int(match.group(1)) - 1)
+        return first.isoformat(), today.isoformat()
+    match = re.match(r'^(\d{4})-(\d{2})$', text)
+    if match:
+        year, month = int(match.group(1)), int(match.group(2))
+        last = calendar.monthrange(year, month)[1]
+        return '{}-01'.format(text), '{}-{:02d}'.format(text, last)
+    if re.match(r'^\d{4}-\d{2}-\d{2}(:\d{4}-\d{2}-\d{2})?$', text):
+        first, _, last = text.partition(':')
+        return first, last or first
+    raise ValueError('Invalid report range: ' + text)
+
+def report(site_log, first, last, batch=log_report.BATCH):
+    """Aggregates the partitions from first to last (ISO dates, inclusive)
+    and writes the report for that range; returns its HTML path.
+    """
+    store = os.path.join(site_log, STORE)
+    index = load_index(store)
+    state = log_report.new_state()
+
+    for date in sorted(d for d in index if first <= d <= last and index[d]):
+        partition = os.path.join(store, date)
+        dictionary = load_json(os.path.join(partition, 'dict.json'), {})
+        files, columns = [], {}
+        try:
+            for name, (field, typecode) in COLUMNS.items():
+                f = open(os.path.join(partition, name), 'rb')
+                files.append(f)
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                files.append(mm)
+                columns[field] = memoryview(mm).cast(typecode)
+
+            rows = index[date]
+            for start in range(0, rows, batch):
+                end = min(start + batch, rows)
+                decoded = {
+                    f: [dictionary[f][c] for c in columns[f][start:end]]
+                    for f in ENCODED
+                }
+                log_report.aggregate_columns(
+                    state,
+                    [date] * (end - start),
+                    decoded['edge'],
+                    columns['bytes'][start:end],
+                    decoded['uri'],
+                    columns['status'][start:end],
+                    decoded['result'],
+                    columns['time_taken'][start:end]
+                )
+        finally:
+            columns.clear()  # views must be released before their mmap
+            for f in reversed(files):
+                f.close()
+
+    name = '_report-' + first + ('' if first == last else '_' + last) + \
+        '.html'
+    return log_report.write(state, os.path.join(site_log, name))
+
+def uris(site_log, first, last):
+    """Yields the URI of every request logged from first to last (ISO
+    dates, inclusive), in log order; for replaying the traffic.
+    """
+    store = os.path.join(site_log, STORE)
+    index = load_index(store)
+    for date in sorted(d for d in index if first <= d <= last and index[d]):
+        partition = os.path.join(store, date)
+        dictionary = load_json(os.path.join(partition, 'dict.json'), {})
+        codes = array.array(COLUMNS['uri.u32'][1])
+        with open(os.path.join(partition, 'uri.u32'), 'rb') as f:
+            codes.frombytes(f.read())
+        for code in codes[:index[date]]:
+            yield dictionary['uri'][code]
+
+def raw_logs(site_log):
+    # raw files left in site_log are the ones not compacted yet
+    return sorted(
+        e.path for e in os.scandir(site_log)
+        if e.is_file() and e.name.endswith('.gz')
+    )
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        print('Compacted {:,} rows'.format(
+            compact(sys.argv[1], raw_logs(sys.argv[1]))))
+    elif len(sys.argv) == 3:
+        print(report(sys.argv[1], *parse_range(sys.argv[2])))
+    else:
+        print('Usage: log_store.py site_log_dir [range]')
+        sys.exit(1)
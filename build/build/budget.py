@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import concurrent.futures
+import getopt
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+import statistics
+import sys
+from html.parser import HTMLParser
+from itertools import repeat
+from urllib.parse import unquote, urlsplit
+
+# include custom modules
+import precompress
+
+# KB transferred (compressed) per page by asset type, and per single asset;
+# build/budget.json ({"js": 200, ...}) overrides any of them
+BUDGETS = {
+    'total': 1024,
+    'html': 100,
+    'css': 100,
+    'js': 170,
+    'image': 700,
+    'font': 200,
+    'asset': 300
+}
+CONFIG = 'build/budget.json'
+SITE_CONFIG = 'config.toml'     # Hugo's, for the site's own hosts
+REPORT = 'build/.budget-report.json'
+TYPES = {
+    '.html': 'html', '.css': 'css', '.js': 'js', '.mjs': 'js',
+    '.png': 'image', '.jpg': 'image', '.jpeg': 'image', '.gif': 'image',
+    '.webp': 'image', '.svg': 'image', '.ico': 'image', '.avif': 'image',
+    '.woff': 'font', '.woff2': 'font', '.ttf': 'font', '.otf': 'font',
+    '.eot': 'font'
+}
+WEIGHED = ('html', 'css', 'js', 'image', 'font', 'other', 'total')
+LINK_RELS = ('stylesheet', 'icon', 'preload', 'modulepreload')
+MIN_INLINE = 1024       # bytes; smaller repeated inline blocks are ignored
+TOP = 10                # offenders listed per check
+
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+CSS_IMPORT = re.compile(r'@import\s+([\'"])([^\'"]+)\1')
+FONT_FACE = re.compile(r'@font-face\s*{[^}]*}')
+FONT_SRC = re.compile(r'\bsrc\s*:\s*([^;}]+)')
+BASE_URL = re.compile(r'^\s*baseURL\s*=\s*[\'"]([^\'"]+)[\'"]', re.M | re.I)
+
+def main(public='public', budgets=None, workers=None, report_path=None,
+    top=TOP, hosts=None):
+    """Checks what a build would publish against performance budgets.
+
+    Every HTML page under public is parsed for the stylesheets, scripts,
+    images and icons it loads, and stylesheets for the fonts and images
+    they load (only the first source of an @font-face, the one browsers
+    fetch). A page's weight per asset type is what it transfers, raw and
+    compressed as publish.py uploads it; each asset is measured once
+    however many pages share it. Pages are scanned on a process pool and
+    folded in as they finish, so tens of thousands of pages stay fast.
+
+    Flags assets over the single asset budget, assets that aren't
+    fingerprinted (so are cached for a day only), missing assets, and
+    bytes duplicated across pages: identical files under different names
+    and the same inline <script>/<style> repeated on many pages. Writes a
+    JSON summary next to the build and prints how page weights moved
+    since the last one.
+
+    URLs on hosts (by default the host of baseURL in the site's
+    config.toml, and its www. twin) are the site's own: canonifyurls makes
+    every asset link absolute, and those are weighed like relative ones.
+
+    Returns False if a page or an asset is over budget.
+    """
+    site = os.path.dirname(os.path.abspath(public))
+    if hosts is None:
+        hosts = site_hosts(os.path.join(site, SITE_CONFIG))
+    hosts = frozenset(h.lower() for h in hosts)
+    if budgets is None:
+        budgets = load_budgets(os.path.join(site, CONFIG))
+    if report_path is None:
+        report_path = os.path.join(site, REPORT)
+    limits = {k: v * 1024 for k, v in budgets.items()}
+
+    pages = {}      # page key => {'raw', 'gz', 'refs'}
+    inline = {}     # inline block hash => [size, pages it is on]
+    external = set()
+    assets = {}     # asset key => measure()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        for key, raw, gz, refs, blocks in pool.map(scan_page,
+            html_files(public), repeat(public), repeat(hosts), chunksize=64):
+            pages[key] = {'raw': raw, 'gz': gz, 'refs': local_refs(refs,
+                external)}
+            for digest, size in blocks:
+                inline.setdefault(digest, [size, 0])[1] += 1
+
+        # assets pages load, then what the stylesheets among them load
+        todo = set().union(*(p['refs'] for p in pages.values()))
+        while todo:
+            for key, entry in pool.map(measure, sorted(todo),
+                repeat(public), repeat(hosts), chunksize=16):
+                entry['refs'] = local_refs(entry['refs'], external)
+                assets[key] = entry
+            todo = set().union(*(a['refs'] for a in assets.values())) - \
+                set(assets)
+
+    closures = {}
+    weights = {}    # page key => {type: compressed bytes, 'raw': bytes}
+    for key, page in pages.items():
+        loaded = set()
+        for ref in page['refs']:
+            loaded |= closure(ref, assets, closures)
+        weight = dict.fromkeys(WEIGHED, 0)
+        weight['html'] = page['gz']
+        weight['raw'] = page['raw']
+        for ref in loaded:
+            if assets[ref]['exists']:
+                weight[asset_type(ref)] += assets[ref]['gz']
+                weight['raw'] += assets[ref]['raw']
+        weight['total'] = sum(weight[t] for t in WEIGHED if t != 'total')
+        weights[key] = weight
+
+    over = sorted(
+        ((weight[t] - limits[t], key, t) for key, weight in weights.items()
+            for t in WEIGHED if t in limits and weight[t] > limits[t]),
+        reverse=True
+    )
+    found = {k: a for k, a in assets.items() if a['exists']}
+    oversized = sorted((a['gz'], k) for k, a in found.items()
+        if a['gz'] > limits.get('asset', float('inf')))[::-1]
+    bundles = precompress.fingerprinted(os.path.join(site, 'data',
+        'manifest.json'))
+    uncached = sorted((a['gz'], k) for k, a in found.items()
+        if k not in bundles and not precompress.is_fingerprinted(k))[::-1]
+    missing = sorted(k for k, a in assets.items() if not a['exists'])
+    duplicates = duplicate_files(found)
+    repeated = sorted(((size * count, count, size) for size, count in
+        inline.values() if count > 1 and size >= MIN_INLINE), reverse=True)
+
+    summary = summarize(weights, len(found))
+    print_report(public, summary, load_previous(report_path), limits, over,
+        oversized, uncached, missing, duplicates, repeated, external, top)
+    with open(report_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    return not over and not oversized
+
+def load_budgets(config):
+    budgets = dict(BUDGETS)
+    if os.path.isfile(config):
+        with open(config) as f:
+            budgets.update(json.load(f))
+    return budgets
+
+def site_hosts(config):
+    # baseURL = "https://example.com/" => {'example.com', 'www.example.com'}
+    if not os.path.isfile(config):
+        return set()
+    with open(config) as f:
+        match = BASE_URL.search(f.read())
+    host = urlsplit(match.group(1)).netloc.lower() if match else ''
+    if not host:
+        return set()
+    bare = host[4:] if host.startswith('www.') else host
+    return {bare, 'www.' + bare}
+
+def html_files(public):
+    # streamed, so the pool starts on pages while the walk goes on
+    for root, dirs, names in os.walk(public):
+        dirs.sort()
+        for name in sorted(names):
+            if name.endswith('.html'):
+                yield os.path.relpath(os.path.join(root, name),
+                    public).replace(os.sep, '/')
+
+def local_refs(refs, external):
+    local = set()
+    for ref in refs:
+        if ref.startswith('//') or '://' in ref:
+            external.add(ref)
+        else:
+            local.add(sys.intern(ref))
+    return local
+
+def resolve(base, url, hosts=()):
+    # a page or stylesheet URL => key under public, or the URL if external;
+    # absolute URLs on the site's own hosts are paths under public too
+    parts = urlsplit(url.strip())
+    if parts.scheme in ('data', 'mailto', 'javascript', 'tel'):
+        return None
+    if parts.netloc and parts.netloc.lower() in hosts and \
+        parts.scheme in ('', 'http', 'https'):
+        path = unquote(parts.path) or '/'
+    elif parts.scheme or parts.netloc:
+        return url.strip()
+    else:
+        path = unquote(parts.path)
+    if not path:
+        return None
+    if not path.startswith('/'):
+        path = posixpath.join(posixpath.dirname('/' + base), path)
+    key = posixpath.normpath(path).lstrip('/')
+    if path.endswith('/') or not posixpath.splitext(key)[1]:
+        key = posixpath.join(key, 'index.html').lstrip('/')
+    return key
+
+def compressed_size(key, data):
+    # what publish.py would upload: gzip copies of text assets worth it
+    if not key.endswith(precompress.COMPRESSIBLE) or \
+        len(data) < precompress.MIN_SIZE:
+        return len(data)
+    packed = len(gzip.compress(data, 9, mtime=0))
+    if packed > len(data) * (1 - precompress.MIN_SAVING):
+        return len(data)
+    return packed
+
+class PageParser(HTMLParser):
+    """Collects the URLs a page loads and its inline script/style blocks."""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.refs = []
+        self.blocks = []
+        self.inline = None  # text of the inline block being read
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'link':
+            rels = (attrs.get('rel') or '').lower().split()
+            if attrs.get('href') and any(r in LINK_RELS for r in rels):
+                self.refs.append(attrs['href'])
+        elif tag == 'script':
+            if attrs.get('src'):
+                self.refs.append(attrs['src'])
+            else:
+                self.inline = []
+        elif tag == 'style':
+            self.inline = []
+        elif tag == 'img' and attrs.get('src'):
+            # srcset candidates are alternatives; src stands for them
+            self.refs.append(attrs['src'])
+        elif tag == 'video' and attrs.get('poster'):
+            self.refs.append(attrs['poster'])
+
+    def handle_data(self, data):
+        if self.inline is not None:
+            self.inline.append(data)
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style') and self.inline is not None:
+            text = ''.join(self.inline).strip().encode('utf-8')
+            if text:
+                self.blocks.append((hashlib.sha1(text).hexdigest(),
+                    len(text)))
+            self.inline = None
+
+def scan_page(key, public, hosts=()):
+    with open(os.path.join(public, key), 'rb') as f:
+        data = f.read()
+    parser = PageParser()
+    parser.feed(data.decode('utf-8', 'replace'))
+    parser.close()
+    refs = {resolve(key, url, hosts) for url in parser.refs} - {None}
+    return key, len(data), compressed_size(key, data), refs, parser.blocks
+
+def measure(key, public, hosts=()):
+    """Size, compressed size and content hash of an asset, and what it
+    loads when it is a stylesheet.
+    """
+    path = os.path.join(public, key)
+    if not os.path.isfile(path):
+        return key, {'exists': False, 'raw': 0, 'gz': 0, 'hash': None,
+            'refs': set()}
+    with open(path, 'rb') as f:
+        data = f.read()
+    refs = set()
+    if key.endswith('.css'):
+        css = data.decode('utf-8', 'replace')
+        urls = [m.group(2) for m in CSS_IMPORT.finditer(css)]
+        for face in FONT_FACE.findall(css):
+            for src in FONT_SRC.findall(face):
+                first = CSS_URL.search(src)
+                if first:
+                    urls.append(first.group(2))
+        urls += [m.group(2) for m in CSS_URL.finditer(FONT_FACE.sub('', css))]
+        refs = {resolve(key, url, hosts) for url in urls} - {None}
+    return key, {
+        'exists': True,
+        'raw': len(data),
+        'gz': compressed_size(key, data),
+        'hash': hashlib.sha256(data).hexdigest(),
+        'refs': refs
+    }
+
+def closure(key, assets, closures):
+    # an asset and everything it loads, through any depth of @import
+    if key not in closures:
+        closures[key] = {key}  # guards against import cycles
+        loaded = {key}
+        for ref in assets[key]['refs']:
+            loaded |= closure(ref, assets, closures)
+        closures[key] = loaded
+    return closures[key]
+
+def asset_type(key):
+    return TYPES.get(posixpath.splitext(key)[1].lower(), 'other')
+
+def duplicate_files(found):
+    # the same bytes under several names are downloaded and cached twice
+    names = {}
+    for key, asset in found.items():
+        names.setdefault(asset['hash'], []).append(key)
+    return sorted(
+        ((found[keys[0]]['gz'] * (len(keys) - 1), sorted(keys))
+            for keys in names.values() if len(keys) > 1),
+        reverse=True
+    )
+
+def summarize(weights, assets):
+    summary = {'pages': len(weights), 'assets': assets, 'weights': {}}
+    for t in WEIGHED + ('raw',):
+        values = [w[t] for w in weights.values()] or [0]
+        summary['weights'][t] = {
+            'median': int(statistics.median(values)),
+            'max': max(values)
+        }
+    return summary
+
+def load_previous(report_path):
+    if not os.path.isfile(report_path):
+        return None
+    with open(report_path) as f:
+        return json.load(f)
+
+def print_report(public, summary, previous, limits, over, oversized,
+    uncached, missing, duplicates, repeated, external, top):
+    print('Performance budget of {}: {} pages, {} assets'.format(public,
+        summary['pages'], summary['assets']))
+    print('{:<8}{:>12}{:>12}{:>10}{:>10}'.format('Type', 'Median', 'Max',
+        'Budget', 'Change'))
+    for t in WEIGHED + ('raw',):
+        weight = summary['weights'][t]
+        change = ''
+        if previous and previous['weights'].get(t, {}).get('median'):
+            was = previous['weights'][t]['median']
+            change = '{:+.0f}%'.format(100 * (weight['median'] - was) / was)
+        print('{:<8}{:>12}{:>12}{:>10}{:>10}'.format(t,
+            human(weight['median']), human(weight['max']),
+            human(limits[t]) if t in limits else '', change))
+
+    if over:
+        print('\nPages over budget: {}'.format(len({key for _, key, _ in
+            over})))
+        for excess, key, t in over[:top]:
+            print('  {} {} +{}'.format(key, t, human(excess)))
+    if oversized:
+        print('\nAssets over {} compressed:'.format(human(limits['asset'])))
+        for size, key in oversized[:top]:
+            print('  {} {}'.format(key, human(size)))
+    if uncached:
+        print('\nNot fingerprinted, cached for a day only: {} asset(s)'.format(
+            len(uncached)))
+        for size, key in uncached[:top]:
+            print('  {} {}'.format(key, human(size)))
+    if missing:
+        print('\nMissing: {} referenced asset(s)'.format(len(missing)))
+        for key in missing[:top]:
+            print('  ' + key)
+    if duplicates:
+        print('\nDuplicate files: {} wasted'.format(
+            human(sum(d[0] for d in duplicates))))
+        for wasted, keys in duplicates[:top]:
+            print('  {} {}'.format(' = '.join(keys), human(wasted)))
+    if repeated:
+        print('\nInline blocks repeated across pages: {} in total'.format(
+            human(sum(r[0] for r in repeated))))
+        for total, count, size in repeated[:top]:
+            print('  {} on {} pages'.format(human(size), count))
+    if external:
+        print('\nExternal assets, not weighed: {}'.format(len(external)))
+
+    print('\nBudget ' + ('exceeded' if over or oversized else 'met'))
+
+def human(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024 or unit == 'MB':
+            return '{:.0f}{}'.format(size, unit) if unit == 'B' else \
+                '{:.1f}{}'.format(size, unit)
+        size /= 1024
+
+def usage():
+    print('Usage: budget.py [--workers N] [--budget TYPE=KB ...] '
+        '[--report FILE] [--top N] [--host HOST ...] [public dir]')
+    print('Types: ' + ', '.join(BUDGETS))
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'w:b:r:t:H:h',
+            ['workers=', 'budget=', 'report=', 'top=', 'host=', 'help'])
+    except getopt.error as err:
+        print(err)
+        usage()
+        sys.exit(1)
+
+    kwargs = {}
+    overrides = {}
+    for opt, val in opts:
+        if opt in ('-w', '--workers'):
+            kwargs['workers'] = int(val)
+        elif opt in ('-b', '--budget'):
+            name, _, kb = val.partition('=')
+            if name not in BUDGETS or not kb.isdigit():
+                usage()
+                sys.exit(1)
+            overrides[name] = int(kb)
+        elif opt in ('-r', '--report'):
+            kwargs['report_path'] = val
+        elif opt in ('-t', '--top'):
+            kwargs['top'] = int(val)
+        elif opt in ('-H', '--host'):
+            kwargs.setdefault('hosts', []).append(val)
+        elif opt in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    public = args[0] if args else 'public'
+    if overrides:
+        site = os.path.dirname(os.path.abspath(public))
+        kwargs['budgets'] = dict(load_budgets(os.path.join(site, CONFIG)),
+            **overrides)
+
+    sys.exit(0 if main(public, **kwargs) else 1)
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import concurrent.futures
+import getopt
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+
+# include 3rd party modules; Pillow is optional, without it only SVGs are
+# optimized and raster images are published as they are
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+RASTER = ('.png', '.jpg', '.jpeg')
+VECTOR = ('.svg',)
+QUALITY = 85            # JPEG re-encode quality
+WEBP_QUALITY = 80
+WIDTHS = (480, 960, 1600)   # responsive variant widths, in pixels
+MIN_SAVING = 0.05       # keep an optimized copy at least 5% smaller
+SKIP = ('favicons',)    # directories whose images keep their exact format
+
+# where pages get image names from (relative to the site source), and the
+# text files there searched; webpack's manifest lists every image, so it
+# isn't a reference
+SOURCES = ('config.toml', 'content', 'layouts', 'themes', 'data', 'static',
+    'assets')
+TEXT = ('.html', '.md', '.markdown', '.toml', '.yaml', '.yml', '.json',
+    '.css', '.js', '.xml', '.txt')
+NOT_REFERENCES = ('data/manifest.json',)
+IMAGE_NAME = re.compile(r'[\w.-]+\.(?:png|jpe?g)\b', re.I)
+
+# SVG elements whose whitespace is content
+PRESERVE = re.compile(r'(<(text|pre|style|script|title|desc)\b.*?</\2\s*>)',
+    re.S)
+
+# webpack output names carry a 10 character hash, e.g. logo.1a2b3c4d5e.png;
+# variants keep it last (logo-480w.1a2b3c4d5e.png) so they stay immutable
+FINGERPRINT = re.compile(r'(\.[0-9a-f]{10})?(\.[^./]+)$')
+VARIANT = re.compile(r'-\d+w(\.[0-9a-f]{10})?\.[^./]+$')
+
+def main(images='static/img', cache_dir=None, workers=None, quality=QUALITY,
+    widths=WIDTHS):
+    """Optimizes the images webpack copied to static/img, in place, before
+    Hugo picks them up: lossless PNG recompression, progressive JPEGs
+    re-encoded at quality, metadata stripped and minified SVGs. Each PNG or
+    JPEG that the site's content, templates, config or styles name also
+    gets a WebP copy (logo.webp) and resized variants (logo-480w.png,
+    logo-480w.webp) for every width narrower than itself, for
+    srcset/<picture> markup.
+
+    Images are optimized in a process pool, and the results are cached in
+    cache_dir by content hash (and settings), so an unchanged image is
+    never processed again; files this writes are remembered too, so a
+    rerun over its own output does nothing. Prints bytes saved per image.
+
+    Returns {path: {'original', 'optimized', 'webp', 'variants'}}.
+    """
+    site = os.path.dirname(os.path.dirname(os.path.abspath(images)))
+    if cache_dir is None:
+        cache_dir = os.path.join(site, 'build', '.image-cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    settings = {'quality': quality, 'webp': WEBP_QUALITY,
+        'widths': sorted(widths), 'pillow': Image is not None}
+    named = referenced(site, images)
+
+    found = {}  # path => cache key
+    copies = {} # path => whether it gets WebP and resized copies
+    for root, dirs, names in os.walk(images):
+        dirs[:] = sorted(dirs)
+        for name in sorted(names):
+            if name.lower().endswith(RASTER + VECTOR) and \
+                not VARIANT.search(name):
+                path = os.path.join(root, name)
+                copies[path] = not skipped(images, path) and (named is None
+                    or name in named or FINGERPRINT.sub(r'\2', name) in named)
+                found[path] = cache_key(path, settings, copies[path])
+
+    done = {}  # path => cache key of the image it was optimized from
+    for path, key in found.items():
+        source = finished(os.path.join(cache_dir, key + '.done'), images)
+        if source:
+            done[path] = source
+    todo = {p: key for p, key in found.items()
+        if p not in done and not os.path.isdir(os.path.join(cache_dir, key))}
+    if todo and Image is None and any(p.lower().endswith(RASTER) for p in
+        todo):
+        print('images.py: Pillow not installed; only SVGs are optimized '
+            '(pip3 install Pillow)')
+
+    errors = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(optimize, path, os.path.join(cache_dir, key),
+                settings, copies[path]): path
+            for path, key in todo.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                errors[futures[future]] = e  # left as it is
+
+    report = {}
+    used = set()
+    for path, key in found.items():
+        if path in done:
+            used |= {key + '.done', done[path]}
+            continue
+        if path in errors:
+            continue
+        report[path] = apply(os.path.join(cache_dir, key), path)
+        used.add(key)
+        # what the image is now, and its copies, is finished
+        done_key = cache_key(path, settings, copies[path]) + '.done'
+        with open(os.path.join(cache_dir, done_key), 'w') as f:
+            json.dump({'source': key, 'copies': [os.path.relpath(p, images)
+                for p in report[path]['files'] if p != path]}, f)
+        used.add(done_key)
+
+    print_report(images, report, set(todo), errors, len(done))
+    prune(cache_dir, used)
+    return report
+
+def cache_key(path, settings, variants=True):
+    digest = hashlib.sha256(json.dumps(dict(settings, variants=variants),
+        sort_keys=True).encode())
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def finished(marker, images):
+    # an image already optimized, as long as its copies are still there;
+    # returns the cache key of its source image
+    if not os.path.isfile(marker):
+        return None
+    with open(marker) as f:
+        done = json.load(f)
+    if all(os.path.isfile(os.path.join(images, c)) for c in done['copies']):
+        return done['source']
+    return None
+
+def referenced(site, images):
+    # names of the PNGs and JPEGs the site's text files mention, or None
+    # when the images aren't in a site source (then every one is)
+    if not os.path.isfile(os.path.join(site, 'config.toml')):
+        return None
+    names = set()
+    skip = {os.path.join(site, p) for p in NOT_REFERENCES}
+    for source in SOURCES:
+        full = os.path.join(site, source)
+        files = [full] if os.path.isfile(full) else []
+        for root, dirs, found in os.walk(full):
+            dirs[:] = [d for d in dirs if d != 'node_modules' and
+                os.path.join(root, d) != os.path.abspath(images)]
+            files += [os.path.join(root, n) for n in found]
+        for path in files:
+            if path.lower().endswith(TEXT) and path not in skip:
+                with open(path, encoding='utf-8', errors='replace') as f:
+                    names.update(IMAGE_NAME.findall(f.read()))
+    return names
+
+def skipped(images, path):
+    parts = os.path.relpath(path, images).split(os.sep)[:-1]
+    return any(part in SKIP for part in parts)
+
+def optimize(src, entry, settings, variants=True):
+    """Writes src's optimized copy, WebP copy and variants to the cache
+    entry directory, with their sizes in meta.json; runs in a worker.
+    """
+    with open(src, 'rb') as f:
+        data = f.read()
+    ext = os.path.splitext(src)[1].lower()
+    meta = {'original': len(data), 'optimized': len(data), 'webp': None,
+        'variants': {}}
+    files = {}
+
+    if ext in VECTOR:
+        files['image'] = minify_svg(data)
+    elif Image is not None:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        # EXIF is dropped, so apply its orientation first, for every copy
+        image = ImageOps.exif_transpose(image)
+        files['image'] = encode(image, ext, settings)
+        if variants:
+            files['webp'] = encode(image, '.webp', settings)
+            width, height = image.size
+            for w in settings['widths']:
+                if w >= width:
+                    continue
+                small = resizable(image).resize(
+                    (w, max(1, round(height * w / width))), Image.LANCZOS)
+                files[str(w)] = encode(small, ext, settings)
+                files[str(w) + '.webp'] = encode(small, '.webp', settings)
+
+    # only keep what is worth it
+    if len(files.get('image', data)) > len(data) * (1 - MIN_SAVING):
+        files.pop('image', None)
+    else:
+        meta['optimized'] = len(files['image'])
+    if 'webp' in files:
+        if len(files['webp']) < meta['optimized']:
+            meta['webp'] = len(files['webp'])
+        else:
+            del files['webp']
+    for name, packed in files.items():
+        if name.isdigit():
+            meta['variants'][name] = len(packed)
+
+    tmp = entry + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, packed in files.items():
+        with open(os.path.join(tmp, name), 'wb') as f:
+            f.write(packed)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, entry)
+
+def resizable(image):
+    # palette images resize badly; resample them in full colour
+    if image.mode in ('P', '1', 'LA', 'I;16'):
+        return image.convert('RGBA' if 'transparency' in image.info or
+            image.mode == 'LA' else 'RGB')
+    return image
+
+def encode(image, ext, settings):
+    buf = io.BytesIO()
+    if ext == '.png':
+        # lossless; text chunks and other metadata aren't carried over
+        image.save(buf, 'PNG', optimize=True)
+    elif ext in ('.jpg', '.jpeg'):
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(buf, 'JPEG', quality=settings['quality'], optimize=True,
+            progressive=True)
+    else:
+        image = resizable(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB')
+        image.save(buf, 'WEBP', quality=settings['webp'], method=6)
+    return buf.getvalue()
+
+def minify_svg(data):
+    # comments, metadata and whitespace between tags and within them; the
+    # prolog (XML declaration, doctype and any entities it declares) is
+    # kept as it is, and so are elements whose whitespace is content
+    text = data.decode('utf-8')
+    root = re.search(r'<(?![?!])', text)
+    start = root.start() if root else len(text)
+    prolog, text = text[:start].strip(), text[start:]
+    text = re.sub(r'<!--.*?-->', '', text, flags=re.S)
+    text = re.sub(r'<metadata\b.*?</metadata>', '', text, flags=re.S)
+    parts = PRESERVE.split(text)
+    for i in range(0, len(parts), 3):   # split() puts groups in between
+        part = re.sub(r'>\s+<', '><', parts[i])
+        part = re.sub(r'^\s+(?=<)|(?<=>)\s+$', '', part)
+        parts[i] = re.sub(r'[ \t\r\n]+', ' ', part)
+    text = ''.join(p for i, p in enumerate(parts) if i % 3 != 2).strip()
+    return ((prolog + '\n' if prolog else '') + text).encode('utf-8')
+
+def variant_path(path, suffix, ext=None):
+    # logo.1a2b3c4d5e.png => logo-480w.1a2b3c4d5e.png, or .webp with ext
+    def sub(match):
+        return suffix + (match.group(1) or '') + (ext or match.group(2))
+    return FINGERPRINT.sub(sub, path, count=1)
+
+def apply(entry, path):
+    # copies a cache entry's files over/next to the image
+    with open(os.path.join(entry, 'meta.json')) as f:
+        meta = json.load(f)
+    meta['files'] = []
+    for name in sorted(os.listdir(entry)):
+        if name == 'meta.json':
+            continue
+        if name == 'image':
+            dst = path
+        elif name == 'webp':
+            dst = variant_path(path, '', '.webp')
+        elif name.endswith('.webp'):
+            dst = variant_path(path, '-' + name[:-5] + 'w', '.webp')
+        else:
+            dst = variant_path(path, '-' + name + 'w')
+        shutil.copyfile(os.path.join(entry, name), dst)
+        meta['files'].append(dst)
+    return meta
+
+def print_report(images, report, processed, errors, unchanged):
+    original = sum(r['original'] for r in report.values())
+    optimized = sum(r['optimized'] for r in report.values())
+    for path in sorted(processed):
+        if path not in report:
+            continue
+        r = report[path]
+        saved = r['original'] - r['optimized']
+        print('{:<48}{:>9} => {:>9}  -{:>3.0f}%{}{}'.format(
+            os.path.relpath(path, images)[-48:], human(r['original']),
+            human(r['optimized']), 100 * saved / (r['original'] or 1),
+            '  webp ' + human(r['webp']) if r['webp'] else '',
+            '  +{} variants'.format(len(r['variants']))
+                if r['variants'] else ''))
+    for path, error in sorted(errors.items()):
+        print('{:<48}failed: {}'.format(os.path.relpath(path, images)[-48:],
+            error))
+    print('Optimized {} images ({} cached, {} already optimized), saved {} '
+        'of {}'.format(len(processed & set(report)),
+        len(set(report) - processed), unchanged,
+        human(original - optimized), human(original)))
+
+def human(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024 or unit == 'MB':
+            return '{:.0f}{}'.format(size, unit) if unit == 'B' else \
+                '{:.1f}{}'.format(size, unit)
+        size /= 1024
+
+def prune(cache_dir, used):
+    # drop cached results of images no longer in the site
+    for entry in os.scandir(cache_dir):
+        if entry.name not in used:
+            if entry.is_dir():
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+
+def usage():
+    print('Usage: images.py [--workers N] [--cache-dir DIR] [--quality Q] '
+        '[--widths 480,960,...] [image dir]')
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'w:c:q:W:h',
+            ['workers=', 'cache-dir=', 'quality=', 'widths=', 'help'])
+    except getopt.error as err:
+        print(err)
+        usage()
+        sys.exit(1)
+
+    kwargs = {}
+    for opt, val in opts:
+        if opt in ('-w', '--workers'):
+            kwargs['workers'] = int(val)
+        elif opt in ('-c', '--cache-dir'):
+            kwargs['cache_dir'] = val
+        elif opt in ('-q', '--quality'):
+            kwargs['quality'] = int(val)
+        elif opt in ('-W', '--widths'):
+            kwargs['widths'] = [int(w) for w in val.split(',') if w]
+        elif opt in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    main(*args, **kwargs)
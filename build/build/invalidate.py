@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import getopt
+import os
+import sys
+import time
+from urllib.parse import quote
+
+# include 3rd party modules
+import boto3
+
+# include custom modules
+import precompress
+
+def main(distribution=None, keys=(), budget=10, wait=False,
+    manifest='data/manifest.json'):
+    """Invalidates only the CloudFront paths touched by a publish, instead of
+    throwing away the whole edge cache with "/*".
+
+    Changed and deleted S3 keys are mapped to URL paths (index.html also as
+    its directory path), fingerprinted webpack output (bundles listed by the
+    manifest plugin, hashed file names) is skipped since its names change
+    with its content, and the rest is collapsed into as few wildcard paths as needed
+    to stay within budget. Submits one invalidation and optionally waits
+    for it to complete.
+
+    Returns the invalidated paths.
+    """
+    if distribution is None:
+        distribution = os.environ['CF_DISTRO']
+
+    bundles = precompress.fingerprinted(manifest)
+    keys = {
+        k for k in keys
+        if k not in bundles and not precompress.is_fingerprinted(k)
+    }
+    paths = plan(keys, budget)
+
+    if not paths:
+        print('No CloudFront paths to invalidate')
+        return paths
+
+    print('Invalidating {} CloudFront paths for {} changed objects:'.format(
+        len(paths), len(keys)))
+    for path in paths:
+        print('  ' + path)
+
+    cloudfront = boto3.client('cloudfront')
+    response = cloudfront.create_invalidation(
+        DistributionId=distribution,
+        InvalidationBatch={
+            'Paths': {'Quantity': len(paths), 'Items': paths},
+            'CallerReference': 'publish-' + str(time.time())
+        }
+    )
+    invalidation = response['Invalidation']['Id']
+    print('Invalidation created: ' + invalidation)
+
+    if wait:
+        start = time.monotonic()
+        waiter = cloudfront.get_waiter('invalidation_completed')
+        waiter.wait(
+            DistributionId=distribution,
+            Id=invalidation,
+            WaiterConfig={'Delay': 5, 'MaxAttempts': 180}
+        )
+        print('Invalidation completed in {:.0f}s'.format(
+            time.monotonic() - start))
+
+    return paths
+
+def url_paths(keys):
+    paths = set()
+    for key in keys:
+        paths.add('/' + key)
+        if key == 'index.html' or key.endswith('/index.html'):
+            paths.add('/' + key[:-len('index.html')])
+    return paths
+
+def plan(keys, budget):
+    """Maps S3 keys to URL paths, then collapses directories into "dir/*"
+    wildcards, deepest and largest first, until at most budget paths are
+    left. Deepest first keeps as much of the edge cache as possible.
+    """
+    paths = url_paths(keys)
+    if len(paths) <= budget:
+        return sorted(quote(p, safe='/*~') for p in paths)
+
+    # directory tree; each node: {'paths': set(), 'dirs': {}}
+    tree = {'paths': set(), 'dirs': {}}
+    for path in paths:
+        node = tree
+        parts = path[1:].split('/')
+        for part in parts[:-1]:
+            node = node['dirs'].setdefault(part, {'paths': set(), 'dirs': {}})
+        node['paths'].add(path)
+
+    levels = {}  # depth => [(prefix, node)]
+    stack = [('/', tree, 0)]
+    while stack:
+        prefix, node, depth = stack.pop()
+        levels.setdefault(depth, []).append((prefix, node))
+        for name, child in node['dirs'].items():
+            stack.append((prefix + name + '/', child, depth + 1))
+
+    def count(node):
+        if node.get('collapsed'):
+            return 1
+        return len(node['paths']) + sum(count(c) for c in node['dirs'].values())
+
+    total = len(paths)
+    for depth in sorted(levels, reverse=True):
+        if total <= budget:
+            break
+        nodes = sorted(levels[depth], key=lambda n: count(n[1]), reverse=True)
+        for prefix, node in nodes:
+            size = count(node)
+            if total <= budget or size < 2:
+                break
+            node['collapsed'] = True
+            total -= size - 1
+
+    result = []
+    stack = [('/', tree)]
+    while stack:
+        prefix, node = stack.pop()
+        if node.get('collapsed'):
+            result.append(prefix + '*')
+            continue
+        result.extend(node['paths'])
+        for name, child in node['dirs'].items():
+            stack.append((prefix + name + '/', child))
+
+    return sorted(quote(p, safe='/*~') for p in result)
+
+def usage():
+    print('Usage: invalidate.py [--budget N] [--wait] [--distribution ID] '
+        'key [key ...]')
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'b:wd:h',
+            ['budget=', 'wait', 'distribution=', 'help'])
+    except getopt.error as err:
+        print(err)
+        usage()
+        sys.exit(1)
+
+    kwargs = {}
+    for opt, val in opts:
+        if opt in ('-b', '--budget'):
+            kwargs['budget'] = int(val)
+        elif opt in ('-w', '--wait'):
+            kwargs['wait'] = True
+        elif opt in ('-d', '--distribution'):
+            kwargs['distribution'] = val
+        elif opt in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    main(keys=args, **kwargs)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import concurrent.futures
+import gzip
+import json
+import mimetypes
+import os
+import re
+
+COMPRESSIBLE = ('.html', '.css', '.js', '.svg', '.json', '.xml', '.txt')
+MIN_SIZE = 1024         # bytes; smaller files aren't worth compressing
+MIN_SAVING = 0.1        # keep compressed copies at least 10% smaller
+IMMUTABLE = 'public, max-age=31536000, immutable'
+HTML_TTL = 300          # seconds
+DEFAULT_TTL = 86400     # seconds; matches the old default object caching
+
+# webpack output names carry a 10 character hash, e.g. bundle.1a2b3c4d5e.js
+FINGERPRINT = re.compile(r'\.[0-9a-f]{10}\.[^./]+$')
+
+def main(public, local, cache_dir, manifest='data/manifest.json',
+    workers=None, html_ttl=HTML_TTL):
+    """Prepares the files of a publish for upload: gzip-compressed copies
+    of text assets and per-type Cache-Control.
+
+    local is the {key: {'hash', 'size'}} content-hash map of public.
+    Compression runs in a process pool, and compressed copies are cached
+    in cache_dir by content hash, so unchanged files are never compressed
+    again. Fingerprinted webpack bundles (from the manifest plugin output)
+    are marked immutable for a year, HTML gets a short TTL.
+
+    Returns {key: {'path', 'size', 'meta'}}, where path is the file to
+    upload, size its size and meta the upload's ExtraArgs.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    bundles = fingerprinted(manifest)
+
+    jobs = {
+        key: os.path.join(cache_dir, entry['hash'] + '.gz')
+        for key, entry in local.items()
+        if key.endswith(COMPRESSIBLE) and entry['size'] >= MIN_SIZE
+    }
+    fresh = [
+        key for key, dst in jobs.items()
+        if not os.path.isfile(dst) and not os.path.isfile(dst + '.skip')
+    ]
+    # identical files share a copy: compress each content once, or workers
+    # would race writing the same cache file
+    todo = {jobs[key]: os.path.join(public, key) for key in fresh}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(compress, todo.values(), todo.keys(), chunksize=64))
+
+    print('Precompressed {} of {} text assets ({} cached)'.format(
+        len(fresh), len(jobs), len(jobs) - len(fresh)))
+
+    prepared = {}
+    for key, entry in local.items():
+        path = os.path.join(public, key)
+        meta = {}
+        content_type = mimetypes.guess_type(key)[0]
+        if content_type:
+            meta['ContentType'] = content_type
+        if key in bundles or is_fingerprinted(key):
+            meta['CacheControl'] = IMMUTABLE
+        elif key.endswith('.html'):
+            meta['CacheControl'] = 'public, max-age=' + str(html_ttl)
+        else:
+            meta['CacheControl'] = 'public, max-age=' + str(DEFAULT_TTL)
+        if key in jobs and os.path.isfile(jobs[key]):
+            path = jobs[key]
+            meta['ContentEncoding'] = 'gzip'
+        prepared[key] = {
+            'path': path,
+            'size': os.path.getsize(path),
+            'meta': meta
+        }
+
+    prune(cache_dir, set(jobs.values()))
+    return prepared
+
+def is_fingerprinted(key):
+    return FINGERPRINT.search(key) is not None
+
+def fingerprinted(manifest):
+    # webpack-manifest-plugin output: {"bundle.js": "/js/bundle.<hash>.js"}
+    if not os.path.isfile(manifest):
+        return set()
+    with open(manifest) as f:
+        return {v.lstrip('/') for v in json.load(f).values()}
+
+def pack(data):
+    """Returns the gzip copy of data that would be uploaded, or None when
+    compression doesn't save enough.
+    """
+    packed = gzip.compress(data, 9, mtime=0)  # mtime=0: same input, same bytes
+    if len(packed) > len(data) * (1 - MIN_SAVING):
+        return None
+    return packed
+
+def compress(src, dst):
+    with open(src, 'rb') as f:
+        packed = pack(f.read())
+    if packed is None:
+        open(dst + '.skip', 'w').close()  # remember it isn't worth it
+        return
+    with open(dst + '.tmp', 'wb') as f:
+        f.write(packed)
+    os.replace(dst + '.tmp', dst)
+
+def prune(cache_dir, used):
+    # drop cached copies of content no longer in the site
+    used |= {p + '.skip' for p in used}
+    for entry in os.scandir(cache_dir):
+        if entry.path not in used:
+            os.remove(entry.path)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import concurrent.futures
+import getopt
+import hashlib
+import json
+import os
+import sys
+import time
+
+# include 3rd party modules
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# include custom modules
+import invalidate
+import precompress
+
+MANIFEST_KEY = 'publish/manifest.json'
+MULTIPART_THRESHOLD = 8 * 1024 * 1024  # bytes; larger assets go multipart
+
+def main(public='public', bucket=None, manifest_bucket=None, workers=16,
+    dry_run=False, distribution=None, budget=10, wait=False, cache_dir=None,
+    html_ttl=precompress.HTML_TTL):
+    """Publishes the Hugo output directory to the site's S3 bucket, uploading
+    only what changed since the last publish.
+
+    A content-hash manifest of what is live is kept in the site's log bucket
+    (log.<bucket>), so no bucket listing or mtime comparison is needed. New
+    and changed files are uploaded over a pooled, multi-threaded client
+    (multipart for large assets) and removed files are deleted in batches
+    of 1000 keys. Text assets go up gzip-compressed, with Cache-Control set
+    per type (see precompress.py); a change of either metadata also counts
+    as a change. Given a CloudFront distribution id, the published keys are
+    then invalidated (see invalidate.py).
+
+    Returns a dict of the keys uploaded and deleted, for CDN invalidation.
+    """
+    if bucket is None:
+        bucket = os.environ['S3_BUCKET']
+    if manifest_bucket is None:
+        manifest_bucket = 'log.' + bucket
+    site = os.path.dirname(os.path.abspath(public))
+    webpack_manifest = os.path.join(site, 'data', 'manifest.json')
+    if cache_dir is None:
+        cache_dir = os.path.join(site, 'build', '.publish-cache')
+
+    start = time.monotonic()
+    s3 = client(workers)
+
+    local = hash_tree(public, workers)
+    prepared = precompress.main(public, local, cache_dir, webpack_manifest,
+        html_ttl=html_ttl)
+    for key, entry in local.items():
+        entry['meta'] = ';'.join(
+            k + '=' + v for k, v in sorted(prepared[key]['meta'].items())
+        )
+
+    live = load_manifest(s3, manifest_bucket)
+    if live is None:
+        print('No publish manifest found; listing s3://' + bucket + '...')
+        live = list_bucket(s3, bucket)
+
+    changed, deleted = diff(local, live)
+
+    print('Publishing ' + public + ' => s3://' + bucket + ': ' +
+        str(len(changed)) + ' changed, ' + str(len(deleted)) + ' deleted, ' +
+        str(len(local) - len(changed)) + ' unchanged')
+
+    if dry_run:
+        for key in changed:
+            print('  upload: ' + key)
+        for key in deleted:
+            print('  delete: ' + key)
+        return {'uploaded': changed, 'deleted': deleted}
+
+    failed = upload(s3, prepared, bucket, changed, workers)
+    failed += delete(s3, bucket, deleted, workers)
+
+    # failed keys keep their old manifest entry, so the next run retries them
+    manifest = dict(local)
+    for key in failed:
+        if key in live:
+            manifest[key] = live[key]
+        else:
+            manifest.pop(key, None)
+    save_manifest(s3, manifest_bucket, manifest)
+
+    uploaded = [k for k in changed if k not in failed]
+    removed = [k for k in deleted if k not in failed]
+    sent = sum(prepared[k]['size'] for k in uploaded)
+    print('Published {} objects ({:,} bytes), deleted {} objects in '
+        '{:.1f}s'.format(len(uploaded), sent, len(removed),
+        time.monotonic() - start))
+
+    # the manifest now records what did go out as live, so invalidate it
+    # even when some keys failed; later runs won't see it as changed
+    if distribution:
+        invalidate.main(distribution, uploaded + removed, budget, wait,
+            webpack_manifest)
+
+    if failed:
+        print('Failed to publish {} objects:'.format(len(failed)))
+        for key in failed:
+            print('  ' + key)
+        sys.exit(1)
+
+    return {'uploaded': uploaded, 'deleted': removed}
+
+def client(workers):
+    # one client is thread safe; size its connection pool to the worker count
+    return boto3.client('s3', config=Config(
+        max_pool_connections=workers * 2,
+        retries={'max_attempts': 10}
+    ))
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_tree(public, workers):
+    """Returns {key: {'hash', 'size'}} for every file under public."""
+    paths = {}
+    for root, dirs, files in os.walk(public):
+        for name in files:
+            path = os.path.join(root, name)
+            key = os.path.relpath(path, public).replace(os.sep, '/')
+            paths[key] = path
+
+    # hashlib releases the GIL on large buffers, so threads hash in parallel
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        hashes = dict(zip(paths, pool.map(file_hash, paths.values())))
+
+    return {
+        key: {'hash': hashes[key], 'size': os.path.getsize(path)}
+        for key, path in paths.items()
+    }
+
+def load_manifest(s3, manifest_bucket):
+    try:
+        body = s3.get_object(Bucket=manifest_bucket, Key=MANIFEST_KEY)['Body']
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+    return json.loads(body.read().decode('utf-8'))
+
+def save_manifest(s3, manifest_bucket, manifest):
+    s3.put_object(
+        Bucket=manifest_bucket,
+        Key=MANIFEST_KEY,
+        Body=json.dumps(manifest, sort_keys=True).encode('utf-8'),
+        ContentType='application/json'
+    )
+
+def list_bucket(s3, bucket):
+    # unknown hashes; forces a full upload but finds keys to delete
+    live = {}
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket):
+        for obj in page.get('Contents', []):
+            live[obj['Key']] = {'hash': None, 'size': obj['Size']}
+    return live
+
+def diff(local, live):
+    changed = sorted(
+        k for k, v in local.items()
+        if k not in live or live[k]['hash'] != v['hash'] or
+            live[k].get('meta') != v['meta']
+    )
+    deleted = sorted(k for k in live if k not in local)
+    return changed, deleted
+
+def upload(s3, prepared, bucket, keys, workers):
+    transfer = TransferConfig(
+        multipart_threshold=MULTIPART_THRESHOLD,
+        multipart_chunksize=MULTIPART_THRESHOLD,
+        max_concurrency=4
+    )
+
+    def put(key):
+        s3.upload_file(prepared[key]['path'], bucket, key,
+            ExtraArgs=prepared[key]['meta'], Config=transfer)
+
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(put, key): key for key in keys}
+        for future in concurrent.futures.as_completed(futures):
+            if future.exception():
+                print('  upload failed: ' + futures[future] + ': ' +
+                    str(future.exception()))
+                failed.append(futures[future])
+    return failed
+
+def delete(s3, bucket, keys, workers):
+    def delete_batch(batch):
+        response = s3.delete_objects(Bucket=bucket, Delete={
+            'Objects': [{'Key': k} for k in batch],
+            'Quiet': True
+        })
+        return [e['Key'] for e in response.get('Errors', [])]
+
+    batches = [keys[i:i + 1000] for i in range(0, len(keys), 1000)]
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for errors in pool.map(delete_batch, batches):
+            failed += errors
+    return failed
+
+def usage():
+    print('Usage: publish.py [--dry-run] [--workers N] '
+        '[--manifest-bucket NAME] [--cache-dir DIR] [--html-ttl SECONDS] '
+        '[--distribution ID [--budget N] [--wait]] [public dir] [bucket]')
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'nw:m:c:t:d:b:Wh',
+            ['dry-run', 'workers=', 'manifest-bucket=', 'cache-dir=',
+            'html-ttl=', 'distribution=', 'budget=', 'wait', 'help'])
+    except getopt.error as err:
+        print(err)
+        usage()
+        sys.exit(1)
+
+    kwargs = {}
+    for opt, val in opts:
+        if opt in ('-n', '--dry-run'):
+            kwargs['dry_run'] = True
+        elif opt in ('-w', '--workers'):
+            kwargs['workers'] = int(val)
+        elif opt in ('-m', '--manifest-bucket'):
+            kwargs['manifest_bucket'] = val
+        elif opt in ('-c', '--cache-dir'):
+            kwargs['cache_dir'] = val
+        elif opt in ('-t', '--html-ttl'):
+            kwargs['html_ttl'] = int(val)
+        elif opt in ('-d', '--distribution'):
+            kwargs['distribution'] = val
+        elif opt in ('-b', '--budget'):
+            kwargs['budget'] = int(val)
+        elif opt in ('-W', '--wait'):
+            kwargs['wait'] = True
+        elif opt in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    main(*args, **kwargs)
@@ -1,22 +1,30 @@
 #!/usr/bin/env python3
 
 # include standard modules
+import hashlib
+import json
 import os
 import signal
 import sys
-
+import time
+from functools import partial
 
 # include 3rd party modules
 import boto3
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, WaiterError
 from colorama import init, Fore
-from halo import Halo
 
 # include custom modules
-import key_gen
+import bucket_drain
 import dev_env
+import key_gen
+import resolver
+import spans
+import stack_watch
+import task_graph
 
-def main(domain=None, email=None):
+@spans.trace('install')
+def main(domain=None, email=None, site='Static-Site'):
     """Create/Update/Delete CloudFormation stack to deploy S3 static website.
 
     Launches two CloudFormation stacks that create:
@@ -34,11 +42,15 @@ def main(domain=None, email=None):
         - One CodeBuild project
 
     Resources will be created in region us-east-1, for ACM
-    certificate/CloudFront compatibility.
+    certificate/CloudFront compatibility. Stacks are named after site (see
+    stack_names); fleet.py deploys many sites this way.
 
     Script checks for existing stack and if found, prompts to
     push CloudFormation template changes via an update or rollback deployment
-    via a delete.
+    via a delete. Updates go through change sets, which are previewed and
+    confirmed first (see prepare_updates). Once every stack has been
+    prompted for, the chosen operations run concurrently, streaming stack
+    events as resources finish.
     """
 
     print(Fore.WHITE + '\n### Static Site Install ###' + Fore.RESET)
@@ -52,41 +64,24 @@ def main(domain=None, email=None):
     home = os.path.expanduser('~/')
     site_path = home + domain
     region = 'us-east-1' # overide any local AWS config; needed for ACM cert
-    repo_base = 'git-codecommit.us-east-1.amazonaws.com'
-    repo_https = 'https://' + repo_base + '/v1/repos/' + domain
-    repo_ssh = 'ssh://' + repo_base + '/v1/repos/' + domain
-    site = 'Static-Site'
-    stack_site = site
-    stack_cicd = site + '-CICD'
-    stacks = [site, stack_cicd]
-
-    account = boto3.client('sts').get_caller_identity()['Account']
-    s3 = boto3.resource('s3', region_name=region)
+    repo_ssh = 'ssh://' + key_gen.ssh_host(site) + '/v1/repos/' + domain
+    stack_site, stack_cicd = stack_names(site)
+    stacks = [stack_site, stack_cicd]
+
+    account = resolver.account()
     cf = boto3.client('cloudformation', region_name=region)
 
+    ops = {}  # stack => (action, template, params); run once all prompted
+
     for stack in stacks:
-        params = [{"ParameterKey": "DomainName","ParameterValue": domain}]
-
-        if stack == stack_site:
-            deploy_tpl = './cfn/site.cfn.yaml'
-            params = params + [
-                {"ParameterKey": "SiteName","ParameterValue": stack_site}
-            ]
-        if stack == stack_cicd:
-            deploy_tpl = './cfn/cicd.cfn.yaml'
-            params = params + [
-                {"ParameterKey": "RepoURL","ParameterValue": repo_https},
-                {"ParameterKey": "EmailAddress","ParameterValue": email},
-                {"ParameterKey": "SiteName","ParameterValue": stack_cicd}
-            ]
-
-        try:
-            cf.describe_stacks(StackName=stack)
-        except ClientError as e:
-            if e.response['Error']['Message'].endswith('does not exist'):
-                launch_stack(
-                    cf, deploy_tpl, domain, params, s3, stack_site, stack
-                )
+        deploy_tpl, params = stack_params(stack, domain, email, stack_site,
+            stack_cicd)
+
+        # always a fresh lookup here; it decides between create and update
+        if resolver.describe(stack, region, fresh=True) is None:
+            if stack == stack_site:
+                cert_notice()
+            ops[stack] = ('create', deploy_tpl, params)
         else:
             print(Fore.YELLOW + '\nExisting CloudFormation stack found:',
                 Fore.YELLOW + stack + '\n')
@@ -97,100 +92,332 @@ def main(domain=None, email=None):
             while True:
                 reply = str(input(prompt)).lower()
                 if reply[:1] == 'u':
-                    update_stack(cf, deploy_tpl, params, stack)
+                    ops[stack] = ('update', deploy_tpl, params)
                     break
                 elif reply[:1] == 'd':
                     if input(Fore.RED + '\nAre you sure you want to delete'
                         ' stack: ' + stack + ' (y/n)? ' +
                         Fore.RESET) == "y":
-                        delete_stack(cf, domain, region, s3, stack_site, stack)
+                        ops[stack] = ('delete', deploy_tpl, params)
                     break
                 elif reply[:1] == 's':
                     break
                 else:
                     print(Fore.RED + '\nInvalid... only S, U or D!\n')
 
-    key_gen.main()
+    prepare_updates(cf, ops, region)
 
-    dev_env.main(cf, domain, email, home, repo_ssh, site_path, stack_cicd)
+    run_stacks(cf, domain, ops, region, stack_site, stack_cicd)
+
+    key_gen.main((stack_site,))
+
+    dev_env.main(cf, domain, email, home, repo_ssh, site_path, stack_cicd,
+        stack_site)
+
+def stack_names(site):
+    # site stack and CICD stack
+    return site, site + '-CICD'
+
+def stack_params(stack, domain, email, stack_site, stack_cicd):
+    """Returns the template and parameters of the site or CICD stack."""
+    repo_https = 'https://' + key_gen.REPO_BASE + '/v1/repos/' + domain
+    params = [{"ParameterKey": "DomainName","ParameterValue": domain}]
 
-def launch_stack(cf, deploy_tpl, domain, params, s3, stack_site, stack):
     if stack == stack_site:
-        print(Fore.GREEN +
-            'Multiple certificate validation emails will be sent to:\n\n'
-            '  - WHOIS listed domain contacts\n'
-            '  - Administrator|hostmaster|postmaster|webmaster|admin'
-            '@your_domain_name\n\n'
-            'Click the approval link in ONE in order to finish deployment.'
-        )
-        wait = input(Fore.YELLOW + '\nPress enter to continue...\n')
+        deploy_tpl = './cfn/site.cfn.yaml'
+        params = params + [
+            {"ParameterKey": "SiteName","ParameterValue": stack_site}
+        ]
+    if stack == stack_cicd:
+        deploy_tpl = './cfn/cicd.cfn.yaml'
+        params = params + [
+            {"ParameterKey": "RepoURL","ParameterValue": repo_https},
+            {"ParameterKey": "EmailAddress","ParameterValue": email},
+            {"ParameterKey": "SiteName","ParameterValue": stack_cicd}
+        ]
+
+    # exports are account-wide; only the first site keeps the plain name
+    if stack_site != 'Static-Site':
+        params = params + [{"ParameterKey": "ArtifactStoreExport",
+            "ParameterValue": stack_site + '-ArtifactStore'}]
+
+    return deploy_tpl, params
 
+def cert_notice():
+    print(Fore.GREEN +
+        'Multiple certificate validation emails will be sent to:\n\n'
+        '  - WHOIS listed domain contacts\n'
+        '  - Administrator|hostmaster|postmaster|webmaster|admin'
+        '@your_domain_name\n\n'
+        'Click the approval link in ONE in order to finish deployment.'
+    )
+    wait = input(Fore.YELLOW + '\nPress enter to continue...\n')
+
+def run_stacks(cf, domain, ops, region, stack_site, stack_cicd):
+    """Runs the chosen stack operations concurrently, only ordering those
+    that really depend on each other:
+
+        - The CICD stack imports the site stack's ArtifactStore export, so it
+          is created after the site stack (which waits on ACM validation)
+        - The export can't be removed while imported, so the site stack is
+          deleted after the CICD stack; emptying its buckets doesn't wait
+        - Updates (change sets confirmed by prepare_updates) of both stacks
+          are independent
+
+    Returns the task results by stack (see task_graph.run).
+    """
+    action = {stack: op[0] for stack, op in ops.items()}
+    tasks = {}
+
+    for stack, (act, deploy_tpl, params) in ops.items():
+        if act == 'create':
+            deps = []
+            if stack == stack_cicd and action.get(stack_site) == 'create':
+                deps = [stack_site]
+            tasks[stack] = (
+                partial(launch_stack, cf, deploy_tpl, params, stack, region),
+                deps
+            )
+        elif act == 'execute':
+            # prepare_updates swapped template and params for the change set
+            tasks[stack] = (
+                partial(execute_change_set, cf, deploy_tpl, params, stack,
+                    region), []
+            )
+        elif act == 'delete':
+            deps = []
+            if stack == stack_site:
+                tasks['Site-Buckets'] = (
+                    partial(empty_buckets, domain, region), []
+                )
+                deps = ['Site-Buckets']
+                if action.get(stack_cicd) == 'delete':
+                    deps.append(stack_cicd)
+            tasks[stack] = (partial(delete_stack, cf, stack), deps)
+
+    if not tasks:
+        return {}
+
+    results = task_graph.run(tasks)
+
+    print(Fore.WHITE + '\nStack Operations:' + Fore.RESET)
+    for name, result in results.items():
+        if result['status'] == 'ok':
+            print(name + Fore.GREEN + ' \u2714' + Fore.RESET +
+                ' ({:.0f}s)'.format(result['seconds']))
+        elif result['status'] == 'failed':
+            print(name + Fore.RED + ' \u2718 ' + str(result['error']) +
+                Fore.RESET)
+        else:
+            print(name + Fore.YELLOW + ' skipped; depends on a failed '
+                'operation' + Fore.RESET)
+
+    return results
+
+def finish(cf, stack_id, stack, marker, verb):
+    # stream events until the operation settles, then raise if it failed
+    with spans.span('watch ' + stack, 'waiter'):
+        final, durations = stack_watch.watch_stack(cf, stack_id, stack,
+            marker)
+    resolver.invalidate(stack)  # outputs may have changed
+    stack_watch.print_durations(stack, durations)
+    if final not in stack_watch.SUCCESS_STATES:
+        raise RuntimeError(verb + ' ended in ' + final + '; see AWS web '
+            'console')
+
+def launch_stack(cf, deploy_tpl, params, stack, region):
     with open(deploy_tpl, 'r') as f:
         tmp_tpl = f.read()
 
     try:
-        cf.create_stack(
+        response = cf.create_stack(
             StackName=stack,
             TemplateBody=tmp_tpl,
             Parameters=params,
             Capabilities=['CAPABILITY_NAMED_IAM'],
             OnFailure='ROLLBACK'
         )
-
-        spinner = Halo(text='Launching: '+ stack, color='green').start()
-        waiter = cf.get_waiter('stack_create_complete')
-        waiter.wait(StackName=stack)
-        spinner.succeed(text='Deployed: '+ stack)
     except ClientError as e:
-        error_string = 'Waiter encountered a terminal failure state'
-        if e.response['Error']['Message'].endswith(error_string):
-            print(Fore.RED + error_string + '\nSee AWS web console')
+        raise RuntimeError(e.response['Error']['Message'])
+
+    stack_watch.echo(Fore.GREEN + 'Launching: ' + stack + Fore.RESET)
+    finish(cf, response['StackId'], stack, None, 'Launch')
+    resolver.record_deploy(stack, response['StackId'],
+        template_hash(deploy_tpl, params), region)
+
+def prepare_updates(cf, ops, region, confirm=None):
+    """Turns the chosen updates into confirmed change sets, in place.
+
+    A stack whose template and parameters hash the same as what was last
+    deployed to it from here is skipped without creating a change set.
+    Change sets for the rest are created concurrently; a change set without
+    changes is dropped, otherwise its resource-level changes are shown,
+    flagging replacements, and it is executed by run_stacks only once
+    confirmed: by prompting, or by confirm(stack, replaced) when given.
+
+    Returns {stack: error} of the change sets that couldn't be created.
+    """
+    tasks = {}
+    for stack, (act, deploy_tpl, params) in list(ops.items()):
+        if act != 'update':
+            continue
+        digest = template_hash(deploy_tpl, params)
+        found = resolver.describe(stack, region)
+        if found and resolver.deployed(stack, region) == \
+            {'id': found['id'], 'hash': digest}:
+            print(Fore.YELLOW + '\n' + stack + ' => unchanged since its last '
+                'deploy; skipped' + Fore.RESET)
+            del ops[stack]
+            continue
+        tasks[stack] = (
+            partial(create_change_set, cf, deploy_tpl, params, stack), []
+        )
+
+    if not tasks:
+        return {}
+
+    print(Fore.WHITE + '\nCreating change sets for: ' + ', '.join(tasks) +
+        Fore.RESET)
+    results = task_graph.run(tasks)
+    failed = {}
+
+    for stack, result in results.items():
+        deploy_tpl, params = ops[stack][1:]
+        del ops[stack]
+        if result['status'] != 'ok':
+            print(Fore.RED + '\n' + stack + ' => ' + str(result['error']) +
+                Fore.RESET)
+            failed[stack] = result['error']
+            continue
+
+        change_set = result['result']
+        if change_set is None:
+            print(Fore.YELLOW + '\n' + stack + ' => No updates are to be '
+                'performed.' + Fore.RESET)
+            resolver.record_deploy(stack, resolver.describe(stack, region)
+                ['id'], template_hash(deploy_tpl, params), region)
+            continue
+
+        replaced = print_changes(stack, change_set['Changes'])
+        if replaced:
+            print(Fore.RED + '\n' + str(replaced) + ' resource(s) will be '
+                'replaced!' + Fore.RESET)
+        if confirm(stack, replaced) if confirm else \
+            input(Fore.GREEN + '\nExecute change set for stack: ' + stack +
+            ' (y/n)? ' + Fore.RESET) == 'y':
+            ops[stack] = ('execute', change_set,
+                template_hash(deploy_tpl, params))
         else:
-            print(Fore.RED + e.response['Error']['Message'])
+            cf.delete_change_set(ChangeSetName=change_set['ChangeSetId'])
 
-def update_stack(cf, deploy_tpl, params, stack):
+    return failed
+
+def create_change_set(cf, deploy_tpl, params, stack):
+    # returns the described change set, or None if it has no changes
     with open(deploy_tpl, 'r') as f:
         tmp_tpl = f.read()
 
     try:
-        cf.update_stack(
+        response = cf.create_change_set(
             StackName=stack,
+            ChangeSetName=stack + '-' + time.strftime('%Y%m%d%H%M%S'),
+            ChangeSetType='UPDATE',
             TemplateBody=tmp_tpl,
             Parameters=params,
             Capabilities=['CAPABILITY_NAMED_IAM']
         )
+    except ClientError as e:
+        raise RuntimeError(e.response['Error']['Message'])
+
+    try:
+        with spans.span('change_set_create_complete ' + stack, 'waiter'):
+            cf.get_waiter('change_set_create_complete').wait(
+                ChangeSetName=response['Id'],
+                WaiterConfig={'Delay': 3, 'MaxAttempts': 100}
+            )
+    except WaiterError:
+        pass  # a failed change set is described below
+
+    change_set = cf.describe_change_set(ChangeSetName=response['Id'])
+    changes = change_set['Changes']
+    while change_set.get('NextToken'):
+        change_set = cf.describe_change_set(ChangeSetName=response['Id'],
+            NextToken=change_set['NextToken'])
+        changes += change_set['Changes']
+    change_set['Changes'] = changes
+
+    if change_set['Status'] == 'FAILED':
+        cf.delete_change_set(ChangeSetName=response['Id'])
+        reason = change_set.get('StatusReason', '')
+        if "didn't contain changes" in reason or \
+            'No updates are to be performed' in reason:
+            return None
+        raise RuntimeError(reason)
+
+    return change_set
+
+def print_changes(stack, changes):
+    # prints a change set's resource changes; returns how many get replaced
+    colors = {'Add': Fore.GREEN, 'Modify': Fore.YELLOW, 'Remove': Fore.RED}
+    replaced = 0
+
+    print(Fore.WHITE + '\nChange set for stack: ' + stack + Fore.RESET)
+    for change in changes:
+        rc = change['ResourceChange']
+        properties = sorted({
+            d['Target']['Name'] for d in rc.get('Details', [])
+            if d['Target'].get('Name')
+        })
+        line = '{}{:<7}{} {} ({})'.format(colors.get(rc['Action'], ''),
+            rc['Action'], Fore.RESET, rc['LogicalResourceId'],
+            rc['ResourceType'])
+        if properties:
+            line += ' ' + ', '.join(properties)
+        if rc.get('Replacement') == 'True':
+            replaced += 1
+            line += Fore.RED + ' => REPLACED' + Fore.RESET
+        elif rc.get('Replacement') == 'Conditional':
+            line += Fore.YELLOW + ' => may be replaced' + Fore.RESET
+        print('  ' + line)
+
+    return replaced
 
-        spinner = Halo(text='Updating: '+ stack, color='green').start()
-        waiter = cf.get_waiter('stack_update_complete')
-        waiter.wait(StackName=stack)
-        spinner.succeed(text='Updated: '+ stack)
+def execute_change_set(cf, change_set, digest, stack, region):
+    marker = stack_watch.last_event_id(cf, stack)
+
+    try:
+        cf.execute_change_set(ChangeSetName=change_set['ChangeSetId'])
     except ClientError as e:
-        error_string = 'No updates are to be performed.'
-        if e.response['Error']['Message'].endswith(error_string):
-            print(Fore.RED + '\n' + stack + ' => ' + error_string)
-        else:
-            print(Fore.RED + e.response['Error']['Message'])
+        raise RuntimeError(e.response['Error']['Message'])
 
-def delete_stack(cf, domain, region, s3, stack_site, stack):
-    if stack == stack_site:
-        buckets = [domain, 'log.' + domain, 'www.' + domain]
-        for b in buckets:
-            try:
-                s3.meta.client.head_bucket(Bucket=b)
-            except ClientError as e:
-                if e.response['Error']['Message'].endswith('does not exist'):
-                    pass
-            else:
-                # Bucket can't be deleted unless empty
-                bucket = s3.Bucket(b)
-                bucket.objects.all().delete()
+    stack_watch.echo(Fore.GREEN + 'Updating: ' + stack + Fore.RESET)
+    finish(cf, change_set['StackId'], stack, marker, 'Update')
+    resolver.record_deploy(stack, change_set['StackId'], digest, region)
+
+def template_hash(deploy_tpl, params):
+    # what a deploy depends on: template content and parameter values
+    with open(deploy_tpl, 'rb') as f:
+        digest = hashlib.sha256(f.read())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def empty_buckets(domain, region):
+    # Bucket can't be deleted unless empty, including old object versions
+    bucket_drain.main(
+        [domain, 'log.' + domain, 'www.' + domain],
+        region=region,
+        echo=stack_watch.echo
+    )
+
+def delete_stack(cf, stack):
+    # keep the stack ARN; events of a deleted stack are only found by ARN
+    stack_id = cf.describe_stacks(StackName=stack)['Stacks'][0]['StackId']
+    marker = stack_watch.last_event_id(cf, stack)
 
     cf.delete_stack(StackName=stack)
 
-    spinner = Halo(text='Deleting: '+ stack, color='green').start()
-    waiter = cf.get_waiter('stack_delete_complete')
-    waiter.wait(StackName=stack)
-    spinner.succeed(text='Deleted: '+ stack)
+    stack_watch.echo(Fore.GREEN + 'Deleting: ' + stack + Fore.RESET)
+    finish(cf, stack_id, stack, marker, 'Delete')
 
 def sigint_handler(signum, frame):
     # handles KeyboardInterrupt (ctrl + c ) a little prettier
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import concurrent.futures
+import getopt
+import json
+import random
+import re
+import sys
+import threading
+import time
+
+# include 3rd party modules
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from colorama import init, Fore
+
+# include custom modules
+import deploy
+import resolver
+import spans
+import stack_watch
+
+REGION = 'us-east-1'    # ACM certificates for CloudFront live here
+ACTIONS = ('deploy', 'delete')
+THROTTLE_CODES = ('Throttling', 'ThrottlingException', 'TooManyRequests',
+    'TooManyRequestsException', 'RequestLimitExceeded')
+MAX_ATTEMPTS = 5        # runs of one site when throttled
+BACKOFF_BASE = 5        # seconds; doubled per throttled attempt, jittered
+BACKOFF_CAP = 120       # seconds
+SETTLE_POLL = (5, 30)   # seconds between stack lookups while one settles
+
+@spans.trace('fleet')
+def main(inventory, action=None, workers=4, allow_replace=False):
+    """Deploys, updates or deletes every site of an inventory file, a few
+    sites at a time.
+
+    The inventory is JSON: {"sites": [{"domain", "email", "action"}]},
+    where action (deploy or delete, deploy by default) can be overridden
+    for all sites. Each site gets its own stacks, named after its domain
+    (see site_name), and with them its own IAM user, group and policies,
+    CodeBuild project, SNS topic and artifact store export.
+
+    Sites run on a bounded worker pool. AWS clients retry throttled calls
+    in botocore's adaptive mode, and a site whose run is still throttled is
+    retried with jittered exponential backoff while fewer sites are let run
+    at once (AIMD: halved on throttling, grown by one per site done). Stack
+    updates are executed without prompting, unless they replace resources
+    and allow_replace isn't set. Ends with a per-site result table.
+
+    Returns {domain: {'status', 'stacks', 'attempts', 'seconds', 'error'}}.
+    """
+    with open(inventory) as f:
+        sites = json.load(f)['sites']
+    for site in sites:
+        site['action'] = action or site.get('action', 'deploy')
+        if site['action'] not in ACTIONS:
+            raise ValueError(site['domain'] + ': unknown action ' +
+                site['action'])
+
+    cf = boto3.client('cloudformation', region_name=REGION, config=Config(
+        max_pool_connections=workers * 4,
+        retries={'mode': 'adaptive', 'max_attempts': 10}
+    ))
+    gate = Gate(workers)
+
+    print(Fore.WHITE + '\n### Static Site Fleet: {} sites, {} at a time '
+        '###'.format(len(sites), workers) + Fore.RESET)
+    if any(s['action'] == 'deploy' for s in sites):
+        print(Fore.YELLOW + '\nNew sites wait on ACM certificate validation; '
+            'approve the emails sent to their domain contacts.' + Fore.RESET)
+
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(run_site, cf, site, gate, allow_replace):
+                site['domain']
+            for site in sites
+        }
+        for future in concurrent.futures.as_completed(futures):
+            results[futures[future]] = future.result()
+
+    print_results(sites, results)
+    return results
+
+def site_name(domain):
+    # stack names allow letters, digits and hyphens only
+    return 'Site-' + re.sub(r'[^A-Za-z0-9]', '-', domain)
+
+def run_site(cf, site, gate, allow_replace):
+    domain = site['domain']
+    stack_site, stack_cicd = deploy.stack_names(site_name(domain))
+    start = time.monotonic()
+    attempt = 0
+
+    while True:
+        attempt += 1
+        error = None
+        with gate:
+            try:
+                stacks = deploy_site(cf, site, stack_site, stack_cicd,
+                    allow_replace)
+                errors = [r['error'] for r in stacks.values() if r['error']]
+                error = errors[0] if errors else None
+            except Exception as e:
+                stacks, error = {}, e
+
+        if error is None or not throttled(error) or attempt == MAX_ATTEMPTS:
+            break
+        gate.throttled()
+        delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 **
+            attempt))
+        stack_watch.echo(Fore.YELLOW + domain + ': throttled; retrying in '
+            '{:.0f}s'.format(delay) + Fore.RESET)
+        time.sleep(delay)
+
+    if error is None:
+        gate.succeeded()
+    return {
+        'status': 'failed' if error else 'ok',
+        'stacks': {s: r['status'] for s, r in stacks.items()},
+        'attempts': attempt,
+        'seconds': time.monotonic() - start,
+        'error': error
+    }
+
+def deploy_site(cf, site, stack_site, stack_cicd, allow_replace):
+    """Plans a site's stack operations from their current state, so a
+    retried run picks up where the last one stopped, then runs them.
+    """
+    ops = {}
+    for stack in (stack_site, stack_cicd):
+        found = settle(stack)
+        if found and found['status'] == 'ROLLBACK_COMPLETE' and \
+            site['action'] != 'delete':
+            # a create that failed; such a stack can only be deleted
+            stack_watch.echo(Fore.YELLOW + stack + ': creation had rolled '
+                'back; deleting it to create it again' + Fore.RESET)
+            deploy.delete_stack(cf, stack)
+            found = None
+
+        deploy_tpl, params = deploy.stack_params(stack, site['domain'],
+            site.get('email', ''), stack_site, stack_cicd)
+        if site['action'] == 'delete':
+            if found:
+                ops[stack] = ('delete', deploy_tpl, params)
+        elif found is None:
+            ops[stack] = ('create', deploy_tpl, params)
+        else:
+            ops[stack] = ('update', deploy_tpl, params)
+
+    declined = {}
+
+    def confirm(stack, replaced):
+        if replaced and not allow_replace:
+            declined[stack] = RuntimeError('change set replaces {} '
+                'resource(s); rerun with --allow-replace'.format(replaced))
+            return False
+        return True
+
+    failed = deploy.prepare_updates(cf, ops, REGION, confirm)
+    failed.update(declined)
+    results = deploy.run_stacks(cf, site['domain'], ops, REGION, stack_site,
+        stack_cicd)
+    for stack, error in failed.items():
+        results[stack] = {'status': 'failed', 'result': None, 'error': error,
+            'seconds': 0.0}
+    return results
+
+def settle(stack):
+    """Returns the stack (see resolver.describe) once an operation an
+    earlier run left in progress is over, or None if it doesn't exist.
+    """
+    poll, max_poll = SETTLE_POLL
+    found = resolver.describe(stack, REGION, fresh=True)
+    while found and found['status'].endswith('_IN_PROGRESS'):
+        stack_watch.echo(Fore.YELLOW + stack + ': waiting for ' +
+            found['status'] + Fore.RESET)
+        time.sleep(poll)
+        poll = min(poll * 2, max_poll)
+        found = resolver.describe(stack, REGION, fresh=True)
+    return found
+
+def throttled(error):
+    if isinstance(error, ClientError):
+        return error.response['Error']['Code'] in THROTTLE_CODES
+    return 'Rate exceeded' in str(error)
+
+class Gate:
+    """Bounds how many sites run at once; the bound adapts to throttling
+    (halved) and recovers by one per site succeeding, up to workers.
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self.limit = workers
+        self.running = 0
+        self.cond = threading.Condition()
+
+    def __enter__(self):
+        with self.cond:
+            while self.running >= self.limit:
+                self.cond.wait()
+            self.running += 1
+
+    def __exit__(self, *exc):
+        with self.cond:
+            self.running -= 1
+            self.cond.notify_all()
+
+    def throttled(self):
+        with self.cond:
+            self.limit = max(1, self.limit // 2)
+
+    def succeeded(self):
+        with self.cond:
+            self.limit = min(self.workers, self.limit + 1)
+            self.cond.notify_all()
+
+def print_results(sites, results):
+    print(Fore.WHITE + '\nFleet Results:' + Fore.RESET)
+    print('{:<32}{:<8}{:>8}{:>9}  {}'.format('Domain', 'Action', 'Time',
+        'Attempts', 'Stacks'))
+    for site in sites:
+        result = results[site['domain']]
+        stacks = ', '.join(s + ' ' + status for s, status in
+            result['stacks'].items()) or 'no changes'
+        color = Fore.GREEN if result['status'] == 'ok' else Fore.RED
+        print(color + '{:<32}{:<8}{:>7.0f}s{:>9}  {}'.format(site['domain'],
+            site['action'], result['seconds'], result['attempts'], stacks) +
+            Fore.RESET)
+        if result['error']:
+            print(Fore.RED + '  ' + str(result['error']) + Fore.RESET)
+
+    failed = sum(r['status'] != 'ok' for r in results.values())
+    print('\n{} sites ok, {} failed'.format(len(results) - failed, failed))
+
+def usage():
+    print('Usage: fleet.py [--action deploy|delete] [--workers N] '
+        '[--allow-replace] inventory.json')
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'a:w:rh',
+            ['action=', 'workers=', 'allow-replace', 'help'])
+    except getopt.error as err:
+        print(err)
+        usage()
+        sys.exit(1)
+
+    kwargs = {}
+    for opt, val in opts:
+        if opt in ('-a', '--action'):
+            kwargs['action'] = val
+        elif opt in ('-w', '--workers'):
+            kwargs['workers'] = int(val)
+        elif opt in ('-r', '--allow-replace'):
+            kwargs['allow_replace'] = True
+        elif opt in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    if len(args) != 1:
+        usage()
+        sys.exit(1)
+
+    results = main(args[0], **kwargs)
+    sys.exit(0 if all(r['status'] == 'ok' for r in results.values()) else 1)
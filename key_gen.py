@@ -3,140 +3,262 @@
 # include standard modules
 import getpass
 import os
+import random
+import stat
 import subprocess
 import sys
+import tempfile
 import time
+from functools import partial
 
 # include 3rd party modules
 import boto3
 from colorama import init, Fore
 
-def main():
-    """Generates RSA public key to be used for git access to AWS CodeCommit
-    repository. Generates locally, adds SSH alias to config, then uploads to
-    AWS IAM user.
+# include custom modules
+import resolver
+import spans
+import stack_watch
+import task_graph
+
+REPO_BASE = 'git-codecommit.us-east-1.amazonaws.com'
+DEADLINE = 120      # seconds a new key may take to work for CodeCommit
+PROBE_BASE = 0.5    # seconds; first readiness probe backoff, then doubled
+PROBE_CAP = 8       # seconds; longest backoff between probes
+
+@spans.trace('keypair')
+def main(sites=('Static-Site',), rotate=None, deadline=DEADLINE):
+    """Generates RSA key pairs used for git access to AWS CodeCommit
+    repositories, one per site: generates locally, uploads to the site's
+    AWS IAM user and adds an SSH alias to config.
+
+    Sites whose IAM user already has keys are rotated (or skipped) as
+    answered per site, unless rotate says so for all. Keys are rotated
+    concurrently, without breaking git access meanwhile: the new key is
+    uploaded next to the old ones, probed with non-interactive SSH logins
+    under exponential backoff with jitter until CodeCommit accepts it (all
+    within one deadline), and only then replaces the old keys in IAM, the
+    ssh-agent and the SSH config. A key that never works is withdrawn.
+
+    Returns {site: new SSH public key id} of the sites rotated.
     """
     home = os.path.expanduser('~/')
-    site = 'Static-Site'
-    site_key = home + '.ssh/' + site + '-Key'
-    repo_base = 'git-codecommit.us-east-1.amazonaws.com'
     iam = boto3.client('iam')
-    response = iam.list_ssh_public_keys(UserName=site + '-Admin')
 
     print(Fore.WHITE + '\nRSA Key Generation:' + Fore.RESET)
 
-    # check if list inside dict has an element
-    if len(response['SSHPublicKeys']) > 0:
-        print(Fore.YELLOW + '\nExisting key found for AWS IAM user: ' + site +
-            '-Admin' + '\n')
-        prompt = Fore.GREEN + 'Skip or Rotate (S/R)? ' + Fore.RESET
-        while True:
-            reply = str(input(prompt)).lower()
-            if reply[:1] == 'r':
-                pub_key_id = response['SSHPublicKeys'][0]['SSHPublicKeyId']
-                print('\nRemoving existing public key for IAM user',
-                    site + '-Admin...')
-                iam.delete_ssh_public_key(
-                    UserName=site + '-Admin',
-                    SSHPublicKeyId=pub_key_id
-                )
-
-                print('\nRemoving existing private key from ssh-agent...')
-                subprocess.run(
-                    '[[ $(ssh-add -l | grep \' '+ site_key + ' \') ]] \
-                        && ssh-add -d ' + site_key,
-                    shell=True
-                )
-
-                if os.path.isfile(site_key):
-                    print('\nRemoving existing private key:', site_key + '...')
-                    os.remove(site_key)
-
-                if os.path.isfile(home + '.ssh/config.d/' + site):
-                    print('\nRemoving existing SSH config for AWS CodeCommit '
-                        'host...')
-                    os.remove(home + '.ssh/config.d/' + site)
-
-                if repo_base in open(home + '.ssh/known_hosts').read():
-                    print('\nRemoving AWS CodeCommit host from ' + home +
-                        '.ssh/known_hosts...\n')
-                    subprocess.run('ssh-keygen -R ' + repo_base, shell=True)
-                break
-            elif reply[:1] == 's':
-                break
-            else:
-                print(Fore.RED + '\nInvalid... only S or R!\n')
-
-    response = iam.list_ssh_public_keys(UserName=site + '-Admin')
-    if len(response['SSHPublicKeys']) == 0:
-        key_pass = getpass.getpass('\nEnter passphrase for new private key: ')
-        print('\nGenerating new private key:', site_key + '...\n')
-        subprocess.run(
-            'ssh-keygen -t rsa -b 2048 -f ' + site_key + ' -C ' + site_key + \
-                ' -P ' + key_pass,
-            shell=True
-        )
+    # IAM users and their current keys, looked up concurrently
+    def lookup(site):
+        user = resolver.outputs(site).get('AdminUser', site + '-Admin')
+        keys = iam.list_ssh_public_keys(UserName=user)['SSHPublicKeys']
+        return user, [k['SSHPublicKeyId'] for k in keys]
 
-        if sys.platform.startswith('darwin'):
-            print('\nAdding new private key to ssh-agent & OSX keychain...')
-            subprocess.run('/usr/bin/ssh-add -K ' + site_key, shell=True)
-        elif sys.platform.startswith('linux'):
-            print('\nAdding new private key to ssh-agent...')
-            subprocess.run('ssh-add' + site_key, shell=True)
-
-        print('\nSetting file mode on private key to 400...')
-        os.chmod(site_key, 0o400)
-
-        print('\nUploading new public key for IAM user', site + '-Admin...')
-        with open(site_key + '.pub') as config:
-            key = (config.read()
-        )
+    found = task_graph.run(
+        {site: (partial(lookup, site), []) for site in sites},
+        workers=min(len(sites), 16)
+    )
+
+    todo = {}  # site => (user, ids of the keys replaced)
+    for site in sites:
+        if found[site]['status'] != 'ok':
+            print(Fore.RED + '\n' + site + ' => ' +
+                str(found[site]['error']) + Fore.RESET)
+            continue
+        user, old_ids = found[site]['result']
+        if old_ids:
+            print(Fore.YELLOW + '\nExisting key found for AWS IAM user: ' +
+                user + '\n')
+            if rotate is None:
+                prompt = Fore.GREEN + 'Skip or Rotate (S/R)? ' + Fore.RESET
+                while True:
+                    reply = str(input(prompt)).lower()
+                    if reply[:1] in ('r', 's'):
+                        break
+                    print(Fore.RED + '\nInvalid... only S or R!\n')
+                if reply[:1] == 's':
+                    continue
+            elif not rotate:
+                continue
+        todo[site] = (user, old_ids)
+
+    if not todo:
+        return {}
+
+    key_pass = getpass.getpass('\nEnter passphrase for new private key' +
+        ('s' if len(todo) > 1 else '') + ': ')
+    include_config_d(home)
+    expires = time.monotonic() + deadline
+
+    print('\nRotating keys for: ' + ', '.join(todo) + '...\n')
+    results = task_graph.run(
+        {
+            site: (partial(rotate_key, iam, home, site, user, old_ids,
+                key_pass, expires), [])
+            for site, (user, old_ids) in todo.items()
+        },
+        workers=min(len(todo), 16)
+    )
+
+    print(Fore.WHITE + '\nKey Rotation:' + Fore.RESET)
+    rotated = {}
+    for site, result in results.items():
+        if result['status'] == 'ok':
+            key_id, ready = result['result']
+            rotated[site] = key_id
+            print(site + Fore.GREEN + ' \u2714 ' + Fore.RESET + key_id +
+                ' (accepted after {:.1f}s)'.format(ready))
+        else:
+            print(site + Fore.RED + ' \u2718 ' + str(result['error']) +
+                Fore.RESET)
+
+    return rotated
+
+def rotate_key(iam, home, site, user, old_ids, key_pass, expires):
+    site_key = home + '.ssh/' + site + '-Key'
+    new_key = site_key + '.new'
+    for path in (new_key, new_key + '.pub'):
+        if os.path.isfile(path):
+            os.remove(path)
+
+    stack_watch.echo('Generating new private key: ' + site_key)
+    spans.run(['ssh-keygen', '-q', '-t', 'rsa', '-b', '2048', '-f', new_key,
+        '-C', site_key, '-N', key_pass], check=True)
+
+    with open(new_key + '.pub') as f:
         response = iam.upload_ssh_public_key(
-            UserName=site + '-Admin',
-            SSHPublicKeyBody=key
+            UserName=user,
+            SSHPublicKeyBody=f.read()
         )
+    pub_key_id = response['SSHPublicKey']['SSHPublicKeyId']
+    uploaded = time.monotonic()
 
-        # Traverse dict inside dict to extract public key id
-        pub_key_id = response['SSHPublicKey']['SSHPublicKeyId']
+    try:
+        if key_pass:
+            agent_add(new_key, key_pass)
+        wait_ready(site, new_key, pub_key_id, expires)
+    except Exception:
+        # withdraw the new key; the old one keeps working
+        iam.delete_ssh_public_key(UserName=user, SSHPublicKeyId=pub_key_id)
+        if key_pass:
+            spans.run(['ssh-add', '-d', new_key], stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL)
+        for path in (new_key, new_key + '.pub'):
+            os.remove(path)
+        raise
+    ready = time.monotonic() - uploaded
 
-        # Check for/make extra SSH config directory; octal mode permission syntax
-        if not os.path.isdir(home + '.ssh/config.d/'):
-            os.mkdir(home + '.ssh/config.d/', 0o700)
+    for key_id in old_ids:
+        iam.delete_ssh_public_key(UserName=user, SSHPublicKeyId=key_id)
+    if os.path.isfile(site_key):
+        spans.run(['ssh-add', '-d', site_key], stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+    os.replace(new_key, site_key)
+    os.replace(new_key + '.pub', site_key + '.pub')
+    os.chmod(site_key, 0o400)
 
-            # Prepend an include directive to default SSH config
-            with open(home + '.ssh/config', 'r+') as config:
-                first_line = config.readline()
-                if first_line != 'Include config.d/*\n':
-                    lines = config.readlines()
-                    config.seek(0)
-                    config.write('Include config.d/*\n')
-                    config.write(first_line)
-                    config.writelines(lines)
+    config = home + '.ssh/config.d/' + site
+    with open(config, 'w') as f:
+        f.writelines(ssh_config(site, pub_key_id, site_key))
+    os.chmod(config, 0o600)
 
-        print('\nAdding AWS public key ID to SSH config for git access to AWS '
-            'CodeCommit repo...')
+    stack_watch.echo(Fore.GREEN + site + ': key ' + pub_key_id + ' active' +
+        Fore.RESET)
+    return pub_key_id, ready
+
+def wait_ready(site, key, pub_key_id, expires):
+    """Probes CodeCommit with a non-interactive SSH login using key until it
+    authenticates, backing off exponentially with full jitter; raises once
+    the deadline (a time.monotonic() value) passes. The probe ignores
+    ~/.ssh/config, whose CodeCommit entry still names the old key.
+    """
+    attempt = 0
+    while True:
+        probe = spans.run(
+            ['ssh', '-T', '-F', '/dev/null', '-l', pub_key_id,
+                '-o', 'IdentityFile=' + key,
+                '-o', 'BatchMode=yes',
+                '-o', 'IdentitiesOnly=yes',
+                '-o', 'StrictHostKeyChecking=accept-new',
+                '-o', 'ConnectTimeout=10',
+                REPO_BASE],
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            universal_newlines=True
+        )
+        output = probe.stdout + probe.stderr
+        if 'successfully authenticated' in output:
+            return
 
-        with open(home + '.ssh/config.d/' + site, "w") as config:
-            txt_lines = [
+        attempt += 1
+        delay = random.uniform(0, min(PROBE_CAP, PROBE_BASE * 2 ** attempt))
+        if time.monotonic() + delay > expires:
+            last = output.strip().splitlines()[-1:]
+            raise RuntimeError('key not accepted by CodeCommit in time' +
+                (': ' + last[0] if last else ''))
+        with spans.span('backoff ' + site, 'wait'):
+            time.sleep(delay)
+
+def agent_add(key, key_pass):
+    # ssh-add reads the passphrase through an askpass helper, not the
+    # terminal, so concurrent rotations don't each prompt for it
+    fd, askpass = tempfile.mkstemp(prefix='askpass-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write('#!/bin/sh\nprintf \'%s\\n\' "$SITE_KEY_PASS"\n')
+        os.chmod(askpass, stat.S_IRWXU)
+        cmd = ['ssh-add', key]
+        if sys.platform.startswith('darwin'):
+            cmd = ['/usr/bin/ssh-add', '-K', key]  # and OSX keychain
+        spans.run(cmd, check=True, stdin=subprocess.DEVNULL,
+            start_new_session=True, env=dict(os.environ,
+                SSH_ASKPASS=askpass,
+                SSH_ASKPASS_REQUIRE='force',
+                DISPLAY=os.environ.get('DISPLAY', ':0'),
+                SITE_KEY_PASS=key_pass
+            ))
+    finally:
+        os.remove(askpass)
+
+def ssh_host(site):
+    # the first site keeps the plain CodeCommit host; others get an alias
+    # (their git remotes use it) so each uses its own key
+    if site == 'Static-Site':
+        return REPO_BASE
+    return site + '.codecommit'
+
+def ssh_config(site, pub_key_id, site_key):
+    if site == 'Static-Site':
+        return [
             'Host git-codecommit.*.amazonaws.com',
             '\n   User ' + pub_key_id,
             '\n   IdentityFile ' + site_key
-            ]
-            config.writelines(txt_lines)
-
-        print('\nSetting file mode on new SSH config to 600...')
-        os.chmod(site_key, 0o600)
+        ]
+    return [
+        'Host ' + ssh_host(site),
+        '\n   HostName ' + REPO_BASE,
+        '\n   User ' + pub_key_id,
+        '\n   IdentityFile ' + site_key,
+        '\n   IdentitiesOnly yes'
+    ]
 
-        print(Fore.YELLOW + '\nPadding 10 seconds for any '
-            'AWS latency...' + Fore.RESET)
-        time.sleep( 10 )
+def include_config_d(home):
+    # Check for/make extra SSH config directory; octal mode permission syntax
+    if not os.path.isdir(home + '.ssh/config.d/'):
+        os.makedirs(home + '.ssh/config.d/', 0o700)
 
-        print('\nAdding AWS CodeCommit host to known_hosts and testing SSH '
-            'config...\n')
-        subprocess.run(
-            'ssh -o StrictHostKeyChecking=no -tt ' + repo_base,
-            shell=True
-        )
+    # Prepend an include directive to default SSH config
+    with open(home + '.ssh/config', 'a+') as config:
+        config.seek(0)
+        first_line = config.readline()
+        if first_line != 'Include config.d/*\n':
+            lines = config.readlines()
+            config.seek(0)
+            config.truncate()
+            config.write('Include config.d/*\n')
+            config.write(first_line)
+            config.writelines(lines)
 
 if __name__ == '__main__':
-    main()
+    # key_gen.py [--rotate] [site ...]
+    args = [a for a in sys.argv[1:] if a != '--rotate']
+    main(args or ('Static-Site',), True if '--rotate' in sys.argv else None)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+# include 3rd party modules
+import boto3
+from botocore.exceptions import ClientError
+
+# include custom modules
+import spans
+
+REGION = 'us-east-1'    # stacks live here for ACM/CloudFront compatibility
+TTL = 900               # seconds lookups are trusted for
+CACHE = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'static-site', 'resolver.json'
+)
+
+lock = threading.Lock()
+local = threading.local()   # boto3 sessions aren't thread-safe; one each
+
+def session():
+    """Returns this thread's boto3 session; callers run lookups from
+    worker threads, where boto3's shared default session isn't safe.
+    """
+    if not hasattr(local, 'session'):
+        local.session = boto3.session.Session()
+        spans.instrument(local.session)  # traced like the default session
+    return local.session
+
+def account():
+    """Returns the AWS account id of the current credentials, cached per
+    access key (stored hashed) so sts isn't called on every run.
+    """
+    credentials = session().get_credentials()
+    access_key = credentials.access_key if credentials else 'none'
+    key = hashlib.sha256(access_key.encode()).hexdigest()[:16]
+    return cached('accounts', key, lambda: session().client('sts')
+        .get_caller_identity()['Account'])
+
+def describe(stack, region=REGION, fresh=False):
+    """Returns {'id', 'status', 'outputs'} of a stack, or None when it
+    doesn't exist, cached per account, region and stack. fresh forces a
+    lookup (and refreshes the cache).
+    """
+    def lookup():
+        cf = session().client('cloudformation', region_name=region)
+        try:
+            found = cf.describe_stacks(StackName=stack)['Stacks'][0]
+        except ClientError as e:
+            if e.response['Error']['Message'].endswith('does not exist'):
+                return None
+            raise
+        return {
+            'id': found['StackId'],
+            'status': found['StackStatus'],
+            'outputs': {
+                o['OutputKey']: o['OutputValue']
+                for o in found.get('Outputs', [])
+            }
+        }
+
+    return cached('stacks', stack_key(stack, region), lookup, fresh,
+        # a stack mid-operation is about to change; don't keep it
+        keep=lambda v: not v['status'].endswith('_IN_PROGRESS'))
+
+def outputs(stack, region=REGION):
+    found = describe(stack, region)
+    return found['outputs'] if found else {}
+
+def distribution_id(stack, domain, region=REGION):
+    """Returns the site's CloudFront distribution id from the site stack's
+    outputs; stacks deployed before the output existed fall back to
+    searching the account's distributions for the domain alias.
+    """
+    distro = outputs(stack, region).get('SiteDistroId')
+    if distro:
+        return distro
+
+    def lookup():
+        cloudfront = session().client('cloudfront')
+        paginator = cloudfront.get_paginator('list_distributions')
+        for page in paginator.paginate():
+            for item in page['DistributionList'].get('Items', []):
+                if domain in item['Aliases'].get('Items', []):
+                    return item['Id']
+
+    return cached('distributions', account() + '/' + domain, lookup)
+
+def invalidate(stack, region=REGION):
+    """Drops the cached lookups of a stack, e.g. after it was updated."""
+    key = stack_key(stack, region)
+    with lock:
+        cache = load()
+        cache.get('stacks', {}).pop(key, None)
+        save(cache)
+
+def deployed(stack, region=REGION):
+    """Returns {'id', 'hash'} of the template and parameters last deployed
+    to a stack from here, or None. Unlike lookups, these don't expire.
+    """
+    key = stack_key(stack, region)
+    with lock:
+        return load().get('deployed', {}).get(key)
+
+def record_deploy(stack, stack_id, digest, region=REGION):
+    key = stack_key(stack, region)
+    with lock:
+        cache = load()
+        cache.setdefault('deployed', {})[key] = {'id': stack_id, 'hash': digest}
+        save(cache)
+
+def stack_key(stack, region):
+    return account() + '/' + region + '/' + stack
+
+def cached(section, key, lookup, fresh=False, ttl=TTL, keep=None):
+    if not fresh:
+        with lock:
+            entry = load().get(section, {}).get(key)
+        if entry and entry['expires'] > time.time():
+            return entry['value']
+
+    value = lookup()
+    with lock:
+        cache = load()
+        if value is not None and (keep is None or keep(value)):
+            cache.setdefault(section, {})[key] = {
+                'value': value,
+                'expires': time.time() + ttl
+            }
+        else:
+            cache.get(section, {}).pop(key, None)
+        save(cache)
+    return value
+
+def load():
+    try:
+        with open(CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save(cache):
+    os.makedirs(os.path.dirname(CACHE), mode=0o700, exist_ok=True)
+    tmp = CACHE + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp, CACHE)
+
+if __name__ == '__main__':
+    # resolver.py [--clear] [stack ...]
+    if '--clear' in sys.argv:
+        with lock:
+            save({})
+    for stack in [a for a in sys.argv[1:] if a != '--clear']:
+        print(stack, json.dumps(describe(stack, fresh=True), indent=2))
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import contextlib
+import functools
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import weakref
+
+# include 3rd party modules
+from colorama import init, Fore
+
+TRACES = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'static-site', 'traces'
+)
+TOP = 15    # slowest spans shown in the summary
+
+lock = threading.Lock()
+local = threading.local()   # per thread: stack of open span ids
+ids = itertools.count(1)
+recording = []              # finished spans of the active trace
+active = [None]             # root span id while a trace is active
+instrumented = weakref.WeakSet()    # sessions with hooks registered
+
+def trace(name):
+    """Decorator for an entry point (install, key rotation, ...). The
+    outermost one records every span opened while it runs, then prints a
+    summary of the slowest spans and writes a Chrome trace (open it in
+    chrome://tracing or ui.perfetto.dev); nested ones are plain spans.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if active[0] is not None:
+                with span(name, 'step'):
+                    return fn(*args, **kwargs)
+
+            instrument()
+            del recording[:]
+            active[0] = 0  # recording; the root span gets its id below
+            try:
+                with span(name, 'step') as root:
+                    active[0] = root['id']
+                    return fn(*args, **kwargs)
+            finally:
+                active[0] = None
+                summary()
+                print('\nTrace written to ' + export(name))
+        return wrapper
+    return decorate
+
+@contextlib.contextmanager
+def span(name, cat='step', parent=None, **attrs):
+    """Times a block as a span of the active trace, nested under the span
+    open in this thread (or parent, a span id from another thread). The
+    yielded dict takes extra attributes; its outcome is 'ok' or the
+    exception raised. Without an active trace, does nothing.
+    """
+    if active[0] is None:
+        yield {}
+        return
+
+    stack = getattr(local, 'stack', None)
+    if stack is None:
+        stack = local.stack = []
+    record = {
+        'id': next(ids),
+        'parent': parent or (stack[-1] if stack else active[0] or None),
+        'name': name,
+        'cat': cat,
+        'tid': threading.get_ident(),
+        'thread': threading.current_thread().name,
+        'start': time.perf_counter(),
+        'outcome': 'ok',
+        'attrs': attrs
+    }
+    stack.append(record['id'])
+    try:
+        yield record
+    except SystemExit as e:
+        if e.code:
+            record['outcome'] = 'exit ' + str(e.code)
+        raise
+    except BaseException as e:
+        record['outcome'] = type(e).__name__ + ': ' + str(e)
+        raise
+    finally:
+        stack.pop()
+        record['end'] = time.perf_counter()
+        with lock:
+            recording.append(record)
+
+def current():
+    # id of the span open in this thread, to parent spans of worker threads
+    stack = getattr(local, 'stack', None)
+    return stack[-1] if stack else active[0] or None
+
+def run(cmd, **kwargs):
+    """subprocess.run in a span, recording its exit status."""
+    with span(cmd if isinstance(cmd, str) else ' '.join(cmd),
+        'subprocess') as record:
+        result = subprocess.run(cmd, **kwargs)
+        record.setdefault('attrs', {})['returncode'] = result.returncode
+        if result.returncode:
+            record['outcome'] = 'exit ' + str(result.returncode)
+        return result
+
+def check_output(cmd, **kwargs):
+    with span(cmd if isinstance(cmd, str) else ' '.join(cmd), 'subprocess'):
+        return subprocess.check_output(cmd, **kwargs)
+
+def instrument(session=None):
+    """Records every AWS API call made through clients of session (boto3's
+    default session) as an 'aws' span with its HTTP status and retries.
+
+    Clients copy their session's event hooks when created, so this has to
+    run before the clients to be traced are created; trace() calls it, and
+    code making its own sessions (resolver.session) calls it on them.
+    """
+    import boto3
+    if session is None:
+        if boto3.DEFAULT_SESSION is None:
+            boto3.setup_default_session()
+        session = boto3.DEFAULT_SESSION
+    if session in instrumented:
+        return
+    instrumented.add(session)
+
+    def before(model, context, **kwargs):
+        if active[0] is None:
+            return
+        opened = span(model.service_model.service_name + '.' + model.name,
+            'aws')
+        context['span'] = (opened, opened.__enter__())
+
+    def after(model, context, parsed=None, http_response=None,
+        exception=None, **kwargs):
+        if 'span' not in context:
+            return
+        opened, record = context.pop('span')
+        metadata = (parsed or {}).get('ResponseMetadata', {})
+        if exception is not None:
+            metadata = getattr(exception, 'response', {}).get(
+                'ResponseMetadata', {})
+            record['outcome'] = type(exception).__name__ + ': ' + \
+                str(exception)
+        record['attrs']['retries'] = metadata.get('RetryAttempts', 0)
+        if http_response is not None:
+            record['attrs']['status'] = http_response.status_code
+            if http_response.status_code >= 400:
+                record['outcome'] = (parsed or {}).get('Error', {}).get(
+                    'Code', str(http_response.status_code))
+        opened.__exit__(None, None, None)
+
+    session.events.register('before-call', before)
+    session.events.register('after-call', after)
+    session.events.register('after-call-error', after)
+
+def summary(top=TOP):
+    """Prints the slowest spans and time spent per category."""
+    spans = [s for s in recording if s['parent'] is not None]
+    if not spans:
+        return
+
+    print(Fore.WHITE + '\nSlowest Steps:' + Fore.RESET)
+    for s in sorted(spans, key=lambda s: s['start'] - s['end'])[:top]:
+        retries = s['attrs'].get('retries')
+        print('{:>8.1f}s  {:<11}'.format(s['end'] - s['start'], s['cat']) +
+            s['name'][:80] +
+            (' ({} retries)'.format(retries) if retries else '') +
+            ('' if s['outcome'] == 'ok' else
+                Fore.RED + ' \u2718 ' + s['outcome'][:80] + Fore.RESET))
+
+    print(Fore.WHITE + '\nBy Category:' + Fore.RESET)
+    categories = {}
+    for s in spans:
+        total = categories.setdefault(s['cat'], [0, 0.0, 0])
+        total[0] += 1
+        total[1] += s['end'] - s['start']
+        total[2] += s['attrs'].get('retries', 0)
+    for cat, (count, seconds, retries) in sorted(categories.items(),
+        key=lambda c: -c[1][1]):
+        print('{:>8.1f}s  {:<11}{} spans'.format(seconds, cat, count) +
+            (', {} retries'.format(retries) if retries else ''))
+
+def export(name, path=None):
+    """Writes the recorded spans as Chrome trace events; returns the path."""
+    path = path or os.path.join(TRACES,
+        name + '-' + time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    pid = os.getpid()
+    origin = min((s['start'] for s in recording), default=0)
+    events = []
+    threads = {}
+    for s in sorted(recording, key=lambda s: s['start']):
+        threads.setdefault(s['tid'], s['thread'])
+        events.append({
+            'name': s['name'],
+            'cat': s['cat'],
+            'ph': 'X',
+            'ts': round((s['start'] - origin) * 1e6),
+            'dur': round((s['end'] - s['start']) * 1e6),
+            'pid': pid,
+            'tid': s['tid'],
+            'args': dict(s['attrs'], outcome=s['outcome'], id=s['id'],
+                parent=s['parent'])
+        })
+    for tid, thread in threads.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+            'tid': tid, 'args': {'name': thread}})
+
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    return path
+
+if __name__ == '__main__':
+    # spans.py trace.json: summary of an exported trace
+    if len(sys.argv) != 2:
+        print('Usage: spans.py trace.json')
+        sys.exit(1)
+    with open(sys.argv[1]) as f:
+        for event in json.load(f)['traceEvents']:
+            if event['ph'] == 'X':
+                recording.append({
+                    'name': event['name'],
+                    'cat': event['cat'],
+                    'start': event['ts'] / 1e6,
+                    'end': (event['ts'] + event['dur']) / 1e6,
+                    'parent': event['args'].get('parent'),
+                    'outcome': event['args'].get('outcome', 'ok'),
+                    'attrs': event['args']
+                })
+    summary()
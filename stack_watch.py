@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import threading
+import time
+
+# include 3rd party modules
+from colorama import init, Fore
+
+# stack-level states after which CloudFormation won't emit further events
+TERMINAL_STATES = (
+    'CREATE_COMPLETE',
+    'CREATE_FAILED',
+    'DELETE_COMPLETE',
+    'DELETE_FAILED',
+    'ROLLBACK_COMPLETE',
+    'ROLLBACK_FAILED',
+    'UPDATE_COMPLETE',
+    'UPDATE_ROLLBACK_COMPLETE',
+    'UPDATE_ROLLBACK_FAILED'
+)
+SUCCESS_STATES = ('CREATE_COMPLETE', 'DELETE_COMPLETE', 'UPDATE_COMPLETE')
+
+print_lock = threading.Lock()  # keeps lines from concurrent stacks whole
+
+def echo(*args):
+    with print_lock:
+        print(*args)
+
+def last_event_id(cf, stack):
+    """Returns the id of the newest event of an existing stack, so a watch
+    started afterwards only streams events of the new operation.
+    """
+    events = cf.describe_stack_events(StackName=stack)['StackEvents']
+    if events:
+        return events[0]['EventId']
+
+def new_events(cf, stack_id, seen, marker):
+    # events are returned newest first; page back until already seen ones
+    events = []
+    kwargs = {'StackName': stack_id}
+    while True:
+        response = cf.describe_stack_events(**kwargs)
+        for event in response['StackEvents']:
+            if event['EventId'] in seen or event['EventId'] == marker:
+                return list(reversed(events))
+            events.append(event)
+        if 'NextToken' not in response:
+            return list(reversed(events))
+        kwargs['NextToken'] = response['NextToken']
+
+def watch_stack(cf, stack_id, stack, marker=None, poll=2, max_poll=10):
+    """Streams CloudFormation events of a stack operation as they happen and
+    returns as soon as the stack reaches a terminal state.
+
+    Polls describe_stack_events, backing off from poll to max_poll seconds
+    while nothing changes, and times each resource from its first
+    IN_PROGRESS event to its COMPLETE/FAILED event. stack_id should be the
+    stack ARN, so a deleted stack can still be watched to the end.
+
+    Returns a tuple of (final stack state, {logical id: seconds}).
+    """
+    seen = set()
+    started = {}
+    durations = {}
+    final = None
+    delay = poll
+
+    while final is None:
+        events = new_events(cf, stack_id, seen, marker)
+        for event in events:
+            seen.add(event['EventId'])
+            logical_id = event['LogicalResourceId']
+            status = event['ResourceStatus']
+            stamp = event['Timestamp']
+
+            if status.endswith('_IN_PROGRESS'):
+                started.setdefault(logical_id, stamp)
+                continue
+
+            took = ''
+            if logical_id in started:
+                durations[logical_id] = \
+                    (stamp - started.pop(logical_id)).total_seconds()
+                took = ' ({:.0f}s)'.format(durations[logical_id])
+
+            color = Fore.RED if 'FAILED' in status or 'ROLLBACK' in status \
+                else Fore.GREEN
+            line = '[' + stack + '] ' + logical_id + ' ' + \
+                event['ResourceType'] + ' ' + color + status + Fore.RESET + \
+                took
+            if 'FAILED' in status and event.get('ResourceStatusReason'):
+                line += Fore.YELLOW + ' => ' + \
+                    event['ResourceStatusReason'] + Fore.RESET
+            echo(line)
+
+            if event['ResourceType'] == 'AWS::CloudFormation::Stack' and \
+                logical_id == stack and status in TERMINAL_STATES:
+                final = status
+
+        if final is None:
+            delay = poll if events else min(delay * 1.5, max_poll)
+            time.sleep(delay)
+
+    return final, durations
+
+def print_durations(stack, durations, top=5):
+    # slowest resources first; the stack itself is reported separately
+    slowest = sorted(
+        ((s, r) for r, s in durations.items() if r != stack), reverse=True
+    )[:top]
+    if slowest:
+        echo(Fore.WHITE + '\nSlowest resources in ' + stack + ':' +
+            Fore.RESET + ''.join('\n  {:>6.0f}s  {}'.format(s, r)
+            for s, r in slowest))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# include standard modules
+import concurrent.futures
+import time
+
+# include custom modules
+import spans
+
+def run(tasks, workers=4, fail_fast=False):
+    """Runs a graph of tasks on a thread pool; each task starts as soon as
+    every task it depends on has finished successfully.
+
+    tasks is a dict of name => (callable, [dependency names]). A task fails
+    by raising; tasks downstream of a failure are skipped, and with fail_fast
+    no new task is started once any task has failed.
+
+    Returns a dict of name => {'status', 'result', 'error', 'seconds'}, with
+    status being one of 'ok', 'failed' or 'skipped'.
+    """
+    for name, (fn, deps) in tasks.items():
+        for dep in deps:
+            if dep not in tasks:
+                raise ValueError('Task ' + name + ' depends on unknown task: '
+                    + dep)
+
+    results = {}
+    pending = dict(tasks)
+    running = {}
+    failed = False
+    parent = spans.current()  # task spans nest under the caller's span
+
+    def timed(name, fn):
+        start = time.monotonic()
+        try:
+            with spans.span(name, 'task', parent):
+                return fn(), None, time.monotonic() - start
+        except Exception as e:
+            return None, e, time.monotonic() - start
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for name, (fn, deps) in list(pending.items()):
+                if any(results.get(d, {}).get('status') in
+                    ('failed', 'skipped') for d in deps) or \
+                    (failed and fail_fast):
+                    results[name] = {'status': 'skipped', 'result': None,
+                        'error': None, 'seconds': 0.0}
+                    del pending[name]
+                elif all(results.get(d, {}).get('status') == 'ok'
+                    for d in deps):
+                    running[pool.submit(timed, name, fn)] = name
+                    del pending[name]
+
+            if not running:
+                if pending:
+                    # nothing runnable and nothing running: dependency cycle
+                    raise ValueError('Dependency cycle between tasks: ' +
+                        ', '.join(sorted(pending)))
+                break
+
+            done, _ = concurrent.futures.wait(running,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                result, error, seconds = future.result()
+                results[name] = {
+                    'status': 'failed' if error else 'ok',
+                    'result': result,
+                    'error': error,
+                    'seconds': seconds
+                }
+                if error:
+                    failed = True
+
+    return results
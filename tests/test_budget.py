@@ -0,0 +1,70 @@
+# include standard modules
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'build', 'build'))
+
+# include custom modules
+import budget
+
+PAGE = '''<!DOCTYPE html>
+<html><head>
+<link rel="stylesheet" href="https://example.com/css/main.1a2b3c4d5e.css">
+<script src="https://example.com/js/big.1a2b3c4d5e.js"></script>
+<script src="https://cdn.example.net/lib.js"></script>
+</head><body><p>Hello</p></body></html>
+'''
+
+class TestCanonifiedUrls(unittest.TestCase):
+    """canonifyurls = true makes every asset link https://<domain>/..."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        site = self.tmp.name
+        self.public = os.path.join(site, 'public')
+        for d in ('css', 'js'):
+            os.makedirs(os.path.join(self.public, d))
+        os.makedirs(os.path.join(site, 'build'))
+        with open(os.path.join(site, 'config.toml'), 'w') as f:
+            f.write('baseURL = "https://example.com"\ncanonifyurls = true\n')
+        with open(os.path.join(self.public, 'index.html'), 'w') as f:
+            f.write(PAGE)
+        with open(os.path.join(self.public, 'css',
+            'main.1a2b3c4d5e.css'), 'w') as f:
+            f.write('body { color: #333; }\n')
+        with open(os.path.join(self.public, 'js', 'big.1a2b3c4d5e.js'),
+            'wb') as f:
+            f.write(os.urandom(400 * 1024))   # incompressible, over 170KB
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_resolve_same_host(self):
+        hosts = {'example.com', 'www.example.com'}
+        self.assertEqual(budget.resolve('index.html',
+            'https://example.com/js/app.js', hosts), 'js/app.js')
+        self.assertEqual(budget.resolve('post/index.html',
+            'http://WWW.example.com/about/', hosts), 'about/index.html')
+        self.assertEqual(budget.resolve('index.html',
+            '//example.com/css/a.css', hosts), 'css/a.css')
+        self.assertEqual(budget.resolve('index.html',
+            'https://cdn.example.net/lib.js', hosts),
+            'https://cdn.example.net/lib.js')
+
+    def test_site_hosts(self):
+        self.assertEqual(budget.site_hosts(os.path.join(self.tmp.name,
+            'config.toml')), {'example.com', 'www.example.com'})
+
+    def test_canonified_assets_are_weighed(self):
+        report = os.path.join(self.tmp.name, 'report.json')
+        self.assertFalse(budget.main(self.public, workers=1,
+            report_path=report))
+        # the same links taken as external aren't weighed at all
+        self.assertTrue(budget.main(self.public, workers=1,
+            report_path=report, hosts=()))
+
+if __name__ == '__main__':
+    unittest.main()
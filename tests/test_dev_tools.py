@@ -0,0 +1,86 @@
+# include standard modules
+import getopt
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+BIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))), 'build', 'bin')
+sys.path.insert(0, BIN)
+
+# include custom modules
+import dev_tools
+
+# the options site took before commands were registered, plus the ones
+# added since (-S, -e, -l); -R and -l take an argument
+SHORT = 'dsxprR:bBcokhiuP' + 'Sel:'
+LONG = ['dev', 'dev-style', 'dev-stop', 'post', 'report', 'report-range=',
+    'build', 'rebuild', 'clean', 'open', 'keypair', 'help', 'install',
+    'uninstall', 'publish'] + ['status', 'edge', 'load=', 'timings']
+
+def letters(shortOps):
+    # 'R:' => {'R:'}, so letters and their argument flags compare together
+    return {c + (':' if shortOps[i + 1:i + 2] == ':' else '')
+        for i, c in enumerate(shortOps) if c != ':'}
+
+class TestOptions(unittest.TestCase):
+
+    def test_short_options(self):
+        shortOps, longOps, byOption = dev_tools.options()
+        self.assertEqual(letters(shortOps), letters(SHORT))
+        self.assertEqual(len(shortOps), len(SHORT))
+
+    def test_long_options(self):
+        shortOps, longOps, byOption = dev_tools.options()
+        self.assertEqual(sorted(longOps), sorted(LONG))
+
+    def test_by_option(self):
+        shortOps, longOps, byOption = dev_tools.options()
+        for opt in LONG:
+            if opt != 'timings':
+                self.assertEqual(byOption['--' + opt.rstrip('=')],
+                    opt.rstrip('='))
+        self.assertEqual(byOption['-d'], 'dev')
+        self.assertEqual(byOption['-R'], 'report-range')
+        self.assertEqual(byOption['-l'], 'load')
+        self.assertEqual(byOption['-P'], 'publish')
+        self.assertEqual(len(byOption), len(LONG) - 1 + len(letters(SHORT)))
+
+    def test_arguments(self):
+        shortOps, longOps, byOption = dev_tools.options()
+        parsed, rest = getopt.getopt(['-R', '7d', '-l', 'synthetic', '-b'],
+            shortOps, longOps)
+        self.assertEqual(parsed, [('-R', '7d'), ('-l', 'synthetic'),
+            ('-b', '')])
+        parsed, rest = getopt.getopt(['--report-range=2018-06',
+            '--load', '7d', '--timings'], shortOps, longOps)
+        self.assertEqual(parsed, [('--report-range', '2018-06'),
+            ('--load', '7d'), ('--timings', '')])
+
+# runs "site -h" in a fresh interpreter and reports what it cost to start
+STARTUP = '''
+import json, sys
+sys.path.insert(0, sys.argv[1])
+sys.argv = ['dev_tools.py', '-h']
+import dev_tools
+dev_tools.main()
+print(json.dumps({
+    'boto3': 'boto3' in sys.modules,
+    'overhead': sum(s for l, s in dev_tools.timings
+        if not l.startswith('run '))
+}))
+'''
+
+class TestStartup(unittest.TestCase):
+
+    def test_light_command_startup(self):
+        run = subprocess.run([sys.executable, '-c', STARTUP, BIN],
+            capture_output=True, universal_newlines=True, check=True)
+        startup = json.loads(run.stdout.strip().splitlines()[-1])
+        self.assertFalse(startup['boto3'], 'site -h imported boto3')
+        self.assertLess(startup['overhead'], dev_tools.IMPORT_BUDGET)
+
+if __name__ == '__main__':
+    unittest.main()